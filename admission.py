@@ -0,0 +1,229 @@
+"""
+Admission control and backpressure in front of the model-backed endpoints
+
+Requests wait in bounded per-lane queues for one of a fixed number of run
+slots. Lanes are served in priority order, and each lane has its own
+concurrency cap so heavy work cannot take every slot. When a lane's queue is
+full the request is rejected immediately (429); when it cannot be admitted
+within the lane's max wait it is rejected with 503. Both carry a Retry-After.
+
+Threads (Flask) wait on a Condition; coroutines (ASGI) queue in the same
+lanes but wait on an asyncio.Event, so a queued connection holds no thread
+and a cancelled one (client disconnect) simply leaves the queue.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from config import ADMISSION_CONTROL
+from utils.metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_RUNNING, ADMISSION_REJECTED, ADMISSION_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, lane, reason, status, retry_after):
+        super().__init__(f"{lane} lane saturated ({reason})")
+        self.lane = lane
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Priority lanes with bounded queues sharing a fixed number of run slots"""
+
+    def __init__(self, max_concurrent, lanes):
+        self.max_concurrent = max_concurrent
+        self.lanes = lanes
+        self._cond = threading.Condition()
+        self._queues = {name: deque() for name in lanes}
+        self._running = {name: 0 for name in lanes}
+        self._total_running = 0
+        self._tickets = itertools.count()
+        self._service_time = {name: 1.0 for name in lanes}  # EWMA, seconds
+        self._by_priority = sorted(lanes, key=lambda name: lanes[name]["priority"])
+        self._async_waiters = {}  # ticket -> (event loop, asyncio.Event) of a queued coroutine
+
+    def _eligible(self, lane):
+        return self._running[lane] < self.lanes[lane]["max_concurrent"]
+
+    def _can_run(self, lane, ticket):
+        if self._total_running >= self.max_concurrent or not self._eligible(lane):
+            return False
+        if self._queues[lane][0] != ticket:
+            return False
+        # Yield to any higher-priority lane that has a runnable waiter
+        for other in self._by_priority:
+            if other == lane:
+                return True
+            if self._queues[other] and self._eligible(other):
+                return False
+        return True
+
+    def _retry_after(self, lane):
+        """Rough seconds until a slot frees up for this lane"""
+        cap = min(self.max_concurrent, self.lanes[lane]["max_concurrent"])
+        waiting = len(self._queues[lane]) + 1
+        return max(1, math.ceil(self._service_time[lane] * waiting / cap))
+
+    def _reject(self, lane, reason, status):
+        retry_after = self._retry_after(lane)
+        ADMISSION_REJECTED.inc(lane=lane, reason=reason)
+        logger.warning(f"  🚦 Rejected {lane} request ({reason}), retry after {retry_after}s")
+        raise AdmissionRejected(lane, reason, status, retry_after)
+
+    def _notify(self):
+        """Wake every waiter, threads and coroutines (call with the lock held)"""
+        self._cond.notify_all()
+        for loop, wakeup in self._async_waiters.values():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _enqueue(self, lane):
+        """Join the lane's queue; returns the ticket (call with the lock held)"""
+        if len(self._queues[lane]) >= self.lanes[lane]["max_queue"]:
+            self._reject(lane, "queue_full", 429)
+        ticket = next(self._tickets)
+        self._queues[lane].append(ticket)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queues[lane]), lane=lane)
+        return ticket
+
+    def _dequeue(self, lane, ticket):
+        """Leave the lane's queue, admitted or not (call with the lock held)"""
+        self._queues[lane].remove(ticket)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queues[lane]), lane=lane)
+        # A head-of-line change may let another waiter run
+        self._notify()
+
+    def _take_slot(self, lane):
+        self._running[lane] += 1
+        self._total_running += 1
+        ADMISSION_RUNNING.set(self._running[lane], lane=lane)
+
+    def acquire(self, lane):
+        """
+        Block until a run slot in `lane` is free; raises AdmissionRejected when saturated
+
+        Returns:
+            Admission timestamp to pass to release()
+        """
+        start = time.monotonic()
+        deadline = start + self.lanes[lane]["max_wait"]
+
+        with self._cond:
+            ticket = self._enqueue(lane)
+            try:
+                while not self._can_run(lane, ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(lane, "timeout", 503)
+                    self._cond.wait(remaining)
+            finally:
+                self._dequeue(lane, ticket)
+            self._take_slot(lane)
+
+        admitted = time.monotonic()
+        ADMISSION_WAIT.observe(admitted - start, lane=lane)
+        return admitted
+
+    async def acquire_async(self, lane):
+        """
+        acquire() for coroutines: waits on the event loop instead of a thread
+
+        Cancellation while queued removes the request from its lane; the slot
+        is only taken on the loop once it is free, so nothing is left holding it.
+        """
+        start = time.monotonic()
+        deadline = start + self.lanes[lane]["max_wait"]
+        wakeup = asyncio.Event()
+
+        with self._cond:
+            ticket = self._enqueue(lane)
+            self._async_waiters[ticket] = (asyncio.get_running_loop(), wakeup)
+        try:
+            while True:
+                with self._cond:
+                    if self._can_run(lane, ticket):
+                        self._take_slot(lane)
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(lane, "timeout", 503)
+                    wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                del self._async_waiters[ticket]
+                self._dequeue(lane, ticket)
+
+        admitted = time.monotonic()
+        ADMISSION_WAIT.observe(admitted - start, lane=lane)
+        return admitted
+
+    def release(self, lane, admitted):
+        """Free the run slot taken by acquire() (may be called from another thread)"""
+        with self._cond:
+            self._running[lane] -= 1
+            self._total_running -= 1
+            ADMISSION_RUNNING.set(self._running[lane], lane=lane)
+            elapsed = time.monotonic() - admitted
+            self._service_time[lane] = 0.8 * self._service_time[lane] + 0.2 * elapsed
+            self._notify()
+
+    @contextmanager
+    def admit(self, lane):
+        """Hold a run slot in `lane` for the duration of the block"""
+        admitted = self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane, admitted)
+
+    def snapshot(self):
+        """Current queue depth and running count per lane"""
+        with self._cond:
+            return {
+                lane: {
+                    "queued": len(self._queues[lane]),
+                    "running": self._running[lane],
+                    "rejected": sum(
+                        ADMISSION_REJECTED.value(lane=lane, reason=reason) for reason in ("queue_full", "timeout")
+                    ),
+                }
+                for lane in self.lanes
+            }
+
+
+admission_controller = AdmissionController(ADMISSION_CONTROL["max_concurrent"], ADMISSION_CONTROL["lanes"])
+
+
+@contextmanager
+def admit(lane):
+    """Admit through the global controller (no-op when admission control is disabled)"""
+    if not ADMISSION_CONTROL["enabled"]:
+        yield
+        return
+    with admission_controller.admit(lane):
+        yield
+
+
+@asynccontextmanager
+async def admit_async(lane):
+    """Async variant for the ASGI app: waits for a slot on the event loop"""
+    if not ADMISSION_CONTROL["enabled"]:
+        yield
+        return
+    admitted = await admission_controller.acquire_async(lane)
+    try:
+        yield
+    finally:
+        admission_controller.release(lane, admitted)
\ No newline at end of file
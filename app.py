@@ -1,19 +1,28 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, g, Response
 import os
+import time
+from contextlib import ExitStack
 from werkzeug.utils import secure_filename
 import json
 from datetime import datetime
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Chroma
 import logging
 
 # Import local utilities
-from utils.model_loader import get_embeddings
-from utils.ocr_processor import extract_text_from_pdf
-from config import APP_CONFIG, VECTOR_DB, TEXT_SPLITTER
+from utils.ingest import ingest_pdf
+from config import APP_CONFIG, VECTOR_DB
+from utils.metrics import REQUEST_LATENCY, REQUESTS, render_metrics
+from utils.profiling import request_profiler, request_id_from
+from utils.sessions import session_store
+from utils.cascade import cascade_snapshot
+from utils.model_loader import residency_snapshot
+from utils.scheduler import scheduler, timed_query
+from utils.admission import admit, admission_controller, AdmissionRejected
+from utils.tts import stream_status, wait_for_segment
 
 # Import LangGraph flow
 from langgraph_flow.graph_build import build_graph
+from langgraph_flow.nodes import new_state
+from langgraph_flow.batch_flow import answer_batch, batch_items
 
 # Configure logging
 logging.basicConfig(
@@ -37,6 +46,28 @@ logger.info("🔄 Initializing LangGraph workflow...")
 graph = build_graph()
 logger.info("✅ LangGraph workflow ready")
 
+@app.before_request
+def start_request_timer():
+    """Assign a request id (or reuse the caller's) and start timing"""
+    g.request_id = request_id_from(request.headers.get('X-Request-ID'))
+    g.start_time = time.perf_counter()
+    g.profile = None
+    if request_profiler.active and request_profiler.should_profile(request.endpoint, request.headers, g.request_id):
+        g.profile = request_profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency per endpoint and echo the request id"""
+    endpoint = request.endpoint or 'unknown'
+    elapsed = time.perf_counter() - g.start_time
+    if g.profile is not None:
+        request_profiler.stop(g.profile, g.request_id, endpoint, elapsed, g.get('node_timings'))
+    if endpoint not in ('metrics', 'static'):
+        REQUEST_LATENCY.observe(elapsed, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
@@ -50,6 +81,18 @@ def register():
     """Business registration page for PDF uploads"""
     return render_template('register.html')
 
+def admission_rejected_response(error):
+    """Fast 429/503 with Retry-After when admission control sheds load"""
+    response = jsonify({
+        "status": "error",
+        "message": "Server is busy, please retry shortly",
+        "lane": error.lane,
+        "reason": error.reason
+    })
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.route('/upload_pdf', methods=['POST'])
 def upload_pdf():
     """Handle PDF upload, OCR processing with DeepSeek, and vector DB storage"""
@@ -68,67 +111,33 @@ def upload_pdf():
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             unique_filename = f"{company_name}_{timestamp}_{filename}"
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(filepath)
             
-            logger.info(f"📄 Processing PDF: {unique_filename}")
+            # Ingestion runs in its own low-priority lane so it cannot starve /ask;
+            # the file is saved only once admitted, so rejected uploads leave nothing behind
+            with admit("ingest"):
+                file.save(filepath)
+                logger.info(f"📄 Processing PDF: {unique_filename}")
+                result = ingest_pdf(filepath, company_name, filename, timestamp)
             
-            # Step 1: Extract text using DeepSeek OCR
-            logger.info("🔍 Extracting text with DeepSeek OCR...")
-            text = extract_text_from_pdf(filepath, use_ocr=True, hybrid=True)
-            
-            if not text or len(text.strip()) < 50:
+            if not result["chunks"]:
                 return jsonify({
                     "status": "error", 
                     "message": "Failed to extract text from PDF or content too short"
                 }), 400
             
-            logger.info(f"✅ Extracted {len(text)} characters")
-            
-            # Step 2: Split text into chunks
-            logger.info("📝 Splitting text into chunks...")
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=TEXT_SPLITTER['chunk_size'],
-                chunk_overlap=TEXT_SPLITTER['chunk_overlap'],
-                separators=TEXT_SPLITTER['separators']
-            )
-            chunks = text_splitter.split_text(text)
-            logger.info(f"✅ Created {len(chunks)} chunks")
-            
-            # Step 3: Create embeddings and store in vector DB using local model
-            logger.info("🧠 Creating embeddings with local sentence-transformers model...")
-            embeddings = get_embeddings()
-            
-            # Create or load vector store (ChromaDB)
-            vectorstore = Chroma(
-                persist_directory=VECTOR_DB['persist_directory'],
-                embedding_function=embeddings,
-                collection_name=VECTOR_DB['collection_name']
-            )
-            
-            # Add documents with metadata
-            metadatas = [
-                {
-                    "source": company_name,
-                    "filename": filename,
-                    "chunk_id": i,
-                    "timestamp": timestamp
-                } 
-                for i in range(len(chunks))
-            ]
-            
-            vectorstore.add_texts(texts=chunks, metadatas=metadatas)
-            logger.info(f"✅ Stored {len(chunks)} embeddings in ChromaDB")
-            
             return jsonify({
                 "status": "success",
                 "message": f"PDF uploaded and processed successfully for {company_name}",
                 "filename": unique_filename,
-                "chunks_created": len(chunks),
-                "text_length": len(text)
+                "chunks_created": result["chunks"],
+                "text_length": result["characters"],
+                "pages": result["pages"]
             })
         else:
             return jsonify({"status": "error", "message": "Invalid file type. Only PDF files are allowed."}), 400
             
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         logger.error(f"❌ Error processing PDF: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -139,47 +148,139 @@ def ask():
     try:
         data = request.json
         
+        # Optional multi-turn session: earlier turns condition retrieval and generation
+        session_id = str(data.get('session_id') or '')
+        history, turn = session_store.history(session_id) if session_id else ([], 0)
+        
         # Build initial state for LangGraph
-        state = {
-            "user_input": data.get('query', ''),
-            "mode_input": data.get('mode_input', 'text'),
-            "mode_output": data.get('mode_output', 'text'),
-            "email": data.get('email', ''),
-            "intent": "",
-            "retrieved_docs": [],
-            "answer": "",
-            "accuracy": False,
-            "audio_file": None,
-            "confidence_score": 0.0
-        }
+        state = new_state(
+            data.get('query', ''),
+            mode_input=data.get('mode_input', 'text'),
+            mode_output=data.get('mode_output', 'text'),
+            email=data.get('email', ''),
+            request_id=g.request_id,
+            session_id=session_id,
+            history=history,
+            turn=turn
+        )
         
-        logger.info(f"🔍 Processing query: {state['user_input'][:50]}...")
+        logger.info(f"🔍 [{g.request_id}] Processing query: {state['user_input'][:50]}...")
         
         # Run LangGraph workflow (uses local DeepSeek LLM and embeddings)
-        final_state = graph.invoke(state)
+        # Text queries get the priority lane; voice/email output is heavier
+        lane = "interactive" if state["mode_output"] == "text" else "heavy"
+        # Latency is recorded separately for queries that overlapped ingestion
+        with timed_query(), admit(lane):
+            final_state = graph.invoke(state)
+        g.node_timings = final_state.get('node_timings')
+        if session_id:
+            session_store.append(session_id, state['user_input'], final_state['answer'])
         
         logger.info(f"✅ Query processed successfully")
         logger.info(f"   Intent: {final_state.get('intent', 'unknown')}")
         logger.info(f"   Confidence: {final_state.get('confidence_score', 0):.2f}")
+        logger.info(f"   Tokens generated: {final_state.get('tokens_generated', {})}")
         
         return jsonify({
             "status": "success",
             "answer": final_state['answer'],
             "audio": final_state.get('audio_file'),
+            "audio_stream": final_state.get('audio_stream'),
             "accuracy": final_state.get('accuracy', True),
             "confidence_score": final_state.get('confidence_score', 0.0),
-            "intent": final_state.get('intent', 'general')
+            "intent": final_state.get('intent', 'general'),
+            "tokens_generated": final_state.get('tokens_generated', {}),
+            "faq": final_state.get('faq_match'),
+            "model_tiers": final_state.get('model_tiers', {}),
+            "session_id": session_id or None,
+            "request_id": g.request_id
         })
         
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         logger.error(f"❌ Error processing query: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/ask_batch', methods=['POST'])
+def ask_batch():
+    """Answer many queries at once with batched embedding, search and generation"""
+    try:
+        data = request.json or {}
+        items = batch_items(data.get('queries'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    stream = data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', '')
+    logger.info(f"📦 [{g.request_id}] Batch of {len(items)} queries (stream={bool(stream)})")
+    
+    try:
+        # Hold the admission slot until the last result is produced
+        admission = ExitStack()
+        admission.enter_context(admit("batch"))
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    
+    if stream:
+        def generate():
+            with admission:
+                try:
+                    for result in answer_batch(items):
+                        yield json.dumps(result) + "\n"
+                except Exception as e:
+                    logger.error(f"❌ Error processing batch: {e}", exc_info=True)
+                    yield json.dumps({"status": "error", "message": str(e)}) + "\n"
+        
+        response = Response(generate(), mimetype='application/x-ndjson')
+        # Also released when the server closes a response that was never iterated
+        response.call_on_close(admission.close)
+        return response
+    
+    try:
+        with admission:
+            results = sorted(answer_batch(items), key=lambda r: r["index"])
+    except Exception as e:
+        logger.error(f"❌ Error processing batch: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    
+    return jsonify({
+        "status": "success",
+        "results": results,
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "request_id": g.request_id
+    })
+
 @app.route('/audio/<filename>')
 def serve_audio(filename):
     """Serve generated TTS audio files"""
     return send_from_directory('static/audio', filename)
 
+@app.route('/audio_stream/<stream_id>')
+def audio_stream(stream_id):
+    """Progress of a voice_stream answer: sentences ready so far, total once finished"""
+    try:
+        return jsonify(stream_status(stream_id))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+
+@app.route('/audio_stream/<stream_id>/<int:index>')
+def audio_stream_segment(stream_id, index):
+    """One sentence of a voice_stream answer, served as soon as it is synthesized"""
+    try:
+        path = wait_for_segment(stream_id, index)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except TimeoutError as e:
+        return jsonify({"status": "error", "message": str(e)}), 504
+    if path is None:
+        return jsonify({"status": "error", "message": "No more segments"}), 404
+    return send_from_directory(APP_CONFIG['audio_folder'], os.path.basename(path))
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics (node latency, tokens, embedding/vector timings, retries, cache hits)"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
@@ -187,7 +288,11 @@ def health():
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(),
         "models": "local",
-        "ocr": "deepseek"
+        "ocr": "deepseek",
+        "admission": admission_controller.snapshot(),
+        "cascade": cascade_snapshot(),
+        "residency": residency_snapshot(),
+        "scheduler": scheduler.snapshot()
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,355 @@
+"""
+Async (ASGI) serving mode: same routes and templates as app.py on Quart
+
+Requests are coroutines, so idle or slow connections hold no OS thread. The
+graph runs through graph.ainvoke(); blocking model, TTS and ingestion work is
+offloaded to the dedicated executors in langgraph_flow.graph_build.
+
+Run with:
+    hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+from quart import Quart, render_template, request, jsonify, send_from_directory, g, Response
+import asyncio
+import json
+from contextlib import AsyncExitStack
+import os
+import time
+from werkzeug.utils import secure_filename
+from datetime import datetime
+import logging
+
+# Import local utilities
+from utils.ingest import ingest_pdf
+from config import APP_CONFIG, VECTOR_DB, TTS_CONFIG
+from utils.metrics import REQUEST_LATENCY, REQUESTS, render_metrics
+from utils.profiling import request_id_from
+from utils.sessions import session_store
+from utils.cascade import cascade_snapshot
+from utils.model_loader import residency_snapshot
+from utils.scheduler import scheduler, timed_query
+from utils.admission import admit_async, admission_controller, AdmissionRejected
+from utils.tts import stream_status, segment_state, segment_path
+
+# Import LangGraph flow
+from langgraph_flow.graph_build import build_async_graph, get_executor
+from langgraph_flow.nodes import new_state
+from langgraph_flow.batch_flow import answer_batch, batch_items
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.config['UPLOAD_FOLDER'] = APP_CONFIG['upload_folder']
+app.config['MAX_CONTENT_LENGTH'] = APP_CONFIG['max_upload_size']
+app.config['ALLOWED_EXTENSIONS'] = APP_CONFIG['allowed_extensions']
+
+# Create necessary folders
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(APP_CONFIG['audio_folder'], exist_ok=True)
+os.makedirs(VECTOR_DB['persist_directory'], exist_ok=True)
+
+# Initialize the async LangGraph workflow
+logger.info("🔄 Initializing async LangGraph workflow...")
+graph = build_async_graph()
+logger.info("✅ Async LangGraph workflow ready")
+
+@app.before_request
+async def start_request_timer():
+    """Assign a request id (or reuse the caller's) and start timing"""
+    g.request_id = request_id_from(request.headers.get('X-Request-ID'))
+    g.start_time = time.perf_counter()
+
+@app.after_request
+async def record_request_metrics(response):
+    """Record latency per endpoint and echo the request id"""
+    endpoint = request.endpoint or 'unknown'
+    elapsed = time.perf_counter() - g.start_time
+    if endpoint not in ('metrics', 'static'):
+        REQUEST_LATENCY.observe(elapsed, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+
+@app.route('/')
+async def index():
+    """Main user interface for queries"""
+    return await render_template('index.html')
+
+@app.route('/register')
+async def register():
+    """Business registration page for PDF uploads"""
+    return await render_template('register.html')
+
+def admission_rejected_response(error):
+    """Fast 429/503 with Retry-After when admission control sheds load"""
+    response = jsonify({
+        "status": "error",
+        "message": "Server is busy, please retry shortly",
+        "lane": error.lane,
+        "reason": error.reason
+    })
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+class ReleasingBody:
+    """
+    Streaming body that runs `release` once it is exhausted or closed
+
+    Quart closes the body when it stops sending it; unlike an async
+    generator's finally block, this also runs if it was never iterated.
+    """
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.body.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            await self.body.aclose()
+        finally:
+            await self.release()
+
+@app.route('/upload_pdf', methods=['POST'])
+async def upload_pdf():
+    """Handle PDF upload, OCR processing with DeepSeek, and vector DB storage"""
+    try:
+        files = await request.files
+        form = await request.form
+        if 'pdf' not in files:
+            return jsonify({"status": "error", "message": "No file uploaded"}), 400
+
+        file = files['pdf']
+        company_name = form.get('company_name', 'Unknown')
+
+        if file.filename == '':
+            return jsonify({"status": "error", "message": "No file selected"}), 400
+
+        if file and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            unique_filename = f"{company_name}_{timestamp}_{filename}"
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+
+            # OCR, embedding and Chroma writes all block, so ingestion runs on the IO executor;
+            # the file is saved only once admitted, so rejected uploads leave nothing behind
+            async with admit_async("ingest"):
+                await file.save(filepath)
+                logger.info(f"📄 Processing PDF: {unique_filename}")
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    get_executor("io"), ingest_pdf, filepath, company_name, filename, timestamp
+                )
+
+            if not result["chunks"]:
+                return jsonify({
+                    "status": "error",
+                    "message": "Failed to extract text from PDF or content too short"
+                }), 400
+
+            return jsonify({
+                "status": "success",
+                "message": f"PDF uploaded and processed successfully for {company_name}",
+                "filename": unique_filename,
+                "chunks_created": result["chunks"],
+                "text_length": result["characters"],
+                "pages": result["pages"]
+            })
+        else:
+            return jsonify({"status": "error", "message": "Invalid file type. Only PDF files are allowed."}), 400
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except Exception as e:
+        logger.error(f"❌ Error processing PDF: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/ask', methods=['POST'])
+async def ask():
+    """Main endpoint for user queries - drives the LangGraph flow with ainvoke"""
+    try:
+        data = await request.get_json()
+
+        # Optional multi-turn session: earlier turns condition retrieval and generation
+        session_id = str(data.get('session_id') or '')
+        history, turn = session_store.history(session_id) if session_id else ([], 0)
+
+        state = new_state(
+            data.get('query', ''),
+            mode_input=data.get('mode_input', 'text'),
+            mode_output=data.get('mode_output', 'text'),
+            email=data.get('email', ''),
+            request_id=g.request_id,
+            session_id=session_id,
+            history=history,
+            turn=turn
+        )
+
+        logger.info(f"🔍 [{g.request_id}] Processing query: {state['user_input'][:50]}...")
+
+        lane = "interactive" if state["mode_output"] == "text" else "heavy"
+        # Latency is recorded separately for queries that overlapped ingestion
+        with timed_query():
+            async with admit_async(lane):
+                final_state = await graph.ainvoke(state)
+
+        if session_id:
+            session_store.append(session_id, state['user_input'], final_state['answer'])
+
+        logger.info(f"✅ Query processed successfully")
+        logger.info(f"   Intent: {final_state.get('intent', 'unknown')}")
+        logger.info(f"   Confidence: {final_state.get('confidence_score', 0):.2f}")
+        logger.info(f"   Tokens generated: {final_state.get('tokens_generated', {})}")
+
+        return jsonify({
+            "status": "success",
+            "answer": final_state['answer'],
+            "audio": final_state.get('audio_file'),
+            "audio_stream": final_state.get('audio_stream'),
+            "accuracy": final_state.get('accuracy', True),
+            "confidence_score": final_state.get('confidence_score', 0.0),
+            "intent": final_state.get('intent', 'general'),
+            "tokens_generated": final_state.get('tokens_generated', {}),
+            "faq": final_state.get('faq_match'),
+            "model_tiers": final_state.get('model_tiers', {}),
+            "session_id": session_id or None,
+            "request_id": g.request_id
+        })
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except Exception as e:
+        logger.error(f"❌ Error processing query: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/ask_batch', methods=['POST'])
+async def ask_batch():
+    """Answer many queries at once with batched embedding, search and generation"""
+    try:
+        data = await request.get_json() or {}
+        items = batch_items(data.get('queries'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    stream = data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', '')
+    logger.info(f"📦 [{g.request_id}] Batch of {len(items)} queries (stream={bool(stream)})")
+
+    try:
+        # Hold the admission slot until the last result is produced
+        admission = AsyncExitStack()
+        await admission.enter_async_context(admit_async("batch"))
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    async def results():
+        # Each step of the blocking generator runs on the model executor
+        loop = asyncio.get_running_loop()
+        batch = answer_batch(items)
+        while True:
+            result = await loop.run_in_executor(get_executor("model"), next, batch, None)
+            if result is None:
+                return
+            yield result
+
+    if stream:
+        async def generate():
+            try:
+                async for result in results():
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                logger.error(f"❌ Error processing batch: {e}", exc_info=True)
+                yield json.dumps({"status": "error", "message": str(e)}) + "\n"
+
+        return Response(ReleasingBody(generate(), admission.aclose), mimetype='application/x-ndjson')
+
+    try:
+        async with admission:
+            collected = sorted([result async for result in results()], key=lambda r: r["index"])
+    except Exception as e:
+        logger.error(f"❌ Error processing batch: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    return jsonify({
+        "status": "success",
+        "results": collected,
+        "errors": sum(1 for r in collected if r["status"] == "error"),
+        "request_id": g.request_id
+    })
+
+@app.route('/audio/<filename>')
+async def serve_audio(filename):
+    """Serve generated TTS audio files"""
+    return await send_from_directory('static/audio', filename)
+
+@app.route('/audio_stream/<stream_id>')
+async def audio_stream(stream_id):
+    """Progress of a voice_stream answer: sentences ready so far, total once finished"""
+    try:
+        return jsonify(stream_status(stream_id))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+
+@app.route('/audio_stream/<stream_id>/<int:index>')
+async def audio_stream_segment(stream_id, index):
+    """One sentence of a voice_stream answer, served as soon as it is synthesized"""
+    # Poll without holding a thread: the sentence may still be in the TTS queue
+    deadline = time.monotonic() + TTS_CONFIG['segment_timeout']
+    try:
+        state = segment_state(stream_id, index)
+        while state == "pending":
+            if time.monotonic() > deadline:
+                return jsonify({"status": "error", "message": f"Audio segment {index} not ready"}), 504
+            await asyncio.sleep(0.02)
+            state = segment_state(stream_id, index)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    if state == "missing":
+        return jsonify({"status": "error", "message": "No more segments"}), 404
+    return await send_from_directory(APP_CONFIG['audio_folder'], os.path.basename(segment_path(stream_id, index)))
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus metrics (node latency, tokens, embedding/vector timings, retries, cache hits)"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health')
+async def health():
+    """Health check endpoint"""
+    # With MODEL_SERVER enabled this is a blocking IPC call
+    residency = await asyncio.get_running_loop().run_in_executor(get_executor("io"), residency_snapshot)
+    return jsonify({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "models": "local",
+        "ocr": "deepseek",
+        "serving": "asgi",
+        "admission": admission_controller.snapshot(),
+        "cascade": cascade_snapshot(),
+        "residency": residency,
+        "scheduler": scheduler.snapshot()
+    })
+
+if __name__ == '__main__':
+    logger.info("🚀 Starting AI Support Assistant (async mode) with Local Models")
+    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Batched version of the /ask flow for many queries at once (/ask_batch)
+
+Each stage runs over the whole batch instead of once per query: one
+embed_documents call, one vector store query with every vector, intent scoring
+for many prompts per forward pass, and answer generation in batches of
+BATCH_QUERIES['generation_batch_size']. Accuracy looping and voice/email
+output are /ask-only; batch answers are text.
+"""
+import logging
+
+from utils.model_loader import get_embeddings, generate_batch, score_continuations_batch
+from utils.metrics import EMBEDDING_LATENCY, PROMPT_TOKENS, COMPLETION_TOKENS
+from utils.vector_store import get_vectorstore, search_batch
+from utils.scheduler import scheduler
+from config import BATCH_QUERIES
+from .nodes import (
+    INTENT_LABELS,
+    INTENT_SYSTEM_PROMPT,
+    RESPONSE_SYSTEM_PROMPT,
+    intent_prompt,
+    keyword_intent,
+    response_prompt
+)
+
+logger = logging.getLogger(__name__)
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _error(item, message):
+    return {"index": item["index"], "id": item["id"], "status": "error", "message": message}
+
+def batch_items(queries):
+    """
+    Normalize the request's "queries" list (strings or {"query", "id"} objects)
+
+    Raises:
+        ValueError: if the list is missing, empty or too long
+    """
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("'queries' must be a non-empty list")
+    if len(queries) > BATCH_QUERIES['max_queries']:
+        raise ValueError(f"At most {BATCH_QUERIES['max_queries']} queries per batch")
+
+    items = []
+    for index, entry in enumerate(queries):
+        if isinstance(entry, dict):
+            items.append({"index": index, "id": entry.get("id"), "query": str(entry.get("query", ""))})
+        else:
+            items.append({"index": index, "id": None, "query": str(entry)})
+    return items
+
+def retrieve_batch(queries):
+    """Embed all queries in one call and search the vector store with every vector at once"""
+    embeddings = get_embeddings()
+    vectorstore = get_vectorstore(embeddings)
+
+    with EMBEDDING_LATENCY.time(operation="query_batch"):
+        vectors = embeddings.embed_documents(queries)
+
+    return search_batch(vectorstore, vectors, BATCH_QUERIES['retrieval_k'])
+
+def classify_batch(queries):
+    """Intent per query, scoring INTENT_LABELS for many prompts per forward pass"""
+    intents = []
+    for chunk in _chunks(queries, BATCH_QUERIES['intent_batch_size']):
+        try:
+            with scheduler.batch_unit("ask_batch"):
+                scores = score_continuations_batch(
+                    [intent_prompt(q) for q in chunk], INTENT_LABELS, INTENT_SYSTEM_PROMPT
+                )
+            intents.extend(max(s, key=s.get) for s in scores)
+        except Exception as e:
+            logger.error(f"Batch intent analysis failed: {e}")
+            intents.extend(keyword_intent(q) for q in chunk)
+    return intents
+
+def answer_batch(items):
+    """
+    Answer a list of {"index", "id", "query"} items
+
+    Yields one result dict per item as soon as its generation batch finishes;
+    items that fail get status "error" without failing the rest.
+    """
+    valid = []
+    for item in items:
+        if not item["query"].strip():
+            yield _error(item, "Empty query")
+        else:
+            valid.append(item)
+    if not valid:
+        return
+
+    queries = [item["query"] for item in valid]
+    logger.info(f"📦 Batch of {len(queries)} queries")
+
+    try:
+        retrieved = retrieve_batch(queries)
+    except Exception as e:
+        logger.error(f"Batch retrieval failed: {e}")
+        retrieved = [[] for _ in queries]
+
+    intents = classify_batch(queries)
+
+    batch_size = BATCH_QUERIES['generation_batch_size']
+    for start in range(0, len(valid), batch_size):
+        chunk = valid[start:start + batch_size]
+        docs = retrieved[start:start + batch_size]
+        prompts = [response_prompt(item["query"], d) for item, d in zip(chunk, docs)]
+        try:
+            # Batch work: each generation batch waits for in-flight /ask queries first
+            with scheduler.batch_unit("ask_batch"):
+                outputs = generate_batch(prompts, RESPONSE_SYSTEM_PROMPT, profile="response")
+        except Exception as e:
+            logger.error(f"Batch generation failed: {e}")
+            for item in chunk:
+                yield _error(item, f"Generation failed: {e}")
+            continue
+
+        for offset, (item, d, stats) in enumerate(zip(chunk, docs, outputs)):
+            PROMPT_TOKENS.observe(stats["prompt_tokens"], node="batch_response_generator")
+            COMPLETION_TOKENS.observe(stats["completion_tokens"], node="batch_response_generator")
+            yield {
+                "index": item["index"],
+                "id": item["id"],
+                "status": "success",
+                "answer": stats["text"].strip(),
+                "intent": intents[start + offset],
+                "sources": sorted({doc["metadata"].get("source", "unknown") for doc in d}),
+                "tokens_generated": stats["completion_tokens"],
+            }
\ No newline at end of file
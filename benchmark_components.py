@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Component micro-benchmarks with deterministic stub models
+Runs on a CPU box with no model downloads: the LLM and embeddings are
+replaced by utils.stub_models, while the text splitter, Chroma and PyMuPDF
+are the real libraries.
+
+Usage:
+    python benchmark_components.py --output bench.json
+    python benchmark_components.py --chroma-sizes 10000 100000 1000000
+    python benchmark_components.py --only splitter embeddings --compare bench.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from config import TEXT_SPLITTER
+
+WORDS = (
+    "device battery firmware reset button power filter warranty screen update "
+    "settings network cable charge error code display manual support replace "
+    "install connect press hold release light indicator mode speed level"
+).split()
+
+def print_section(title):
+    """Print a formatted section header"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+def make_text(n_chars, seed=0):
+    """Deterministic manual-like text with paragraphs and sentences"""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < n_chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + "."
+        parts.append(sentence)
+        size += len(sentence) + 1
+        if rng.random() < 0.15:
+            parts.append("\n\n")
+    return " ".join(parts)[:n_chars]
+
+def install_stub_models():
+    """Swap the global model manager for deterministic stubs"""
+    import utils.model_loader as model_loader
+    from utils.stub_models import StubModelManager
+    from config import MODEL_SERVER
+
+    MODEL_SERVER['enabled'] = False
+    model_loader.model_manager = StubModelManager()
+    return model_loader.model_manager
+
+def measure(fn, iterations, warmup=1, items=1):
+    """Time fn() and summarize; items is the work units per call (for throughput)"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    mean = statistics.mean(timings)
+    return {
+        "iterations": iterations,
+        "mean_s": mean,
+        "p50_s": timings[len(timings) // 2],
+        "p95_s": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_s": timings[0],
+        "items_per_call": items,
+        "items_per_s": items / mean if mean else 0.0,
+    }
+
+# ============================================
+# Benchmarks
+# ============================================
+def bench_splitter(results, sizes=(100_000, 1_000_000)):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=TEXT_SPLITTER['chunk_size'],
+        chunk_overlap=TEXT_SPLITTER['chunk_overlap'],
+        separators=TEXT_SPLITTER['separators']
+    )
+    for size in sizes:
+        text = make_text(size)
+        results[f"splitter_{size}_chars"] = measure(lambda: splitter.split_text(text), iterations=5, items=size)
+
+def bench_token_splitter(results, sizes=(100_000, 1_000_000), page_chars=3000):
+    """Streaming token splitter over pages (word counter: no tokenizer download)"""
+    from utils.splitter import StreamingTokenSplitter, WordCounter
+
+    splitter = StreamingTokenSplitter(counter=WordCounter())
+    for size in sizes:
+        text = make_text(size)
+        pages = [(i + 1, text[offset:offset + page_chars]) for i, offset in enumerate(range(0, size, page_chars))]
+        results[f"token_splitter_{size}_chars"] = measure(
+            lambda: sum(1 for _ in splitter.split_pages(iter(pages))), iterations=5, items=size
+        )
+
+def bench_embeddings(results, batch_sizes=(1, 32, 256), real=False):
+    if real:
+        from utils.model_loader import get_embeddings
+        embeddings = get_embeddings()
+    else:
+        from utils.stub_models import StubEmbeddings
+        embeddings = StubEmbeddings()
+
+    chunks = [make_text(1000, seed=i) for i in range(max(batch_sizes))]
+    for batch_size in batch_sizes:
+        batch = chunks[:batch_size]
+        results[f"embeddings_batch_{batch_size}"] = measure(
+            lambda: embeddings.embed_documents(batch), iterations=10, items=batch_size
+        )
+
+def bench_chroma(results, sizes=(10_000,), batch_size=5000, queries=50):
+    from langchain.vectorstores import Chroma
+    from utils.stub_models import StubEmbeddings
+
+    embeddings = StubEmbeddings()
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = Chroma(
+                persist_directory=tmp,
+                embedding_function=embeddings,
+                collection_name=f"bench_{size}"
+            )
+            texts = [make_text(200, seed=i) for i in range(size)]
+            metadatas = [{"source": "bench", "chunk_id": i} for i in range(size)]
+
+            start = time.perf_counter()
+            for offset in range(0, size, batch_size):
+                store.add_texts(texts=texts[offset:offset + batch_size], metadatas=metadatas[offset:offset + batch_size])
+            elapsed = time.perf_counter() - start
+            results[f"chroma_add_{size}"] = {
+                "iterations": 1, "mean_s": elapsed, "p50_s": elapsed, "p95_s": elapsed, "min_s": elapsed,
+                "items_per_call": size, "items_per_s": size / elapsed,
+            }
+
+            query_texts = itertools.cycle([make_text(60, seed=10_000_000 + i) for i in range(queries)])
+            results[f"chroma_query_{size}"] = measure(
+                lambda: store.similarity_search(next(query_texts), k=3),
+                iterations=queries
+            )
+
+def bench_prompt_construction(results):
+    install_stub_models()
+    from langgraph_flow.nodes import response_generator
+
+    docs = [
+        {"content": make_text(1000, seed=i), "metadata": {"source": "bench", "chunk_id": i}}
+        for i in range(3)
+    ]
+
+    def run():
+        state = {
+            "user_input": "How do I reset the device after a firmware update?",
+            "retrieved_docs": docs,
+            "answer": "",
+            "tokens_generated": {},
+        }
+        response_generator(state)
+
+    results["response_generator_stub_llm"] = measure(run, iterations=200)
+
+def bench_pipeline(results, chunks=1000, queries=20):
+    """Full LangGraph /ask flow with stub models over a real Chroma collection"""
+    install_stub_models()
+    from langgraph_flow.graph_build import build_graph
+    from langgraph_flow.nodes import new_state
+    from utils.vector_store import get_vectorstore
+    from config import VECTOR_DB
+
+    original_directory = VECTOR_DB['persist_directory']
+    with tempfile.TemporaryDirectory() as tmp:
+        VECTOR_DB['persist_directory'] = tmp
+        try:
+            store = get_vectorstore()
+            store.add_texts(
+                texts=[make_text(800, seed=i) for i in range(chunks)],
+                metadatas=[{"source": "bench", "chunk_id": i} for i in range(chunks)]
+            )
+
+            graph = build_graph()
+            query_texts = itertools.cycle([make_text(80, seed=20_000_000 + i) for i in range(queries)])
+
+            def run():
+                graph.invoke(new_state(next(query_texts), request_id="bench"))
+
+            results["pipeline_ask_stub_models"] = measure(run, iterations=queries)
+        finally:
+            VECTOR_DB['persist_directory'] = original_directory
+
+def bench_pymupdf(results, pages=50):
+    import fitz  # PyMuPDF
+    from utils.ocr_processor import pdf_processor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        doc = fitz.open()
+        for i in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), make_text(2500, seed=i), fontsize=9)
+        doc.save(path)
+        doc.close()
+
+        results[f"pymupdf_extract_{pages}_pages"] = measure(
+            lambda: pdf_processor._extract_with_pymupdf(path), iterations=5, items=pages
+        )
+
+BENCHMARKS = {
+    "splitter": bench_splitter,
+    "token_splitter": bench_token_splitter,
+    "embeddings": bench_embeddings,
+    "chroma": bench_chroma,
+    "prompt": bench_prompt_construction,
+    "pipeline": bench_pipeline,
+    "pymupdf": bench_pymupdf,
+}
+
+# ============================================
+# Reporting
+# ============================================
+def print_results(results):
+    print(f"{'benchmark':40} {'mean':>10} {'p95':>10} {'items/s':>12}")
+    for name, r in results.items():
+        print(f"{name:40} {r['mean_s'] * 1000:8.2f}ms {r['p95_s'] * 1000:8.2f}ms {r['items_per_s']:12.1f}")
+
+def compare(results, baseline_path):
+    """Print the relative change of mean time against a previous run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    print_section(f"📊 Comparison with {baseline_path}")
+    for name, r in results.items():
+        if name not in baseline:
+            print(f"{name:40} (new)")
+            continue
+        old = baseline[name]["mean_s"]
+        change = (r["mean_s"] - old) / old * 100 if old else 0.0
+        marker = "⚠️ " if change > 10 else "  "
+        print(f"{marker}{name:38} {old * 1000:8.2f}ms -> {r['mean_s'] * 1000:8.2f}ms ({change:+.1f}%)")
+
+def run_benchmarks(only=None, chroma_sizes=(10_000,), real_embeddings=False):
+    """Run the selected benchmarks and return {name: result}"""
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        print_section(f"⏱️  {name}")
+        kwargs = {}
+        if name == "chroma":
+            kwargs["sizes"] = chroma_sizes
+        elif name == "embeddings":
+            kwargs["real"] = real_embeddings
+        try:
+            bench(results, **kwargs)
+            print("✅ done")
+        except ImportError as e:
+            print(f"⚠️  Skipped (missing dependency: {e.name})")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Component micro-benchmarks with stub models")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--chroma-sizes", nargs="+", type=int, default=[10_000], help="Chunk counts for Chroma")
+    parser.add_argument("--real-embeddings", action="store_true", help="Use the configured embedding model")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    # Node INFO logging would dominate the stub timings
+    logging.disable(logging.INFO)
+
+    results = run_benchmarks(args.only, args.chroma_sizes, args.real_embeddings)
+
+    print_section("📊 Results")
+    print_results(results)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+        print(f"\n📄 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+"""
+Bulk ingestion of a directory of PDFs
+
+Runs the /upload_pdf ingestion steps as a multi-process pipeline with bounded
+queues between the stages, so OCR of one manual overlaps with embedding and
+storing of the previous ones:
+
+    extract  PDFProcessor (PyMuPDF, OCR for scanned PDFs)  -> pages
+    split    StreamingTokenSplitter                        -> chunk batches
+    embed    embedding model                               -> vectors
+    write    configured vector store (this process)
+
+Chunks get the same metadata as uploads (utils.ingest.chunk_metadatas) and are
+written through get_vectorstore(), so the app reads them like any uploaded
+manual. Progress is checkpointed after every stored batch: rerun the same
+command to resume; finished documents and stored batches are skipped.
+Throughput and utilization per stage are printed at the end.
+
+Each extract and embed worker loads its own models. With OCR or embeddings on
+the GPU, keep those worker counts low or start the model server
+(MODEL_SERVER_ENABLED=true) so all workers share one copy.
+
+Usage:
+    python bulk_ingest.py manuals/ --company Acme
+    python bulk_ingest.py manuals/ --company Acme --extract-workers 4 --embed-workers 2
+    FAKE_MODELS=true python bulk_ingest.py manuals/ --company Acme --output bulk.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from benchmark_components import print_section
+from config import TEXT_SPLITTER, FAQ_PRECOMPUTE
+
+# Workers log warnings only; progress is printed by the writer
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+CHECKPOINT_NAME = ".bulk_ingest_checkpoint.json"
+
+class StageTimer:
+    """Items handled and time spent working (not waiting on queues) by one worker"""
+
+    def __init__(self, stage, unit):
+        self.stage = stage
+        self.unit = unit
+        self.items = 0
+        self.busy_s = 0.0
+
+    @contextmanager
+    def work(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy_s += time.perf_counter() - start
+
+    def as_dict(self):
+        return {"stage": self.stage, "unit": self.unit, "items": self.items, "busy_s": self.busy_s}
+
+def add_range(ranges, start, end):
+    """Merge [start, end) into a sorted list of disjoint [start, end) ranges"""
+    merged = []
+    for s, e in sorted(ranges + [[start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+def in_ranges(ranges, i):
+    return any(s <= i < e for s, e in ranges)
+
+class Checkpoint:
+    """Per-document progress (stored chunk ranges), rewritten atomically after every batch"""
+
+    def __init__(self, path, company_name):
+        self.path = path
+        self.company_name = company_name
+        self.documents = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved["company_name"] != company_name:
+                raise SystemExit(
+                    f"{path} belongs to company '{saved['company_name']}'; pass --checkpoint to use another file"
+                )
+            self.documents = saved["documents"]
+
+    def entry(self, key, path):
+        """Progress for one document, started over if the file changed since it was recorded"""
+        stat = os.stat(path)
+        fingerprint = [stat.st_size, int(stat.st_mtime)]
+        entry = self.documents.get(key)
+        if entry is not None and entry["fingerprint"] != fingerprint:
+            print(f"⚠️  {key} changed since the last run; ingesting it again")
+            entry = None
+        if entry is None:
+            entry = self.documents[key] = {
+                "fingerprint": fingerprint,
+                "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+                "stored": [],
+                "done": False,
+            }
+        return entry
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"company_name": self.company_name, "documents": self.documents}, f, indent=1)
+        os.replace(tmp, self.path)
+
+def find_pdfs(directory):
+    """Relative paths of every PDF under directory, in a stable order"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                found.append(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/"))
+    return found
+
+def _finish_stage(remaining, queues, sentinels=1):
+    """Called by every worker of a stage on exit; the last one closes the next stage's queues"""
+    with remaining.get_lock():
+        remaining.value -= 1
+        last = remaining.value == 0
+    if last:
+        for q in queues:
+            for _ in range(sentinels):
+                q.put(None)
+
+def extract_worker(tasks, split_queues, stats, remaining):
+    """PDF -> ("page", doc, (page_number, text)) ... ("end", doc, error)"""
+    from utils.ocr_processor import iter_pdf_pages
+
+    timer = StageTimer("extract", "pages")
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        outbox = split_queues[job["doc"] % len(split_queues)]
+        error = None
+        try:
+            pages = iter_pdf_pages(job["path"], use_ocr=True, hybrid=True)
+            while True:
+                with timer.work():
+                    page = next(pages, None)
+                if page is None:
+                    break
+                timer.items += 1
+                outbox.put(("page", job["doc"], page))
+        except Exception as e:
+            error = f"Extraction failed: {e}"
+        outbox.put(("end", job["doc"], error))
+
+    stats.put(timer.as_dict())
+    _finish_stage(remaining["extract"], split_queues)
+
+def split_worker(inbox, chunk_queue, jobs, batch_size, stats, remaining, embed_workers):
+    """Pages of a document -> ("batch", doc, first_chunk_id, texts, metadatas) ... ("done", doc, summary)"""
+    from utils.ingest import chunk_metadatas, MIN_TEXT_LENGTH
+    from utils.splitter import StreamingTokenSplitter
+
+    splitter = StreamingTokenSplitter()
+    timer = StageTimer("split", "chunks")
+    pages = {}  # doc -> [(page_number, text)] until its extraction ends
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        kind, doc, payload = message
+        if kind == "page":
+            pages.setdefault(doc, []).append(payload)
+            continue
+
+        job = jobs[doc]
+        doc_pages = pages.pop(doc, [])
+        if payload is not None:
+            chunk_queue.put(("done", doc, {"error": payload}))
+            continue
+
+        # Deterministic, so a resumed run produces the same chunk ids
+        with timer.work():
+            chunks = list(splitter.split_pages(doc_pages))
+        if sum(len(chunk["text"]) for chunk in chunks) < MIN_TEXT_LENGTH:
+            chunks = []  # Same rule as ingest_pdf: treated as a failed extraction
+        timer.items += len(chunks)
+
+        def send(batch):
+            first = batch[0][0]
+            batch_chunks = [chunk for _, chunk in batch]
+            metadatas = chunk_metadatas(batch_chunks, job["company_name"], job["filename"], job["timestamp"], first)
+            chunk_queue.put(("batch", doc, first, [chunk["text"] for chunk in batch_chunks], metadatas))
+
+        batch = []
+        for i, chunk in enumerate(chunks):
+            if in_ranges(job["stored"], i):
+                continue
+            if batch and (len(batch) >= batch_size or batch[-1][0] != i - 1):
+                send(batch)
+                batch = []
+            batch.append((i, chunk))
+        if batch:
+            send(batch)
+
+        chunk_queue.put(("done", doc, {
+            "pages": len(doc_pages),
+            "characters": sum(len(text) for _, text in doc_pages),
+            "chunks": len(chunks),
+        }))
+
+    stats.put(timer.as_dict())
+    _finish_stage(remaining["split"], [chunk_queue], sentinels=embed_workers)
+
+def embed_worker(inbox, vector_queue, stats, remaining):
+    """Chunk batches -> the same batches with their vectors"""
+    from utils.model_loader import get_embeddings
+
+    embeddings = get_embeddings()
+    timer = StageTimer("embed", "chunks")
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        if message[0] == "batch":
+            with timer.work():
+                vectors = embeddings.embed_documents(message[3])
+            timer.items += len(vectors)
+            message = message + (vectors,)
+        vector_queue.put(message)
+
+    stats.put(timer.as_dict())
+    _finish_stage(remaining["embed"], [vector_queue])
+
+class PrecomputedEmbeddings:
+    """Embedding function for the writer: hands add_texts the vectors from the embed stage"""
+
+    def __init__(self):
+        self.vectors = None
+
+    def embed_documents(self, texts):
+        vectors, self.vectors = self.vectors, None
+        if vectors is None or len(vectors) != len(texts):
+            raise RuntimeError("No precomputed vectors for this batch")
+        return vectors
+
+    def embed_query(self, text):
+        raise RuntimeError("The bulk ingest writer does not search")
+
+class Writer:
+    """Stores embedded batches, updates the checkpoint and queues FAQ generation per document"""
+
+    def __init__(self, checkpoint, jobs, faq):
+        from utils.vector_store import get_vectorstore
+
+        self.checkpoint = checkpoint
+        self.jobs = jobs
+        self.embeddings = PrecomputedEmbeddings()
+        self.store = get_vectorstore(self.embeddings)
+        self.timer = StageTimer("write", "chunks")
+        self.faq = faq
+        self.spools = {}
+        self.faq_runs = []
+        self.summaries = {}  # doc -> "done" summary, until all its chunks are stored
+        self.finished = {"ingested": 0, "failed": 0, "empty": 0}
+
+    def handle(self, message):
+        kind, doc = message[0], message[1]
+        job = self.jobs[doc]
+        entry = self.checkpoint.documents[job["key"]]
+        if kind == "batch":
+            _, _, first, texts, metadatas, vectors = message
+            self.embeddings.vectors = vectors
+            with self.timer.work():
+                # Deterministic ids: a batch stored just before a crash is upserted again, not duplicated
+                ids = [f"{job['key']}:{job['timestamp']}:{first + i}" for i in range(len(texts))]
+                self.store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+                entry["stored"] = add_range(entry["stored"], first, first + len(texts))
+                self.checkpoint.save()
+            self.timer.items += len(texts)
+            if self.faq:
+                if doc not in self.spools:
+                    from utils.faq import FaqSpool
+                    self.spools[doc] = FaqSpool(job["company_name"])
+                self.spools[doc].write(texts, metadatas)
+        else:
+            self.summaries[doc] = message[2]
+        self._maybe_finish(doc, entry)
+
+    def _maybe_finish(self, doc, entry):
+        summary = self.summaries.get(doc)
+        if summary is None:
+            return
+        key = self.jobs[doc]["key"]
+        if "error" in summary:
+            entry["error"] = summary["error"]
+            self.finished["failed"] += 1
+            print(f"❌ {key}: {summary['error']}")
+        elif entry["stored"] != ([[0, summary["chunks"]]] if summary["chunks"] else []):
+            return  # Batches still in the embed stage
+        else:
+            entry.update(done=True, pages=summary["pages"], chunks=summary["chunks"])
+            entry.pop("error", None)
+            if summary["chunks"]:
+                self.finished["ingested"] += 1
+                print(f"✅ {key}: {summary['pages']} pages, {summary['chunks']} chunks")
+            else:
+                self.finished["empty"] += 1
+                print(f"⚠️  {key}: no text extracted (or too short)")
+        del self.summaries[doc]
+        self.checkpoint.save()
+        self._close_spool(doc)
+
+    def _close_spool(self, doc):
+        spool = self.spools.pop(doc, None)
+        if spool is None:
+            return
+        from utils.faq import schedule_faq
+        spool.close()
+        if spool.count:
+            self.faq_runs.append(schedule_faq(spool))
+        else:
+            spool.discard()
+
+def run_pipeline(args, checkpoint, jobs):
+    """Start the stages, write everything they produce and return per-worker stats"""
+    ctx = mp.get_context("spawn")  # No forked copies of torch/CUDA state
+    tasks = ctx.Queue()
+    split_queues = [ctx.Queue(maxsize=args.queue_size) for _ in range(args.split_workers)]
+    chunk_queue = ctx.Queue(maxsize=args.queue_size)
+    vector_queue = ctx.Queue(maxsize=args.queue_size)
+    stats = ctx.Queue()
+    remaining = {
+        "extract": ctx.Value("i", args.extract_workers),
+        "split": ctx.Value("i", args.split_workers),
+        "embed": ctx.Value("i", args.embed_workers),
+    }
+
+    for job in jobs.values():
+        tasks.put(job)
+    for _ in range(args.extract_workers):
+        tasks.put(None)
+
+    processes = [
+        ctx.Process(target=extract_worker, args=(tasks, split_queues, stats, remaining), name=f"extract-{i}")
+        for i in range(args.extract_workers)
+    ] + [
+        ctx.Process(
+            target=split_worker,
+            args=(inbox, chunk_queue, jobs, args.batch_size, stats, remaining, args.embed_workers),
+            name=f"split-{i}"
+        )
+        for i, inbox in enumerate(split_queues)
+    ] + [
+        ctx.Process(target=embed_worker, args=(chunk_queue, vector_queue, stats, remaining), name=f"embed-{i}")
+        for i in range(args.embed_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    writer = Writer(checkpoint, jobs, faq=FAQ_PRECOMPUTE['enabled'] and not args.no_faq)
+    try:
+        while True:
+            try:
+                message = vector_queue.get(timeout=1.0)
+            except queue.Empty:
+                crashed = [p for p in processes if p.exitcode not in (None, 0)]
+                if crashed:
+                    raise RuntimeError(f"Worker {crashed[0].name} exited with code {crashed[0].exitcode}")
+                continue
+            if message is None:
+                break
+            writer.handle(message)
+
+        worker_stats = [stats.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join()
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        checkpoint.save()
+        for doc in list(writer.spools):
+            writer._close_spool(doc)
+
+    if writer.faq_runs:
+        print(f"\n⏳ Waiting for FAQ generation ({len(writer.faq_runs)} documents)...")
+        for run in writer.faq_runs:
+            run.result()
+
+    return worker_stats + [writer.timer.as_dict()], writer.finished
+
+def stage_report(worker_stats, wall_time, args):
+    """Throughput and utilization per stage; the most utilized stage is the bottleneck"""
+    workers = {"extract": args.extract_workers, "split": args.split_workers, "embed": args.embed_workers, "write": 1}
+    report = {}
+    for stage, count in workers.items():
+        rows = [s for s in worker_stats if s["stage"] == stage]
+        items = sum(s["items"] for s in rows)
+        busy = sum(s["busy_s"] for s in rows)
+        report[stage] = {
+            "workers": count,
+            "unit": rows[0]["unit"] if rows else "",
+            "items": items,
+            "busy_s": round(busy, 2),
+            "throughput_per_s": round(items / wall_time, 2) if wall_time else 0.0,
+            "per_worker_busy_per_s": round(items / busy, 2) if busy else None,
+            "utilization": round(busy / (count * wall_time), 3) if wall_time else 0.0,
+        }
+    return report
+
+def print_stage_report(report, wall_time):
+    print_section("📊 Bulk Ingestion Throughput")
+    print(f"Wall time: {wall_time:.1f}s")
+    print(f"\n{'stage':8} {'workers':>7} {'items':>8} {'unit':7} {'busy':>9} {'items/s':>9} {'per worker':>11} {'util':>6}")
+    for stage, s in report.items():
+        per_worker = f"{s['per_worker_busy_per_s']:10.1f}/s" if s['per_worker_busy_per_s'] is not None else f"{'-':>12}"
+        print(f"{stage:8} {s['workers']:7} {s['items']:8} {s['unit']:7} {s['busy_s']:8.1f}s "
+              f"{s['throughput_per_s']:9.1f} {per_worker} {s['utilization']:6.0%}")
+    bottleneck = max(report, key=lambda stage: report[stage]["utilization"])
+    hint = "one writer; try a larger --batch-size" if bottleneck == "write" else f"add --{bottleneck}-workers first"
+    print(f"\nBottleneck: {bottleneck} ({hint})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a directory of PDFs into the vector store")
+    parser.add_argument("directory", help="Directory to search for PDFs (recursively)")
+    parser.add_argument("--company", required=True, help="Company name stored with every chunk (as in /upload_pdf)")
+    parser.add_argument("--extract-workers", type=int, default=2, help="Extraction/OCR processes")
+    parser.add_argument("--split-workers", type=int, default=1, help="Splitter processes")
+    parser.add_argument("--embed-workers", type=int, default=1, help="Embedding processes")
+    parser.add_argument("--batch-size", type=int, default=TEXT_SPLITTER['ingest_batch_size'], help="Chunks per stored batch")
+    parser.add_argument("--queue-size", type=int, default=8, help="Messages each stage may queue ahead of the next")
+    parser.add_argument("--checkpoint", help=f"Progress file (default: <directory>/{CHECKPOINT_NAME})")
+    parser.add_argument("--no-faq", action="store_true", help="Skip FAQ precomputation even if FAQ_PRECOMPUTE is on")
+    parser.add_argument("--output", help="Write the stage report as JSON to this path")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        raise SystemExit(f"Not a directory: {args.directory}")
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.directory, CHECKPOINT_NAME), args.company)
+
+    jobs = {}
+    skipped = 0
+    for doc, key in enumerate(find_pdfs(args.directory)):
+        path = os.path.abspath(os.path.join(args.directory, key))
+        entry = checkpoint.entry(key, path)
+        if entry["done"]:
+            skipped += 1
+            continue
+        jobs[doc] = {
+            "doc": doc,
+            "key": key,
+            "path": path,
+            "filename": os.path.basename(key),
+            "company_name": args.company,
+            "timestamp": entry["timestamp"],
+            "stored": entry["stored"],
+        }
+    checkpoint.save()
+
+    print_section("📚 Bulk Ingestion")
+    print(f"{len(jobs)} PDFs to ingest for {args.company} ({skipped} already done per {checkpoint.path})")
+    print(f"Workers: extract={args.extract_workers} split={args.split_workers} embed={args.embed_workers} write=1")
+    if not jobs:
+        return
+
+    start = time.perf_counter()
+    try:
+        worker_stats, finished = run_pipeline(args, checkpoint, jobs)
+    except KeyboardInterrupt:
+        print(f"\n⏸️  Interrupted; progress saved to {checkpoint.path}. Run the same command to resume.")
+        sys.exit(130)
+    wall_time = time.perf_counter() - start
+
+    report = stage_report(worker_stats, wall_time, args)
+    print_stage_report(report, wall_time)
+    print(f"\nDocuments: {finished['ingested']} ingested, {finished['empty']} without text, {finished['failed']} failed")
+    if finished["failed"]:
+        print("Failed documents are retried on the next run.")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"wall_time_s": wall_time, "config": vars(args), "documents": finished, "stages": report}, f, indent=2)
+        print(f"\n📄 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
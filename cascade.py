@@ -0,0 +1,124 @@
+"""
+Small/large model cascade (MODEL_CASCADE)
+
+Model-calling nodes go through score() and generate() here instead of the
+LLM helpers. Per node, a routing rule picks the small model, the large model,
+or a cascade: the small model (MODELS['llm_small']) answers first and the call
+is escalated to the large model when the small model is unsure (a low label
+probability or mean token log-probability) or, for answers, when retrieval
+found no clearly relevant chunk. Calls, escalations and latency are recorded
+per node and tier; cascade_snapshot() summarizes them for /health.
+"""
+import logging
+import math
+import time
+from config import MODEL_CASCADE
+from utils.model_loader import score_continuations, generate_with_stats
+from utils.metrics import CASCADE_CALLS, CASCADE_ESCALATIONS, CASCADE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_REASONS = ("confidence", "retrieval")
+
+
+def node_rule(node):
+    """Routing rule for a node ({"tier": "large"} when the cascade is off)"""
+    if not MODEL_CASCADE['enabled']:
+        return {"tier": "large"}
+    return MODEL_CASCADE['nodes'].get(node, {"tier": "large"})
+
+
+def label_probabilities(scores):
+    """Renormalize candidate scores (mean token log-probabilities) over the closed candidate set"""
+    top = max(scores.values())
+    weights = {c: math.exp(lp - top) for c, lp in scores.items()}
+    total = sum(weights.values())
+    return {c: w / total for c, w in weights.items()}
+
+
+def _call(node, tier, call):
+    start = time.perf_counter()
+    try:
+        return call()
+    finally:
+        CASCADE_LATENCY.observe(time.perf_counter() - start, node=node, tier=tier)
+        CASCADE_CALLS.inc(node=node, tier=tier)
+
+
+def _escalate(node, reason, detail):
+    CASCADE_ESCALATIONS.inc(node=node, reason=reason)
+    logger.info(f"  ⬆️  Escalating {node} to the large model ({detail})")
+
+
+def score(node, prompt, candidates, system_prompt=None):
+    """
+    Candidate log-probabilities from the node's tier
+
+    Returns:
+        (scores, tier) where tier is the model that produced the scores
+    """
+    rule = node_rule(node)
+    if rule["tier"] != "large":
+        scores = _call(node, "small", lambda: score_continuations(prompt, candidates, system_prompt, tier="small"))
+        best = max(label_probabilities(scores).values())
+        if rule["tier"] == "small" or best >= rule.get("min_probability", 0.0):
+            return scores, "small"
+        _escalate(node, "confidence", f"best label p={best:.2f}")
+    return _call(node, "large", lambda: score_continuations(prompt, candidates, system_prompt)), "large"
+
+
+def generate(node, prompt, system_prompt=None, profile="default", retrieval_score=None, intent=None):
+    """
+    generate_with_stats on the node's tier
+
+    Args:
+        retrieval_score: Cosine similarity of the best retrieved chunk, if any
+        intent: Detected intent (rule "easy_intents" may skip the retrieval check)
+
+    Returns:
+        generate_with_stats dict plus "tier"
+    """
+    rule = node_rule(node)
+    tier = rule["tier"]
+    if (tier == "cascade" and retrieval_score is not None
+            and retrieval_score < rule.get("min_retrieval_score", 0.0)
+            and intent not in rule.get("easy_intents", [])):
+        _escalate(node, "retrieval", f"top chunk similarity {retrieval_score:.2f}")
+        tier = "large"
+
+    if tier != "large":
+        stats = _call(node, "small", lambda: generate_with_stats(prompt, system_prompt, profile, tier="small"))
+        confident = stats.get("mean_logprob", 0.0) >= rule.get("min_token_logprob", -math.inf)
+        if tier == "small" or (stats["completion_tokens"] and stats["text"].strip() and confident):
+            stats["tier"] = "small"
+            return stats
+        _escalate(node, "confidence", f"mean token log-prob {stats.get('mean_logprob', 0.0):.2f}")
+
+    stats = _call(node, "large", lambda: generate_with_stats(prompt, system_prompt, profile))
+    stats["tier"] = "large"
+    return stats
+
+
+def cascade_snapshot():
+    """Per-node calls, escalation rate and mean latency per tier"""
+    if not MODEL_CASCADE['enabled']:
+        return {"enabled": False}
+
+    nodes = {}
+    for node, rule in MODEL_CASCADE['nodes'].items():
+        calls = {tier: CASCADE_CALLS.value(node=node, tier=tier) for tier in ("small", "large")}
+        escalations = {reason: CASCADE_ESCALATIONS.value(node=node, reason=reason) for reason in ESCALATION_REASONS}
+        # Every cascaded call either tried the small model or was routed past it
+        routed = calls["small"] + escalations["retrieval"]
+        latency = {}
+        for tier in calls:
+            snapshot = CASCADE_LATENCY.snapshot(node=node, tier=tier)
+            latency[tier] = round(snapshot["sum"] / snapshot["count"], 4) if snapshot["count"] else None
+        nodes[node] = {
+            "tier": rule["tier"],
+            "calls": calls,
+            "escalations": escalations,
+            "escalation_rate": round(sum(escalations.values()) / routed, 4) if routed else 0.0,
+            "mean_latency_s": latency,
+        }
+    return {"enabled": True, "nodes": nodes}
\ No newline at end of file
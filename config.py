@@ -15,6 +15,17 @@ MODELS = {
         "device": "cuda",  # "cuda" for GPU, "cpu" for CPU
         "load_in_8bit": True,  # Set True for lower memory usage
         "load_in_4bit": False,  # Set True for even lower memory (requires bitsandbytes)
+        "prompt_format": "deepseek",  # <|system|>/<|user|>/<|assistant|> turns, or "chat_template"
+    },
+    
+    # Small LLM for the model cascade (MODEL_CASCADE): easy calls, escalating to "llm"
+    "llm_small": {
+        "model_name": os.getenv("SMALL_LLM_MODEL", "Qwen/Qwen2.5-1.5B-Instruct"),
+        "model_path": "./models/Qwen2.5-1.5B-Instruct",
+        "device": "cuda",
+        "load_in_8bit": False,  # Small enough to run in fp16 next to the 8-bit 7B model
+        "load_in_4bit": False,
+        "prompt_format": "chat_template",  # The tokenizer's own template (Qwen: <|im_start|>/<|im_end|>)
     },
     
     # Embedding Model for RAG
@@ -23,6 +34,16 @@ MODELS = {
         # Alternative: "BAAI/bge-small-en-v1.5" for better quality
         "model_path": "./models/all-MiniLM-L6-v2",
         "device": "cuda",
+        "max_seq_length": 256,  # Tokens per input (longer input is truncated); ingestion chunks fit in this
+        # "pytorch" (HuggingFaceEmbeddings, fp32) or "onnx" (onnxruntime, CPU)
+        "backend": os.getenv("EMBEDDINGS_BACKEND", "pytorch"),
+        "onnx": {
+            "export_dir": "./models/all-MiniLM-L6-v2-onnx",  # exported on first use
+            "quantize": True,  # Dynamic int8 quantization of the exported model
+            "intra_op_threads": int(os.getenv("ONNX_INTRA_OP_THREADS", str(os.cpu_count() or 1))),
+            "batch_size": 32,
+            "max_seq_length": 256,  # Same as sentence-transformers all-MiniLM-L6-v2
+        },
     },
     
     # DeepSeek OCR / GOT-OCR2.0
@@ -34,18 +55,109 @@ MODELS = {
     }
 }
 
+# Query embedding micro-batching (utils/embedding_dispatcher.py): embed_query calls from
+# concurrent requests within max_wait_ms are embedded in one forward pass
+EMBEDDING_BATCHING = {
+    "enabled": os.getenv("EMBEDDING_BATCHING_ENABLED", "true").lower() == "true",
+    "max_batch": int(os.getenv("EMBEDDING_MAX_BATCH", "32")),
+    "max_wait_ms": float(os.getenv("EMBEDDING_MAX_WAIT_MS", "2")),  # Added to a lone query's latency
+}
+
+# Fake Models (deterministic stubs for load tests; no downloads or GPU needed)
+FAKE_MODELS = {
+    "enabled": os.getenv("FAKE_MODELS", "false").lower() == "true",
+    "prefill_latency": float(os.getenv("FAKE_PREFILL_LATENCY", "0.0")),  # seconds per prompt token
+    "decode_latency": float(os.getenv("FAKE_DECODE_LATENCY", "0.0")),  # seconds per generated token
+    "embed_latency": float(os.getenv("FAKE_EMBED_LATENCY", "0.0")),  # seconds per embedded text
+    "small_latency_factor": float(os.getenv("FAKE_SMALL_LATENCY_FACTOR", "0.25")),  # small tier vs. the above
+    "tts_latency": float(os.getenv("FAKE_TTS_LATENCY", "0.0")),  # seconds per synthesized character
+}
+
+# Model Cascade: the small LLM handles a node's call and escalates to the large one
+# when it is unsure. Per node, "tier" is "small", "large" or "cascade".
+MODEL_CASCADE = {
+    "enabled": os.getenv("MODEL_CASCADE_ENABLED", "false").lower() == "true",
+    "nodes": {
+        # Label scoring: escalate when the best label's probability (over the label set) is low
+        "intent_analyzer": {"tier": "cascade", "min_probability": 0.6},
+        "accuracy_evaluator": {"tier": "cascade", "min_probability": 0.8, "min_token_logprob": -0.7},
+        # Answers: start small only with one clearly relevant chunk (or an easy intent),
+        # escalate when the small model's mean token log-probability is low
+        "response_generator": {
+            "tier": "cascade",
+            "min_retrieval_score": float(os.getenv("CASCADE_MIN_RETRIEVAL_SCORE", "0.6")),
+            "min_token_logprob": float(os.getenv("CASCADE_MIN_TOKEN_LOGPROB", "-0.9")),
+            "easy_intents": ["general"],
+        },
+    },
+}
+
+# Model Residency: loaded models share a memory budget; idle, unpinned models are
+# evicted (least recently used first) and reload on their next use
+MODEL_RESIDENCY = {
+    "budget_mb": int(os.getenv("MODEL_MEMORY_BUDGET_MB", "0")),  # 0 = no limit
+    "pinned": [m for m in os.getenv("MODEL_PINNED", "llm,embeddings").split(",") if m],
+    "offload": {"ocr": os.getenv("OCR_OFFLOAD", "drop")},  # "drop" or "cpu" (keep weights in host memory)
+    "idle_unload_seconds": {"ocr": int(os.getenv("OCR_IDLE_UNLOAD_SECONDS", "300"))},
+    # Planned footprint before a model's first load (measured afterwards)
+    "estimated_mb": {"llm": 7500, "llm_small": 3200, "embeddings": 100, "ocr": 1300},
+}
+
+# Query/ingestion isolation (utils/scheduler.py): graph model nodes run first,
+# ingestion and /ask_batch yield at unit boundaries (OCR page, store batch, FAQ group)
+WORK_SCHEDULER = {
+    "enabled": os.getenv("WORK_SCHEDULER_ENABLED", "true").lower() == "true",
+    # Share of model time batch work may use while queries are arriving (idle server: no cap)
+    "batch_share": float(os.getenv("INGEST_MODEL_SHARE", "0.3")),
+    "window_seconds": 10,  # Sliding window for the share
+    "max_batch_wait": 5.0,  # A batch unit never waits longer than this, so ingestion keeps progressing
+}
+
 # Vector Database Configuration
 VECTOR_DB = {
     "type": "chromadb",  # or "faiss"
     "persist_directory": "./vector_db",
     "collection_name": "product_docs",
+    # Compact vector storage (utils/vector_store.py) instead of the Chroma collection:
+    # codes in memory, exact float32 vectors memory-mapped for rescoring.
+    # int8 + pca/128 holds ~12x more chunks per worker (see vector_compression_report.py)
+    "compression": {
+        "mode": os.getenv("VECTOR_COMPRESSION", "none"),  # "none" (Chroma), "float16" or "int8"
+        "reduction": os.getenv("VECTOR_REDUCTION") or None,  # None, "pca" or "truncate" (Matryoshka-style)
+        "dims": int(os.getenv("VECTOR_DIMS", "128")),  # Dimensions kept when reducing
+        "rescore_candidates": 100,  # Approximate top-N re-ranked with the exact float32 vectors
+        "fit_min_samples": 1000,  # PCA / int8 ranges are fitted once this many chunks are stored
+    },
+}
+
+# Vector index snapshots (utils/snapshot.py): warm up new nodes without re-running OCR and embeddings
+VECTOR_SNAPSHOT = {
+    "directory": os.getenv("VECTOR_SNAPSHOT_DIR", "./snapshots"),
+    "compresslevel": 3,  # gzip level; float32 vectors barely compress, so favour speed
+}
+
+# Shared Model Server (one process holds the models, web workers connect to it)
+MODEL_SERVER = {
+    "enabled": os.getenv("MODEL_SERVER_ENABLED", "false").lower() == "true",
+    "address": os.getenv("MODEL_SERVER_ADDRESS", "/tmp/ai_support_models.sock"),  # Unix socket path
+    # Without MODEL_SERVER_AUTHKEY the server writes a random key to authkey_file (mode 0600)
+    # and clients read it from there
+    "authkey": os.getenv("MODEL_SERVER_AUTHKEY"),
+    "authkey_file": os.path.expanduser(os.getenv("MODEL_SERVER_AUTHKEY_FILE", "~/.ai_support_models.key")),
+    "connect_timeout": 30,  # Seconds to wait for the server socket to appear
+    "health_connect_timeout": 1,  # /health reports the server as down after this long
 }
 
 # Text Splitting Configuration
+# Ingestion sizes chunks in embedding-model tokens (utils/splitter.py);
+# chunk_size/chunk_overlap are the older character-based settings
 TEXT_SPLITTER = {
     "chunk_size": 1000,
     "chunk_overlap": 200,
     "separators": ["\n\n", "\n", " ", ""],
+    "chunk_tokens": None,  # None = embedding max_seq_length minus special tokens
+    "chunk_overlap_tokens": 48,
+    "ingest_batch_size": 64,  # Chunks embedded and stored per add_texts call
 }
 
 # Generation Configuration
@@ -57,11 +169,40 @@ GENERATION_CONFIG = {
     "do_sample": True,
 }
 
+# Per-call Generation Profiles (selected by each node)
+# Missing keys fall back to "default"; decoding ends as soon as a stop sequence appears.
+# The model's own turn markers are always stop sequences too (LocalModelManager.turn_stops),
+# so it never runs on into hallucinated turns
+GENERATION_PROFILES = {
+    "default": {
+        **GENERATION_CONFIG,
+        "stop": [],
+    },
+    "response": {
+        "max_new_tokens": 384,
+    },
+    "evaluator": {
+        "max_new_tokens": 6,  # Enough for "0.85"
+        "do_sample": False,  # Greedy: deterministic score
+        "repetition_penalty": 1.0,
+        "stop": ["\n"],
+    },
+    "faq_questions": {
+        "max_new_tokens": 160,  # A few one-line questions
+        "do_sample": False,
+    },
+}
+
 # TTS Configuration (using pyttsx3 - offline)
 TTS_CONFIG = {
     "engine": "pyttsx3",  # offline TTS
     "rate": 150,  # speech rate
     "volume": 1.0,  # volume (0.0 to 1.0)
+    # mode_output "voice_stream": sentences are synthesized in the background and
+    # served from /audio_stream/<id>/<n> as each one is ready
+    "stream_workers": int(os.getenv("TTS_STREAM_WORKERS", "1")),  # concurrent synthesis threads
+    "min_segment_chars": int(os.getenv("TTS_MIN_SEGMENT_CHARS", "20")),  # shorter fragments join the next sentence
+    "segment_timeout": float(os.getenv("TTS_SEGMENT_TIMEOUT", "60")),  # seconds a segment request waits
 }
 
 # Email Configuration (optional)
@@ -80,9 +221,78 @@ APP_CONFIG = {
     "audio_folder": "./static/audio",
 }
 
+# Precomputed FAQ answers (generated at ingest time, served by /ask on a close match)
+FAQ_PRECOMPUTE = {
+    "enabled": os.getenv("FAQ_PRECOMPUTE_ENABLED", "false").lower() == "true",
+    "collection_name": "product_faq",  # Question index, next to VECTOR_DB's collection
+    "questions_per_chunk": 3,
+    "match_threshold": float(os.getenv("FAQ_MATCH_THRESHOLD", "0.9")),  # Cosine similarity to a stored question
+    "spool_folder": "./uploads/faq_spool",  # Chunks waiting for background generation
+}
+
+# Multi-turn sessions (/ask with a session_id)
+SESSIONS = {
+    "max_sessions": int(os.getenv("SESSION_MAX_SESSIONS", "10000")),  # Conversation histories kept per worker (LRU)
+    "ttl_seconds": int(os.getenv("SESSION_TTL_SECONDS", "1800")),  # Idle sessions expire
+    "history_turns": 6,  # Turns replayed into the prompt when there is no cached prefix
+    "retrieval_turns": 2,  # Previous user turns added to the retrieval query
+    "kv_cache_max_mb": int(os.getenv("SESSION_KV_CACHE_MB", "1024")),  # All cached session prefixes together
+    "kv_cache_max_sessions": int(os.getenv("SESSION_KV_CACHE_SESSIONS", "64")),
+    "max_context_tokens": 3072,  # Longer transcripts restart from the recent history
+}
+
+# Batch Queries (/ask_batch)
+BATCH_QUERIES = {
+    "max_queries": int(os.getenv("BATCH_MAX_QUERIES", "500")),  # Per request
+    "retrieval_k": 3,  # Same as retriever_node
+    "generation_batch_size": int(os.getenv("BATCH_GENERATION_SIZE", "8")),  # Prompts per model.generate call
+    "intent_batch_size": 16,  # Prompts per scoring forward pass (x5 rows, one per label)
+}
+
+# Async Serving (asgi_app.py): blocking graph work runs on these thread pools
+ASYNC_SERVING = {
+    "model_workers": int(os.getenv("ASYNC_MODEL_WORKERS", "2")),  # LLM / embeddings / vector search
+    "io_workers": int(os.getenv("ASYNC_IO_WORKERS", "8")),  # TTS, email, file writes, ingestion
+}
+
+# Admission Control (bounded queues in front of the models)
+# Lower priority number = served first; each lane caps its own concurrency so
+# voice/email and ingestion can never take every slot from text queries
+ADMISSION_CONTROL = {
+    "enabled": os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true",
+    "max_concurrent": int(os.getenv("ADMISSION_MAX_CONCURRENT", "2")),  # Requests running at once
+    "lanes": {
+        "interactive": {"priority": 0, "max_queue": 32, "max_wait": 10.0, "max_concurrent": 2},  # text /ask
+        "heavy": {"priority": 1, "max_queue": 16, "max_wait": 20.0, "max_concurrent": 1},  # voice/email /ask
+        "batch": {"priority": 2, "max_queue": 4, "max_wait": 30.0, "max_concurrent": 1},  # /ask_batch
+        "ingest": {"priority": 3, "max_queue": 4, "max_wait": 60.0, "max_concurrent": 1},  # /upload_pdf
+    },
+}
+
+# Per-request Profiling (off by default; no overhead when off)
+PROFILING = {
+    "enabled": os.getenv("PROFILING_ENABLED", "false").lower() == "true",  # Profile every request (rate-capped)
+    "secret": os.getenv("PROFILING_SECRET", ""),  # Enables signed per-request profiling via header
+    "header": "X-Profile-Signature",  # hex HMAC-SHA256(secret, X-Request-ID)
+    "mode": os.getenv("PROFILING_MODE", "sampling"),  # "sampling" (.folded stacks) or "deterministic" (cProfile)
+    "sample_interval": 0.005,  # Seconds between stack samples
+    "output_dir": os.getenv("PROFILING_DIR", "./profiles"),
+    "endpoints": ["ask", "upload_pdf"],
+    "max_per_minute": 6,
+    "max_disk_mb": 200,  # Oldest profiles are deleted beyond this
+}
+
 # Accuracy Threshold
 ACCURACY_THRESHOLD = 0.7  # Minimum confidence score to accept answer
 
+# How accuracy_evaluator computes its confidence score
+ACCURACY_EVALUATION = {
+    "mode": os.getenv("ACCURACY_EVALUATION_MODE", "logprob"),  # "logprob" (one forward pass) or "generate"
+    # "yes_no": P("yes") for "is the answer supported?"
+    # "digits": probability-weighted expectation over a 0-9 rating
+    "logprob_method": "yes_no",
+}
+
 # Enable/Disable Features
 FEATURES = {
     "voice_input": True,
@@ -0,0 +1,90 @@
+"""
+Micro-batched query embedding across concurrent requests
+
+Every /ask embeds its query with embed_query, i.e. a batch-size-1 forward
+pass that leaves most of the CPU's vector width idle. EmbeddingDispatcher
+sits behind get_embeddings(): queries that arrive within
+EMBEDDING_BATCHING['max_wait_ms'] of each other are embedded with a single
+embed_documents call and the vectors are handed back to their callers.
+
+There is no background thread. The first waiting caller leads a batch: it
+waits out the window (or until max_batch queries are queued), runs the
+forward pass and wakes the others. Queries that arrive while a forward pass
+is running join the next batch. embed_documents (ingestion, /ask_batch)
+passes straight through, serialized with the batches.
+"""
+import threading
+import time
+from concurrent.futures import Future
+from utils.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT
+
+
+class EmbeddingDispatcher:
+    """
+    LangChain-compatible embeddings that coalesce concurrent embed_query calls
+
+    Args:
+        load: Returns the underlying embeddings (called per batch, so a model
+            reloaded after eviction is picked up)
+        max_batch: Most queries per forward pass
+        max_wait: Seconds the first query of a batch waits for company
+    """
+
+    def __init__(self, load, max_batch=32, max_wait=0.002):
+        self.load = load
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending = []  # (text, future, enqueued_at)
+        self._leading = False
+        self._forward_lock = threading.Lock()
+
+    def embed_query(self, text):
+        future = Future()
+        with self._cond:
+            self._pending.append((text, future, time.perf_counter()))
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+
+        while True:
+            with self._cond:
+                while self._leading and not future.done():
+                    self._cond.wait()
+                if future.done():
+                    break
+                self._leading = True
+            self._run_batch()
+        return future.result()
+
+    def _run_batch(self):
+        """Wait out the window, embed up to max_batch pending queries and wake their callers"""
+        deadline = time.perf_counter() + self.max_wait
+        with self._cond:
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+
+        try:
+            started = time.perf_counter()
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            for _, _, enqueued_at in batch:
+                EMBEDDING_BATCH_WAIT.observe(started - enqueued_at)
+            with self._forward_lock:
+                vectors = self.load().embed_documents([text for text, _, _ in batch])
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with self._cond:
+                self._leading = False
+                self._cond.notify_all()
+
+    def embed_documents(self, texts):
+        with self._forward_lock:
+            return self.load().embed_documents(texts)
\ No newline at end of file
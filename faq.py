@@ -0,0 +1,182 @@
+"""
+Ingest-time precomputed FAQ answers (doc2query-style)
+
+After a PDF is chunked, a background worker asks the LLM for the questions
+each chunk answers, generates a grounded answer for every question from that
+chunk alone, and stores the questions (with their answers in the metadata)
+in a dedicated question index. At query time /ask embeds the query once and,
+if it is close enough to a stored question, returns the stored answer without
+running retrieval or generation.
+
+Chunks are spooled to a JSONL file during ingestion so the worker does not
+keep whole documents in memory, and generation goes through the "ingest"
+admission lane so it always yields to live queries.
+"""
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import FAQ_PRECOMPUTE, BATCH_QUERIES
+from utils.model_loader import get_embeddings, generate_batch
+from utils.metrics import FAQ_LOOKUPS, FAQ_GENERATED
+from utils.admission import admit, AdmissionRejected
+from utils.scheduler import scheduler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUESTION_SYSTEM_PROMPT = """You write the questions customers ask customer support.
+Given an excerpt from a product manual, write questions that the excerpt fully answers.
+Write one question per line, with no numbering and nothing else."""
+
+ANSWER_SYSTEM_PROMPT = """You are a helpful customer support assistant.
+Answer the question using only the excerpt from the product documentation.
+Keep your answer concise, helpful, and professional.
+Do not make up information that isn't in the excerpt."""
+
+_LIST_PREFIX_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)]|Q\d*[:.)])\s*")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="faq")
+
+
+def parse_questions(text, limit):
+    """Distinct question lines from a generated list"""
+    questions = []
+    for line in text.splitlines():
+        question = _LIST_PREFIX_RE.sub("", line).strip()
+        if question.endswith("?") and len(question.split()) >= 3 and question not in questions:
+            questions.append(question)
+    return questions[:limit]
+
+
+class FaqSpool:
+    """Append-only JSONL file of chunks waiting for FAQ generation"""
+
+    def __init__(self, name):
+        os.makedirs(FAQ_PRECOMPUTE['spool_folder'], exist_ok=True)
+        self.path = os.path.join(FAQ_PRECOMPUTE['spool_folder'], f"{name}_{uuid.uuid4().hex[:8]}.jsonl")
+        self.count = 0
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, texts, metadatas):
+        for text, metadata in zip(texts, metadatas):
+            self._file.write(json.dumps({"text": text, "metadata": metadata}) + "\n")
+            self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        os.remove(self.path)
+
+
+def _read_spool(path, batch_size):
+    """Yield lists of spooled chunks, batch_size at a time"""
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _generate_when_admitted(prompts, system_prompt, profile):
+    """Batched generation in the ingest lane, waiting (not failing) while the server is busy"""
+    while True:
+        try:
+            # Each generation group is one unit of batch work: it runs between queries
+            with scheduler.batch_unit("faq"), admit("ingest"):
+                return generate_batch(prompts, system_prompt, profile=profile)
+        except AdmissionRejected as e:
+            time.sleep(e.retry_after)
+
+
+def precompute_faq(spool_path):
+    """Generate questions and grounded answers for every spooled chunk and store them"""
+    from utils.vector_store import get_vectorstore
+
+    store = get_vectorstore(collection_name=FAQ_PRECOMPUTE['collection_name'])
+    batch_size = BATCH_QUERIES['generation_batch_size']
+    limit = FAQ_PRECOMPUTE['questions_per_chunk']
+    stored = 0
+    start = time.perf_counter()
+
+    for chunks in _read_spool(spool_path, batch_size):
+        # Step 1: likely questions for each chunk
+        outputs = _generate_when_admitted(
+            [f"Excerpt:\n{chunk['text']}\n\nWrite up to {limit} questions:" for chunk in chunks],
+            QUESTION_SYSTEM_PROMPT, "faq_questions"
+        )
+        pairs = [
+            (question, chunk)
+            for chunk, output in zip(chunks, outputs)
+            for question in parse_questions(output["text"], limit)
+        ]
+
+        # Step 2: an answer to each question, grounded in its own chunk
+        for offset in range(0, len(pairs), batch_size):
+            group = pairs[offset:offset + batch_size]
+            answers = _generate_when_admitted(
+                [f"Excerpt:\n{chunk['text']}\n\nQuestion: {question}\n\nAnswer:" for question, chunk in group],
+                ANSWER_SYSTEM_PROMPT, "response"
+            )
+            store.add_texts(
+                texts=[question for question, _ in group],
+                metadatas=[
+                    {**chunk["metadata"], "answer": answer["text"].strip()}
+                    for (_, chunk), answer in zip(group, answers)
+                ]
+            )
+            stored += len(group)
+            FAQ_GENERATED.inc(len(group))
+
+    logger.info(f"✅ Precomputed {stored} FAQ answers in {time.perf_counter() - start:.1f}s")
+    return stored
+
+
+def schedule_faq(spool):
+    """Run FAQ generation for a closed spool in the background, then delete the spool"""
+    def run():
+        try:
+            with scheduler.batch_job():
+                precompute_faq(spool.path)
+        except Exception as e:
+            logger.error(f"FAQ precomputation failed for {spool.path}: {e}", exc_info=True)
+        finally:
+            os.remove(spool.path)
+
+    logger.info(f"🗂️  Queued FAQ generation for {spool.count} chunks")
+    return _executor.submit(run)
+
+
+def find_faq_answer(query):
+    """
+    Stored answer for the closest precomputed question, if similar enough
+
+    Returns:
+        Dict with question, answer, similarity and metadata, or None
+    """
+    from utils.vector_store import get_vectorstore, search_with_similarity
+
+    embeddings = get_embeddings()
+    store = get_vectorstore(embeddings, collection_name=FAQ_PRECOMPUTE['collection_name'])
+    found = search_with_similarity(store, embeddings.embed_query(query), k=1)
+    if not found or found[0][1] < FAQ_PRECOMPUTE['match_threshold']:
+        FAQ_LOOKUPS.inc(result="miss")
+        return None
+
+    doc, similarity = found[0]
+    FAQ_LOOKUPS.inc(result="hit")
+    metadata = dict(doc.metadata)
+    return {
+        "question": doc.page_content,
+        "answer": metadata.pop("answer", ""),
+        "similarity": float(similarity),
+        "metadata": metadata,
+    }
\ No newline at end of file
@@ -1,39 +1,132 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langgraph.graph import StateGraph, START, END
+from config import ASYNC_SERVING
+from utils.metrics import NODE_LATENCY
+from utils.scheduler import scheduler
 from .nodes import (
     SupportState,
     input_router,
+    faq_matcher,
     intent_analyzer,
     retriever_node,
     response_generator,
     accuracy_evaluator,
     output_router,
+    faq_route,
     check_accuracy_route
 )
 
+logger = logging.getLogger(__name__)
+
+def instrument_node(name, node):
+    """Wrap a node so its latency is recorded per request"""
+    @functools.wraps(node)
+    def timed_node(state):
+        start = time.perf_counter()
+        try:
+            if name in MODEL_NODES:
+                # Ingestion and /ask_batch yield to queries at their next unit boundary
+                with scheduler.interactive():
+                    return node(state)
+            return node(state)
+        finally:
+            elapsed = time.perf_counter() - start
+            NODE_LATENCY.observe(elapsed, node=name)
+            timings = state.setdefault("node_timings", {})
+            timings[name] = round(timings.get(name, 0.0) + elapsed, 4)
+            logger.info(f"  [{state.get('request_id', '-')}] {name} took {elapsed * 1000:.1f} ms")
+    return timed_node
+
+# Nodes that block on the models vs. on TTS/SMTP; input_router is cheap and runs inline
+MODEL_NODES = {"faq_matcher", "intent_analyzer", "retriever_node", "response_generator", "accuracy_evaluator"}
+IO_NODES = {"output_router"}
+
+_executors = {}
+
+def get_executor(kind):
+    """Dedicated thread pools for the async graph ("model" or "io"), created on first use"""
+    if kind not in _executors:
+        _executors[kind] = ThreadPoolExecutor(
+            max_workers=ASYNC_SERVING[f"{kind}_workers"],
+            thread_name_prefix=f"graph-{kind}"
+        )
+    return _executors[kind]
+
+def async_node(name, node):
+    """Wrap a sync node as a coroutine that offloads blocking work to its executor"""
+    timed = instrument_node(name, node)
+    if name in MODEL_NODES:
+        kind = "model"
+    elif name in IO_NODES:
+        kind = "io"
+    else:
+        kind = None
+
+    @functools.wraps(node)
+    async def run_node(state):
+        if kind is None:
+            return timed(state)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(kind), timed, state)
+    return run_node
+
 def build_graph():
     """
     Build the LangGraph workflow for AI-orchestrated support
     
     Flow:
-    START → input_router → intent_analyzer → retriever_node → 
+    START → input_router → faq_matcher → [if FAQ match] → output_router → END
+                                       → [otherwise] → intent_analyzer → retriever_node → 
     response_generator → accuracy_evaluator → [if accurate] → output_router → END
                                             → [if inaccurate] → retriever_node (loop)
     """
     
+    return _compile(instrument_node)
+
+def build_async_graph():
+    """
+    Same workflow with async nodes, for graph.ainvoke() from the ASGI app
+    
+    Model nodes run on the "model" executor and output_router on the "io"
+    executor, so the event loop never blocks on inference, TTS or SMTP.
+    """
+    return _compile(async_node)
+
+def _compile(wrap_node):
     # Initialize state graph
     graph = StateGraph(SupportState)
     
-    # Add all nodes
-    graph.add_node("input_router", input_router)
-    graph.add_node("intent_analyzer", intent_analyzer)
-    graph.add_node("retriever_node", retriever_node)
-    graph.add_node("response_generator", response_generator)
-    graph.add_node("accuracy_evaluator", accuracy_evaluator)
-    graph.add_node("output_router", output_router)
+    # Add all nodes (each wrapped with latency instrumentation)
+    nodes = {
+        "input_router": input_router,
+        "faq_matcher": faq_matcher,
+        "intent_analyzer": intent_analyzer,
+        "retriever_node": retriever_node,
+        "response_generator": response_generator,
+        "accuracy_evaluator": accuracy_evaluator,
+        "output_router": output_router,
+    }
+    for name, node in nodes.items():
+        graph.add_node(name, wrap_node(name, node))
     
-    # Add edges (linear flow with one conditional)
+    # Add edges (linear flow with two conditionals)
     graph.add_edge(START, "input_router")
-    graph.add_edge("input_router", "intent_analyzer")
+    graph.add_edge("input_router", "faq_matcher")
+    
+    # Precomputed FAQ answers skip the rest of the pipeline
+    graph.add_conditional_edges(
+        "faq_matcher",
+        faq_route,
+        {
+            "output_router": "output_router",
+            "intent_analyzer": "intent_analyzer"
+        }
+    )
+    
     graph.add_edge("intent_analyzer", "retriever_node")
     graph.add_edge("retriever_node", "response_generator")
     graph.add_edge("response_generator", "accuracy_evaluator")
@@ -83,7 +176,11 @@ if __name__ == "__main__":
         "accuracy": False,
         "email": "",
         "audio_file": None,
-        "confidence_score": 0.0
+        "confidence_score": 0.0,
+        "tokens_generated": {},
+        "request_id": "graph-build-test",
+        "retry_count": 0,
+        "node_timings": {}
     }
     
     result = graph.invoke(test_state)
@@ -0,0 +1,108 @@
+"""
+PDF ingestion: extract, split, embed and store in the vector DB
+Shared by the Flask and ASGI apps so both write the same collection format.
+"""
+import logging
+from utils.model_loader import get_embeddings
+from utils.ocr_processor import iter_pdf_pages
+from utils.metrics import VECTOR_STORE_LATENCY
+from utils.scheduler import scheduler
+from config import TEXT_SPLITTER, FAQ_PRECOMPUTE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIN_TEXT_LENGTH = 50  # Less extracted text than this is treated as a failed extraction
+
+def chunk_metadatas(chunks, company_name, filename, timestamp, first_chunk_id):
+    """Vector store metadata for consecutive chunks of one document (the format /ask reads)"""
+    return [
+        {
+            "source": company_name,
+            "filename": filename,
+            "chunk_id": first_chunk_id + i,
+            "timestamp": timestamp,
+            "page_start": chunk["page_start"],
+            "page_end": chunk["page_end"]
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+
+def ingest_pdf(filepath, company_name, filename, timestamp):
+    """
+    Extract, split, embed and store one PDF
+    
+    Pages stream through the token-aware splitter and chunks are stored in
+    batches, so memory stays bounded for very long manuals. OCR pages and
+    store batches run as batch work that yields to queries (utils.scheduler).
+    
+    Returns:
+        Dict with pages, chunks and characters; chunks is 0 if extraction
+        failed or the text was too short
+    """
+    with scheduler.batch_job():
+        return _ingest_pdf(filepath, company_name, filename, timestamp)
+
+def _ingest_pdf(filepath, company_name, filename, timestamp):
+    # Deferred so worker startup does not pay for LangChain/Chroma
+    from utils.vector_store import get_vectorstore
+    from utils.splitter import StreamingTokenSplitter
+    
+    stats = {"pages": 0, "chunks": 0, "characters": 0}
+    
+    def pages():
+        for page_number, text in iter_pdf_pages(filepath, use_ocr=True, hybrid=True):
+            stats["pages"] += 1
+            stats["characters"] += len(text)
+            yield page_number, text
+    
+    logger.info("🧠 Creating embeddings with local sentence-transformers model...")
+    embeddings = get_embeddings()
+    
+    # Create or load vector store (ChromaDB, or compact storage if configured)
+    vectorstore = get_vectorstore(embeddings)
+    
+    # Chunks are also spooled for background FAQ generation (utils.faq)
+    spool = None
+    if FAQ_PRECOMPUTE['enabled']:
+        from utils.faq import FaqSpool
+        spool = FaqSpool(company_name)
+    
+    def store(batch):
+        metadatas = chunk_metadatas(batch, company_name, filename, timestamp, stats["chunks"])
+        # Embedding a batch is one unit of batch work (utils.scheduler)
+        with scheduler.batch_unit("embed"), VECTOR_STORE_LATENCY.time(operation="add"):
+            vectorstore.add_texts(texts=[chunk["text"] for chunk in batch], metadatas=metadatas)
+        if spool:
+            spool.write([chunk["text"] for chunk in batch], metadatas)
+        stats["chunks"] += len(batch)
+    
+    # Extract (DeepSeek OCR / PyMuPDF), split and store page by page
+    logger.info("🔍 Extracting and splitting text page by page...")
+    splitter = StreamingTokenSplitter()
+    batch = []
+    try:
+        for chunk in splitter.split_pages(pages()):
+            batch.append(chunk)
+            if len(batch) >= TEXT_SPLITTER['ingest_batch_size']:
+                store(batch)
+                batch = []
+        
+        if not stats["chunks"] and sum(len(chunk["text"]) for chunk in batch) < MIN_TEXT_LENGTH:
+            return {**stats, "chunks": 0}
+        if batch:
+            store(batch)
+    finally:
+        if spool:
+            # Whatever was stored gets FAQ answers, even if extraction failed part way
+            from utils.faq import schedule_faq
+            spool.close()
+            if spool.count:
+                schedule_faq(spool)
+            else:
+                spool.discard()
+    
+    logger.info(f"✅ Extracted {stats['characters']} characters from {stats['pages']} pages")
+    logger.info(f"✅ Stored {stats['chunks']} chunks of up to {splitter.chunk_tokens} tokens in the vector store")
+    
+    return stats
\ No newline at end of file
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+End-to-end load generator and replay harness for /ask and /upload_pdf
+
+Replays a JSONL corpus of queries against a running app, either closed-loop
+(fixed concurrency) or open-loop (Poisson arrivals at a fixed rate), with
+optional PDF uploads mixed in. Reports latency percentiles and histograms
+per endpoint and per output mode; /ask requests that overlapped an upload
+are reported separately as "ask:<mode>@ingesting", so query p99 during
+ingestion can be compared with p99 on an idle server. Voice answers also
+get "first_audio:<mode>": request start until the first audio file (the
+whole answer for "voice", sentence 0 for "voice_stream") has downloaded.
+
+Corpus lines are JSON objects; the query text is taken from "query", or
+from "title" + "body" (the requests.jsonl format). Optional "mode_output".
+
+To run without real models, start the app with fake models:
+    FAKE_MODELS=true FAKE_DECODE_LATENCY=0.02 python app.py
+
+Usage:
+    python load_test.py requests.jsonl --concurrency 8 --requests 200
+    python load_test.py requests.jsonl --rate 5 --duration 60 --modes text=0.8 voice=0.2
+    python load_test.py requests.jsonl --concurrency 4 --modes voice=0.5 voice_stream=0.5
+    python load_test.py requests.jsonl --upload-pdf manual.pdf --upload-ratio 0.05 --output load.json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def print_section(title):
+    """Print a formatted section header"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+def load_corpus(path):
+    """Read query texts (and optional output modes) from a JSONL file"""
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            query = record.get("query") or " ".join(
+                part for part in (record.get("title"), record.get("body")) if part
+            )
+            corpus.append({"query": query, "mode_output": record.get("mode_output")})
+    if not corpus:
+        raise SystemExit(f"No queries found in {path}")
+    return corpus
+
+def parse_modes(specs):
+    """Parse ["text=0.8", "voice=0.2"] into weighted choices"""
+    modes = {}
+    for spec in specs:
+        name, _, weight = spec.partition("=")
+        modes[name] = float(weight or 1.0)
+    return list(modes), list(modes.values())
+
+class LoadRecorder:
+    """Thread-safe collection of per-request results"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.slot_waits = 0  # Open-loop arrivals that found every --max-in-flight slot busy
+        self._lock = threading.Lock()
+
+    def record(self, key, latency, ok):
+        with self._lock:
+            self.samples[key].append(latency)
+            if not ok:
+                self.errors[key] += 1
+
+    def report(self, wall_time):
+        summary = {}
+        for key, latencies in sorted(self.samples.items()):
+            latencies = sorted(latencies)
+            n = len(latencies)
+            histogram = {str(b): sum(1 for l in latencies if l <= b) for b in HISTOGRAM_BUCKETS}
+            histogram["+Inf"] = n
+            summary[key] = {
+                "requests": n,
+                "errors": self.errors[key],
+                "throughput_rps": n / wall_time if wall_time else 0.0,
+                "mean_s": statistics.mean(latencies),
+                "p50_s": latencies[int(n * 0.50)],
+                "p90_s": latencies[min(n - 1, int(n * 0.90))],
+                "p99_s": latencies[min(n - 1, int(n * 0.99))],
+                "max_s": latencies[-1],
+                "histogram": histogram,
+            }
+        return summary
+
+class LoadGenerator:
+    """Issues /ask and /upload_pdf requests and records their latencies"""
+
+    def __init__(self, base_url, corpus, modes, mode_weights, upload_pdf=None, upload_ratio=0.0,
+                 timeout=300, seed=0):
+        self.base_url = base_url.rstrip("/")
+        self.corpus = corpus
+        self.modes = modes
+        self.mode_weights = mode_weights
+        self.upload_pdf = upload_pdf
+        self.upload_ratio = upload_ratio if upload_pdf else 0.0
+        self.timeout = timeout
+        self.recorder = LoadRecorder()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._session = threading.local()
+        self._uploads_in_flight = 0
+        self._uploads_started = 0
+
+    def _http(self):
+        session = getattr(self._session, "session", None)
+        if session is None:
+            session = self._session.session = requests.Session()
+        return session
+
+    def _next_job(self):
+        with self._rng_lock:
+            if self._rng.random() < self.upload_ratio:
+                return ("upload_pdf", None)
+            item = self._rng.choice(self.corpus)
+            mode = item["mode_output"] or self._rng.choices(self.modes, self.mode_weights)[0]
+            return ("ask", {"query": item["query"], "mode_input": "text", "mode_output": mode})
+
+    def _ingesting(self):
+        """(uploads in flight, uploads started so far)"""
+        with self._rng_lock:
+            return self._uploads_in_flight, self._uploads_started
+
+    def _track_upload(self, delta):
+        with self._rng_lock:
+            self._uploads_in_flight += delta
+            self._uploads_started += max(delta, 0)
+
+    def run_one(self, scheduled=None):
+        """
+        Issue one request and record its latency
+
+        Args:
+            scheduled: perf_counter time the request was due (open loop). Latency
+                is measured from then, so time spent waiting for a free slot counts.
+        """
+        endpoint, payload = self._next_job()
+        key = endpoint if endpoint == "upload_pdf" else f"ask:{payload['mode_output']}"
+        in_flight, started = self._ingesting()
+        start = time.perf_counter() if scheduled is None else scheduled
+        try:
+            if endpoint == "upload_pdf":
+                self._track_upload(1)
+                try:
+                    with open(self.upload_pdf, "rb") as f:
+                        response = self._http().post(
+                            f"{self.base_url}/upload_pdf",
+                            files={"pdf": f},
+                            data={"company_name": "loadtest"},
+                            timeout=self.timeout
+                        )
+                finally:
+                    self._track_upload(-1)
+            else:
+                if payload["mode_output"] == "email":
+                    payload["email"] = "loadtest@example.com"
+                response = self._http().post(f"{self.base_url}/ask", json=payload, timeout=self.timeout)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        latency = time.perf_counter() - start
+        if endpoint == "ask":
+            # An upload was running at the start, at the end, or began in between
+            in_flight_after, started_after = self._ingesting()
+            if in_flight or in_flight_after or started_after != started:
+                key += "@ingesting"
+        self.recorder.record(key, latency, ok)
+        if endpoint == "ask" and ok and payload["mode_output"] in ("voice", "voice_stream"):
+            self._fetch_first_audio(payload["mode_output"], response.json(), start)
+
+    def _fetch_first_audio(self, mode, result, start):
+        """Download the first playable audio and record time-to-first-audio from request start"""
+        if mode == "voice":
+            url = result.get("audio")
+        else:
+            url = result.get("audio_stream") and f"{result['audio_stream']}/0"
+        try:
+            ok = bool(url) and self._http().get(f"{self.base_url}{url}", timeout=self.timeout).status_code == 200
+        except requests.RequestException:
+            ok = False
+        self.recorder.record(f"first_audio:{mode}", time.perf_counter() - start, ok)
+
+    def run_closed_loop(self, concurrency, total_requests, duration):
+        """Each worker issues its next request as soon as the previous one finishes"""
+        deadline = time.monotonic() + duration if duration else None
+        remaining = [total_requests]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if remaining[0] <= 0 or (deadline and time.monotonic() >= deadline):
+                        return
+                    remaining[0] -= 1
+                self.run_one()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def run_open_loop(self, rate, total_requests, duration, max_in_flight):
+        """
+        Requests arrive as a Poisson process regardless of how fast the app responds
+
+        An arrival that finds all max_in_flight workers busy queues for one; its
+        latency still runs from the scheduled arrival (no coordinated omission).
+        """
+        deadline = time.perf_counter() + duration if duration else None
+        in_flight = [0]
+        lock = threading.Lock()
+
+        def run(scheduled):
+            try:
+                self.run_one(scheduled)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            next_arrival = time.perf_counter()
+            for _ in range(total_requests):
+                if deadline and next_arrival >= deadline:
+                    break
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                with lock:
+                    if in_flight[0] >= max_in_flight:
+                        self.recorder.slot_waits += 1
+                    in_flight[0] += 1
+                pool.submit(run, next_arrival)
+                with self._rng_lock:
+                    next_arrival += self._rng.expovariate(rate)
+
+def print_report(summary, wall_time):
+    print_section("📊 Load Test Results")
+    print(f"Wall time: {wall_time:.1f}s")
+    print(f"\n{'endpoint':20} {'reqs':>6} {'err':>5} {'rps':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for key, s in summary.items():
+        print(f"{key:20} {s['requests']:6} {s['errors']:5} {s['throughput_rps']:7.2f} "
+              f"{s['p50_s']:7.2f}s {s['p90_s']:7.2f}s {s['p99_s']:7.2f}s {s['max_s']:7.2f}s")
+
+    for key, s in summary.items():
+        print(f"\nLatency histogram: {key}")
+        previous = 0
+        for bound, cumulative in s["histogram"].items():
+            count = cumulative - previous
+            previous = cumulative
+            bar = "#" * round(40 * count / s["requests"]) if s["requests"] else ""
+            label = bound if bound == "+Inf" else f"{bound}s"
+            print(f"  <= {label:>6} {count:6} {bar}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query corpus against /ask and /upload_pdf")
+    parser.add_argument("corpus", help="JSONL corpus of queries")
+    parser.add_argument("--url", default="http://localhost:5000", help="App base URL")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop workers")
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate (requests/s); overrides --concurrency")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open-loop cap on outstanding requests")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests to send")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds")
+    parser.add_argument("--modes", nargs="+", default=["text=1.0"], help="Output mode mix, e.g. text=0.8 voice=0.2")
+    parser.add_argument("--upload-pdf", help="PDF to upload for ingest traffic")
+    parser.add_argument("--upload-ratio", type=float, default=0.0, help="Fraction of requests that are uploads")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout (s)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the request mix")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    modes, weights = parse_modes(args.modes)
+    generator = LoadGenerator(
+        args.url, load_corpus(args.corpus), modes, weights,
+        upload_pdf=args.upload_pdf, upload_ratio=args.upload_ratio,
+        timeout=args.timeout, seed=args.seed
+    )
+
+    print_section("🚀 Load Test")
+    if args.rate:
+        print(f"Open loop: {args.rate} req/s, up to {args.requests} requests")
+    else:
+        print(f"Closed loop: {args.concurrency} workers, {args.requests} requests")
+
+    start = time.perf_counter()
+    if args.rate:
+        generator.run_open_loop(args.rate, args.requests, args.duration, args.max_in_flight)
+    else:
+        generator.run_closed_loop(args.concurrency, args.requests, args.duration)
+    wall_time = time.perf_counter() - start
+
+    summary = generator.recorder.report(wall_time)
+    print_report(summary, wall_time)
+    if args.rate:
+        print(f"\nArrivals that waited for a free slot (--max-in-flight {args.max_in_flight}): "
+              f"{generator.recorder.slot_waits}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "wall_time_s": wall_time,
+                "config": vars(args),
+                "results": summary,
+                "slot_waits": generator.recorder.slot_waits
+            }, f, indent=2)
+        print(f"\n📄 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,273 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition
+
+Histograms, counters and gauges are kept in a module-level registry and
+rendered in the Prometheus text format by the /metrics endpoint. Standard
+library only, so importing it costs nothing at worker startup.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds (model calls can take tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (1, 4, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+# Queueing delays in seconds (micro-batching windows are a few milliseconds)
+WAIT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """Base class: named metric with a fixed set of label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        """Copy of the bucket counts, sum and count for one label set"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if state is None:
+                return {"buckets": self.buckets, "counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            return {"buckets": self.buckets, "counts": list(state["counts"]), "sum": state["sum"], "count": state["count"]}
+
+    def quantile(self, q, **labels):
+        """Upper bound of the bucket holding quantile q (inf past the last bucket, None if empty)"""
+        snapshot = self.snapshot(**labels)
+        if not snapshot["count"]:
+            return None
+        rank = q * snapshot["count"]
+        for bound, count in zip(self.buckets, snapshot["counts"]):
+            if count >= rank:
+                return bound
+        return math.inf
+
+    def _render_samples(self):
+        for key, state in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, state["counts"]):
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {count}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {state['count']}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}"
+
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text format"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# ============================================
+# Support pipeline metrics
+# ============================================
+REQUEST_LATENCY = Histogram(
+    "support_request_latency_seconds", "End-to-end HTTP request latency", ["endpoint"]
+)
+REQUESTS = Counter(
+    "support_requests_total", "HTTP requests by endpoint and status", ["endpoint", "status"]
+)
+NODE_LATENCY = Histogram(
+    "support_node_latency_seconds", "LangGraph node latency", ["node"]
+)
+PROMPT_TOKENS = Histogram(
+    "support_llm_prompt_tokens", "Prompt tokens per LLM call", ["node"], buckets=TOKEN_BUCKETS
+)
+COMPLETION_TOKENS = Histogram(
+    "support_llm_completion_tokens", "Completion tokens per LLM call", ["node"], buckets=TOKEN_BUCKETS
+)
+EMBEDDING_LATENCY = Histogram(
+    "support_embedding_latency_seconds", "Embedding latency", ["operation"]
+)
+VECTOR_STORE_LATENCY = Histogram(
+    "support_vector_store_latency_seconds", "Vector store latency", ["operation"]
+)
+RETRIES = Counter(
+    "support_retrieval_retries_total", "Re-retrievals triggered by low accuracy"
+)
+CACHE_HITS = Counter(
+    "support_cache_hits_total", "Cache hits", ["cache"]
+)
+CACHE_MISSES = Counter(
+    "support_cache_misses_total", "Cache misses", ["cache"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "support_admission_queue_depth", "Requests waiting for admission", ["lane"]
+)
+ADMISSION_RUNNING = Gauge(
+    "support_admission_running", "Admitted requests currently running", ["lane"]
+)
+ADMISSION_REJECTED = Counter(
+    "support_admission_rejected_total", "Requests rejected by admission control", ["lane", "reason"]
+)
+ADMISSION_WAIT = Histogram(
+    "support_admission_wait_seconds", "Time spent waiting for admission", ["lane"]
+)
+FAQ_LOOKUPS = Counter(
+    "support_faq_lookups_total", "Precomputed FAQ lookups by result (hit/miss)", ["result"]
+)
+FAQ_GENERATED = Counter(
+    "support_faq_questions_generated_total", "Questions and answers precomputed at ingest time"
+)
+SESSION_KV_BYTES = Gauge(
+    "support_session_kv_cache_bytes", "Estimated memory held by cached session KV prefixes"
+)
+SESSION_KV_EVICTIONS = Counter(
+    "support_session_kv_evictions_total", "Session KV prefixes dropped, by reason", ["reason"]
+)
+SESSION_REUSED_TOKENS = Histogram(
+    "support_session_reused_prompt_tokens", "Prompt tokens served from a session's cached prefix",
+    buckets=TOKEN_BUCKETS
+)
+CASCADE_CALLS = Counter(
+    "support_cascade_calls_total", "LLM calls per node and model tier (small/large)", ["node", "tier"]
+)
+CASCADE_ESCALATIONS = Counter(
+    "support_cascade_escalations_total", "Calls sent to the large model instead of the small one", ["node", "reason"]
+)
+CASCADE_LATENCY = Histogram(
+    "support_cascade_latency_seconds", "LLM call latency per node and model tier", ["node", "tier"]
+)
+MODEL_RESIDENT_BYTES = Gauge(
+    "support_model_resident_bytes", "Memory held by each resident model", ["model"]
+)
+MODEL_RESIDENCY_EVENTS = Counter(
+    "support_model_residency_events_total", "Model loads, reloads, evictions, offloads and restores", ["model", "event"]
+)
+MODEL_LOAD_LATENCY = Histogram(
+    "support_model_load_seconds", "Time to load, reload or restore a model", ["model"]
+)
+BATCH_UNIT_WAIT = Histogram(
+    "support_batch_unit_wait_seconds", "Time a unit of batch work waited for queries to finish", ["kind"]
+)
+BATCH_MODEL_SHARE = Gauge(
+    "support_batch_model_share", "Share of recent model time used by batch work (ingestion, /ask_batch)"
+)
+QUERY_LATENCY = Histogram(
+    "support_query_latency_seconds", "End-to-end /ask latency, by whether batch work overlapped it", ["during_batch"]
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "support_embedding_query_batch_size", "Queries embedded per coalesced forward pass", buckets=BATCH_SIZE_BUCKETS
+)
+EMBEDDING_BATCH_WAIT = Histogram(
+    "support_embedding_query_wait_seconds", "Time a query waited to join an embedding batch", buckets=WAIT_BUCKETS
+)
+TTS_FIRST_AUDIO = Histogram(
+    "support_tts_time_to_first_audio_seconds", "Request start to the first playable audio, by voice output mode", ["mode"]
+)
+TTS_SYNTHESIS_LATENCY = Histogram(
+    "support_tts_synthesis_seconds", "Time to synthesize one audio file (a whole answer, or one sentence)", ["mode"]
+)
\ No newline at end of file
@@ -1,48 +1,237 @@
 """
 Utility functions to load local models from Hugging Face
+
+Heavy libraries (torch, transformers, LangChain model wrappers) are imported
+inside the loader methods so that importing this module stays cheap and web
+workers can start without paying for them until a model is actually needed.
 """
-import torch
-from transformers import (
-    AutoTokenizer, 
-    AutoModelForCausalLM,
-    BitsAndBytesConfig,
-    pipeline
-)
-from sentence_transformers import SentenceTransformer
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.llms import HuggingFacePipeline
+import functools
 import logging
-from config import MODELS, GENERATION_CONFIG
+import os
+import threading
+import time
+from collections import OrderedDict
+from config import MODELS, GENERATION_CONFIG, GENERATION_PROFILES, MODEL_SERVER, FAKE_MODELS, SESSIONS, EMBEDDING_BATCHING
+from utils.metrics import (
+    CACHE_HITS,
+    CACHE_MISSES,
+    SESSION_KV_BYTES,
+    SESSION_KV_EVICTIONS,
+    SESSION_REUSED_TOKENS
+)
+from utils.residency import residency, module_bytes
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def get_generation_profile(profile="default"):
+    """Resolve a named generation profile on top of the default profile"""
+    if profile not in GENERATION_PROFILES:
+        logger.warning(f"Unknown generation profile '{profile}', using default")
+    return {**GENERATION_PROFILES["default"], **GENERATION_PROFILES.get(profile, {})}
+
+class StopSequenceCriteria:
+    """
+    Stopping criteria that ends generation once a stop sequence is decoded
+    
+    Leading whitespace is not a stop: greedy decoding often opens with a
+    newline, which would otherwise end a "\n"-terminated answer at once.
+    """
+    
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        self.tokenizer = tokenizer
+        self.stop_sequences = stop_sequences
+        self.prompt_length = prompt_length
+        # Only decode the tail of the output: enough tokens to cover any stop sequence
+        self.window = max(len(tokenizer(s, add_special_tokens=False)["input_ids"]) for s in stop_sequences) + 2
+        self.content_start = {}  # row -> position of its first non-whitespace token
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        # In a batch, stop once every row has produced a stop sequence
+        length = input_ids.shape[1]
+        if length <= self.prompt_length:
+            return False
+        stopped = True
+        for i, row in enumerate(input_ids):
+            # Called after every new token, so the first non-blank one is seen as it arrives
+            # Special tokens count too: a chat template's end-of-turn token is a stop sequence
+            if i not in self.content_start and self.tokenizer.decode(row[-1:]).strip():
+                self.content_start[i] = length - 1
+            if i not in self.content_start:
+                stopped = False
+                continue
+            start = max(self.content_start[i], length - self.window)
+            text = self.tokenizer.decode(row[start:])
+            if start == self.content_start[i]:
+                text = text.lstrip()
+            if not any(stop in text for stop in self.stop_sequences):
+                stopped = False
+        return stopped
+
+class TokenLogprobRecorder:
+    """
+    Logits processor that sums each row's generated-token log-probabilities
+    
+    Only the previous step's distribution is kept (not every step's scores),
+    so the memory cost does not grow with the answer length.
+    """
+    
+    def __init__(self, pad_id):
+        self.pad_id = pad_id
+        self.total = None
+        self.count = None
+        self._previous = None
+    
+    def __call__(self, input_ids, scores):
+        import torch
+        
+        if self._previous is not None:
+            self._add(input_ids[:, -1])
+        self._previous = torch.log_softmax(scores.float(), dim=-1)
+        return scores
+    
+    def _add(self, tokens):
+        logprobs = self._previous.gather(1, tokens.unsqueeze(1)).squeeze(1)
+        real = (tokens != self.pad_id).float()
+        if self.total is None:
+            self.total = logprobs * real
+            self.count = real
+        else:
+            self.total += logprobs * real
+            self.count += real
+    
+    def mean(self, sequences):
+        """Mean log-probability per row, once generation has finished"""
+        if self._previous is not None:
+            # The last chosen token never reaches the processor
+            self._add(sequences[:, -1])
+            self._previous = None
+        if self.total is None:
+            return [0.0] * sequences.shape[0]
+        return (self.total / self.count.clamp(min=1)).tolist()
+
+def uses_llm(method):
+    """Keep the manager's LLM resident (not evicted) while the method runs"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with residency.using(self.llm_slot):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def truncate_at_stop(text, stop_sequences):
+    """Cut text at the first stop sequence after any leading whitespace; returns (text, stopped)"""
+    body = text.lstrip()
+    cut = min((body.find(s) for s in stop_sequences if s in body), default=-1)
+    if cut == -1:
+        return text, False
+    return text[:len(text) - len(body) + cut], True
+
+class SessionKVCache:
+    """
+    KV caches of multi-turn sessions, LRU-evicted under a memory cap
+    
+    An entry holds a session's transcript token ids, the model's
+    past_key_values for them and the turn they end with. Entries are taken
+    out while a turn generates (a concurrent request for the same session
+    simply misses) and put back afterwards.
+    """
+    
+    def __init__(self, max_bytes, max_sessions):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def take(self, session_id):
+        """Remove and return a session's entry (None on a miss)"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry["bytes"]
+                SESSION_KV_BYTES.set(self._bytes)
+            return entry
+    
+    def put(self, session_id, entry):
+        """Store an entry, evicting least recently used sessions to stay under the caps"""
+        if entry["bytes"] > self.max_bytes:
+            SESSION_KV_EVICTIONS.inc(reason="too_large")
+            return
+        with self._lock:
+            previous = self._entries.pop(session_id, None)
+            if previous is not None:
+                self._bytes -= previous["bytes"]
+            self._entries[session_id] = entry
+            self._bytes += entry["bytes"]
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_sessions:
+                reason = "memory" if self._bytes > self.max_bytes else "sessions"
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["bytes"]
+                SESSION_KV_EVICTIONS.inc(reason=reason)
+            SESSION_KV_BYTES.set(self._bytes)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            SESSION_KV_BYTES.set(0)
+
 class LocalModelManager:
-    """Manages loading and caching of local models"""
+    """
+    Manages loading and caching of local models
+    
+    Loaded models are reported to utils.residency, which may evict them to
+    stay within MODEL_RESIDENCY['budget_mb']; the load_* methods reload them.
+    """
     
-    def __init__(self):
+    # Turn markers of the "deepseek" prompt format
+    DEEPSEEK_TURN_STOPS = ["<|user|>", "<|system|>"]
+    
+    def __init__(self, llm_config=None, llm_slot="llm"):
+        self.llm_config = llm_config or MODELS['llm']
+        # "deepseek" (<|system|>/<|user|>/<|assistant|> turns) or "chat_template" (the tokenizer's own)
+        self.prompt_format = self.llm_config.get('prompt_format', "deepseek")
+        self.llm_slot = llm_slot  # Residency name of this manager's LLM
         self.llm = None
         self.embeddings = None
         self.ocr_model = None
         self.tokenizer = None
+        self.model = None
+        self.session_cache = SessionKVCache(
+            SESSIONS['kv_cache_max_mb'] * 1024 * 1024, SESSIONS['kv_cache_max_sessions']
+        )
         
     def load_llm(self):
-        """Load DeepSeek LLM model"""
+        """Load the LLM (DeepSeek, or this manager's llm_config)"""
         if self.llm is not None:
-            logger.info("LLM already loaded")
+            CACHE_HITS.inc(cache="llm")
+            residency.touch(self.llm_slot)
             return self.llm
+        CACHE_MISSES.inc(cache="llm")
+        residency.register(self.llm_slot, self._unload_llm, self._offload_llm, self._restore_llm)
+        residency.make_room(self.llm_slot)
+        start = time.perf_counter()
             
         try:
-            logger.info(f"Loading LLM: {MODELS['llm']['model_name']}")
+            logger.info(f"Loading LLM: {self.llm_config['model_name']}")
+            
+            import torch
+            from transformers import (
+                AutoTokenizer,
+                AutoModelForCausalLM,
+                BitsAndBytesConfig,
+                pipeline
+            )
+            from langchain.llms import HuggingFacePipeline
             
             # Configuration for quantization (optional, for lower memory)
             quantization_config = None
-            if MODELS['llm']['load_in_8bit']:
+            if self.llm_config['load_in_8bit']:
                 quantization_config = BitsAndBytesConfig(
                     load_in_8bit=True,
                     llm_int8_threshold=6.0
                 )
-            elif MODELS['llm']['load_in_4bit']:
+            elif self.llm_config['load_in_4bit']:
                 quantization_config = BitsAndBytesConfig(
                     load_in_4bit=True,
                     bnb_4bit_compute_dtype=torch.float16,
@@ -51,16 +240,16 @@ class LocalModelManager:
             
             # Load tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(
-                MODELS['llm'].get('model_path') or MODELS['llm']['model_name'],
+                self.llm_config.get('model_path') or self.llm_config['model_name'],
                 trust_remote_code=True
             )
             
-            # Load model
-            model = AutoModelForCausalLM.from_pretrained(
-                MODELS['llm'].get('model_path') or MODELS['llm']['model_name'],
+            # Load model (kept for direct forward passes, e.g. label scoring)
+            model = self.model = AutoModelForCausalLM.from_pretrained(
+                self.llm_config.get('model_path') or self.llm_config['model_name'],
                 quantization_config=quantization_config,
-                device_map="auto" if MODELS['llm']['device'] == "cuda" else None,
-                torch_dtype=torch.float16 if MODELS['llm']['device'] == "cuda" else torch.float32,
+                device_map="auto" if self.llm_config['device'] == "cuda" else None,
+                torch_dtype=torch.float16 if self.llm_config['device'] == "cuda" else torch.float32,
                 trust_remote_code=True,
                 low_cpu_mem_usage=True
             )
@@ -79,6 +268,7 @@ class LocalModelManager:
             
             # Wrap in LangChain
             self.llm = HuggingFacePipeline(pipeline=pipe)
+            residency.loaded(self.llm_slot, module_bytes(model), time.perf_counter() - start)
             
             logger.info("✅ LLM loaded successfully")
             return self.llm
@@ -90,18 +280,34 @@ class LocalModelManager:
     def load_embeddings(self):
         """Load embedding model for RAG"""
         if self.embeddings is not None:
-            logger.info("Embeddings already loaded")
+            CACHE_HITS.inc(cache="embeddings")
+            residency.touch("embeddings")
             return self.embeddings
+        CACHE_MISSES.inc(cache="embeddings")
+        residency.register("embeddings", self._unload_embeddings)
+        residency.make_room("embeddings")
+        start = time.perf_counter()
             
         try:
             logger.info(f"Loading embeddings: {MODELS['embeddings']['model_name']}")
             
+            if MODELS['embeddings'].get('backend') == "onnx":
+                # int8-quantized ONNX Runtime path for CPU-only nodes
+                from utils.onnx_embeddings import OnnxEmbeddings
+                self.embeddings = OnnxEmbeddings()
+                residency.loaded("embeddings", os.path.getsize(self.embeddings.onnx_path), time.perf_counter() - start)
+                logger.info("✅ Embeddings loaded successfully (onnxruntime)")
+                return self.embeddings
+            
+            from langchain.embeddings import HuggingFaceEmbeddings
+            
             # Using HuggingFaceEmbeddings from LangChain
             self.embeddings = HuggingFaceEmbeddings(
                 model_name=MODELS['embeddings'].get('model_path') or MODELS['embeddings']['model_name'],
                 model_kwargs={'device': MODELS['embeddings']['device']},
                 encode_kwargs={'normalize_embeddings': True}
             )
+            residency.loaded("embeddings", module_bytes(self.embeddings.client), time.perf_counter() - start)
             
             logger.info("✅ Embeddings loaded successfully")
             return self.embeddings
@@ -113,13 +319,19 @@ class LocalModelManager:
     def load_ocr_model(self):
         """Load DeepSeek OCR / GOT-OCR2.0 model"""
         if self.ocr_model is not None:
-            logger.info("OCR model already loaded")
+            CACHE_HITS.inc(cache="ocr")
+            residency.touch("ocr")
             return self.ocr_model
+        CACHE_MISSES.inc(cache="ocr")
+        residency.register("ocr", self._unload_ocr, self._offload_ocr, self._restore_ocr)
+        residency.make_room("ocr")
+        start = time.perf_counter()
             
         try:
             logger.info(f"Loading OCR model: {MODELS['ocr']['model_name']}")
             
             # For GOT-OCR2.0 (DeepSeek's OCR)
+            import torch
             from transformers import AutoModel, AutoTokenizer
             
             tokenizer = AutoTokenizer.from_pretrained(
@@ -139,6 +351,7 @@ class LocalModelManager:
                 'model': model,
                 'tokenizer': tokenizer
             }
+            residency.loaded("ocr", module_bytes(model), time.perf_counter() - start)
             
             logger.info("✅ OCR model loaded successfully")
             return self.ocr_model
@@ -148,52 +361,551 @@ class LocalModelManager:
             logger.warning("Falling back to PyMuPDF text extraction")
             return None
     
-    def generate_text(self, prompt, system_prompt=None):
+    def generate_text(self, prompt, system_prompt=None, profile="default"):
         """Generate text using the loaded LLM"""
+        return self.generate_with_stats(prompt, system_prompt, profile)["text"]
+    
+    def generate_with_stats(self, prompt, system_prompt=None, profile="default"):
+        """
+        Generate text with a named generation profile
+        
+        Returns:
+            Dict with text, profile, prompt_tokens, completion_tokens, whether
+            a stop sequence ended generation, and mean_logprob (the model's
+            average log-probability of its own answer tokens)
+        """
+        try:
+            return self._generate([prompt], system_prompt, profile)[0]
+        except Exception as e:
+            logger.error(f"Text generation failed: {e}")
+            return {
+                "text": f"Error generating response: {str(e)}",
+                "profile": profile,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "stopped": False,
+                "mean_logprob": 0.0,
+            }
+    
+    def generate_batch(self, prompts, system_prompt=None, profile="default"):
+        """
+        Generate answers for several prompts in one batched model.generate call
+        
+        Unlike generate_with_stats, failures raise so the caller can report
+        them per item.
+        
+        Returns:
+            List of generate_with_stats-style dicts, in prompt order
+        """
+        return self._generate(prompts, system_prompt, profile)
+    
+    @uses_llm
+    def _generate(self, prompts, system_prompt, profile):
         if self.llm is None:
             self.load_llm()
         
-        # Format prompt for DeepSeek
-        if system_prompt:
-            formatted_prompt = f"<|system|>\n{system_prompt}\n<|user|>\n{prompt}\n<|assistant|>\n"
-        else:
-            formatted_prompt = f"<|user|>\n{prompt}\n<|assistant|>\n"
+        import torch
+        from transformers import LogitsProcessorList
         
+        formatted_prompts = [self.format_prompt(prompt, system_prompt) for prompt in prompts]
+        settings = get_generation_profile(profile)
+        stop_sequences = self.stop_sequences(settings)
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.eos_token_id
+        
+        # Left-pad so every row's continuation starts at the same position
+        padding_side = self.tokenizer.padding_side
+        pad_token = self.tokenizer.pad_token
+        self.tokenizer.padding_side = "left"
+        if pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         try:
-            response = self.llm(formatted_prompt)
-            return response
+            inputs = self.tokenizer(
+                formatted_prompts, return_tensors="pt", padding=True, add_special_tokens=self._add_special_tokens
+            ).to(self.model.device)
+        finally:
+            self.tokenizer.padding_side = padding_side
+            self.tokenizer.pad_token = pad_token
+        prompt_length = inputs["input_ids"].shape[1]
+        
+        recorder = TokenLogprobRecorder(pad_id)
+        with torch.no_grad():
+            output = self.model.generate(
+                **inputs,
+                logits_processor=LogitsProcessorList([recorder]),
+                **self._generation_kwargs(settings, stop_sequences, prompt_length, pad_id)
+            )
+        mean_logprobs = recorder.mean(output)
+        
+        results = []
+        for row in range(len(prompts)):
+            new_tokens = output[row, prompt_length:]
+            text, stopped = self._decode_answer(new_tokens, stop_sequences)
+            results.append({
+                "text": text,
+                "profile": profile,
+                "prompt_tokens": int(inputs["attention_mask"][row].sum()),
+                "completion_tokens": int((new_tokens != pad_id).sum()),
+                "stopped": stopped,
+                "mean_logprob": mean_logprobs[row],
+            })
+        return results
+    
+    def _generation_kwargs(self, settings, stop_sequences, prompt_length, pad_id):
+        """model.generate arguments for a resolved generation profile"""
+        from transformers import StoppingCriteriaList
+        
+        gen_kwargs = {
+            "max_new_tokens": settings["max_new_tokens"],
+            "do_sample": settings["do_sample"],
+            "repetition_penalty": settings["repetition_penalty"],
+            "pad_token_id": pad_id,
+        }
+        if settings["do_sample"]:
+            gen_kwargs["temperature"] = settings["temperature"]
+            gen_kwargs["top_p"] = settings["top_p"]
+        if stop_sequences:
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                StopSequenceCriteria(self.tokenizer, stop_sequences, prompt_length)
+            ])
+        return gen_kwargs
+    
+    def generate_in_session(self, session_id, turn, prompt, system_prompt=None, history=None, profile="default"):
+        """
+        Generate one turn of a multi-turn session, reusing the session's KV cache
+        
+        A session's transcript is append-only (system prompt, then each turn's
+        prompt and answer), so when the cache ends with the previous turn only
+        the new turn's tokens are prefilled. Regenerating the same turn (an
+        accuracy retry) rolls the cache back to where the turn started. With
+        no usable cache the transcript is rebuilt from `history`.
+        
+        Args:
+            session_id: Conversation id
+            turn: Number of earlier turns in the session
+            history: Recent {"user", "assistant"} turns, used on a cache miss
+        
+        Returns:
+            generate_with_stats-style dict plus reused_tokens
+        """
+        try:
+            return self._generate_in_session(session_id, turn, prompt, system_prompt, history or [], profile)
         except Exception as e:
-            logger.error(f"Text generation failed: {e}")
-            return f"Error generating response: {str(e)}"
+            logger.error(f"Session generation failed: {e}")
+            return {
+                "text": f"Error generating response: {str(e)}",
+                "profile": profile,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "stopped": False,
+                "reused_tokens": 0,
+            }
+    
+    @uses_llm
+    def _generate_in_session(self, session_id, turn, prompt, system_prompt, history, profile):
+        if self.llm is None:
+            self.load_llm()
+        
+        import torch
+        from transformers import DynamicCache
+        
+        settings = get_generation_profile(profile)
+        stop_sequences = self.stop_sequences(settings)
+        budget = SESSIONS['max_context_tokens'] - settings["max_new_tokens"]
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.eos_token_id
+        
+        entry = self.session_cache.take(session_id)
+        if entry is not None and entry["turn"] == turn:
+            # Same turn again: drop the previous attempt's prompt and answer
+            entry["cache"].crop(entry["turn_start"])
+            entry["ids"] = entry["ids"][:entry["turn_start"]]
+        elif entry is not None and entry["turn"] != turn - 1:
+            entry = None  # Turns were answered elsewhere (another worker, an FAQ match)
+        
+        if entry is not None:
+            # Previous answer ends without what format_session puts after it
+            turn_ids = self.tokenizer(self.answer_suffix() + self.format_turn(prompt), add_special_tokens=False)["input_ids"]
+            if len(entry["ids"]) + len(turn_ids) > budget:
+                SESSION_KV_EVICTIONS.inc(reason="context")
+                entry = None
+        
+        if entry is not None:
+            CACHE_HITS.inc(cache="session_kv")
+            turn_start = len(entry["ids"])
+            ids = entry["ids"] + turn_ids
+            cache = entry["cache"]
+        else:
+            CACHE_MISSES.inc(cache="session_kv")
+            turn_ids = self.tokenizer(self.format_turn(prompt), add_special_tokens=False)["input_ids"]
+            # Replay as much recent history as fits the context budget
+            while True:
+                prefix_ids = self.tokenizer(
+                    self.format_session(system_prompt, history), add_special_tokens=self._add_special_tokens
+                )["input_ids"]
+                if not history or len(prefix_ids) + len(turn_ids) <= budget:
+                    break
+                history = history[1:]
+            turn_start = len(prefix_ids)
+            ids = prefix_ids + turn_ids
+            cache = DynamicCache()
+        reused = cache.get_seq_length()
+        
+        input_ids = torch.tensor([ids], device=self.model.device)
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=cache,
+                **self._generation_kwargs(settings, stop_sequences, len(ids), pad_id)
+            )
+        
+        sequence = output[0].tolist()
+        text, stopped = self._decode_answer(sequence[len(ids):], stop_sequences)
+        
+        # Keep the transcript without trailing EOS/padding, and no more cache than transcript
+        while len(sequence) > len(ids) and sequence[-1] in (pad_id, self.tokenizer.eos_token_id):
+            sequence.pop()
+        cached = min(cache.get_seq_length(), len(sequence))
+        cache.crop(cached)
+        self.session_cache.put(session_id, {
+            "ids": sequence,
+            "cache": cache,
+            "turn": turn,
+            "turn_start": turn_start,
+            "bytes": cached * self._kv_bytes_per_token(),
+        })
+        SESSION_REUSED_TOKENS.observe(reused)
+        
+        return {
+            "text": text,
+            "profile": profile,
+            "prompt_tokens": len(ids),
+            "completion_tokens": len(sequence) - len(ids),
+            "stopped": stopped,
+            "reused_tokens": reused,
+        }
+    
+    def _kv_bytes_per_token(self):
+        """Keys + values across all layers for one token"""
+        import torch
+        
+        config = self.model.config
+        heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+        head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+        return 2 * config.num_hidden_layers * heads * head_dim * torch.finfo(self.model.dtype).bits // 8
+    
+    @property
+    def _add_special_tokens(self):
+        # A chat template already writes any BOS token into the text
+        return self.prompt_format != "chat_template"
+    
+    def _chat(self, messages, add_generation_prompt):
+        return self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=add_generation_prompt
+        )
+    
+    def turn_stops(self):
+        """Strings that open a new turn (or end this one) in this model's prompt format"""
+        if self.prompt_format == "chat_template":
+            # Control tokens such as Qwen's <|im_start|>/<|im_end|>, plus EOS and padding
+            tokens = [self.tokenizer.eos_token, self.tokenizer.pad_token, *self.tokenizer.additional_special_tokens]
+            return list(dict.fromkeys(t for t in tokens if t))
+        return list(self.DEEPSEEK_TURN_STOPS)
     
-    def cleanup(self):
-        """Free up memory by removing models"""
+    def stop_sequences(self, settings):
+        """A generation profile's stop sequences plus this model's turn markers"""
+        return (settings.get("stop") or []) + self.turn_stops()
+    
+    def _decode_answer(self, tokens, stop_sequences):
+        """Decode generated tokens and cut them at the first stop sequence; returns (text, stopped)"""
+        # Keep special tokens until after the cut: they may be the turn markers
+        text, stopped = truncate_at_stop(self.tokenizer.decode(tokens), stop_sequences)
+        for token in self.tokenizer.all_special_tokens:
+            text = text.replace(token, "")
+        return text, stopped
+    
+    def answer_suffix(self):
+        """What the prompt format puts after an assistant answer, before the next turn"""
+        if self.prompt_format == "chat_template":
+            text = self._chat([{"role": "user", "content": "."}, {"role": "assistant", "content": "\x00"}], False)
+            return text.split("\x00", 1)[1]
+        return "\n"
+    
+    def format_turn(self, prompt):
+        """One user turn of a session transcript, ready for the assistant's answer"""
+        if self.prompt_format == "chat_template":
+            # What the template adds for this turn after an earlier exchange
+            before = [{"role": "user", "content": "."}, {"role": "assistant", "content": "."}]
+            text = self._chat(before + [{"role": "user", "content": prompt}], True)
+            return text[len(self._chat(before, False)):]
+        return f"<|user|>\n{prompt}\n<|assistant|>\n"
+    
+    def format_session(self, system_prompt, history):
+        """Session transcript before the current turn: system prompt and earlier turns"""
+        if self.prompt_format == "chat_template":
+            messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+            for previous in history:
+                messages += [{"role": "user", "content": previous["user"]}, {"role": "assistant", "content": previous["assistant"]}]
+            return self._chat(messages, False) if messages else ""
+        text = f"<|system|>\n{system_prompt}\n" if system_prompt else ""
+        for previous in history:
+            text += self.format_turn(previous["user"]) + f"{previous['assistant']}{self.answer_suffix()}"
+        return text
+    
+    def format_prompt(self, prompt, system_prompt=None):
+        """Format prompt for this model: its tokenizer's chat template, or DeepSeek's turn markers"""
+        if self.prompt_format == "chat_template":
+            messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+            return self._chat(messages + [{"role": "user", "content": prompt}], True)
+        if system_prompt:
+            return f"<|system|>\n{system_prompt}\n<|user|>\n{prompt}\n<|assistant|>\n"
+        return f"<|user|>\n{prompt}\n<|assistant|>\n"
+    
+    def score_continuations(self, prompt, candidates, system_prompt=None):
+        """
+        Score a closed set of continuations of a prompt
+        
+        All candidates are scored in one batched forward pass (no decoding),
+        so the result is deterministic and always one of the candidates.
+        Scores are the mean log-probability per candidate token: summed
+        log-probabilities would favour labels that happen to be one token
+        ("general") over ones the tokenizer splits ("feature_request").
+        
+        Returns:
+            Dict mapping each candidate to its mean token log-probability
+        """
+        return self.score_continuations_batch([prompt], candidates, system_prompt)[0]
+    
+    @uses_llm
+    def score_continuations_batch(self, prompts, candidates, system_prompt=None):
+        """
+        Score the same candidate set for several prompts in one forward pass
+        
+        Returns:
+            List of {candidate: mean token log-probability} dicts, in prompt order
+        """
+        if self.llm is None:
+            self.load_llm()
+        
+        import torch
+        
+        candidate_ids = [self.tokenizer(c, add_special_tokens=False)["input_ids"] for c in candidates]
+        
+        # One row per (prompt, candidate) pair
+        sequences = []
+        prompt_lengths = []
+        for prompt in prompts:
+            prompt_ids = self.tokenizer(
+                self.format_prompt(prompt, system_prompt), add_special_tokens=self._add_special_tokens
+            )["input_ids"]
+            for ids in candidate_ids:
+                sequences.append(prompt_ids + ids)
+                prompt_lengths.append(len(prompt_ids))
+        
+        # Right-pad so each row's tokens keep their positions
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.eos_token_id or 0
+        max_len = max(len(seq) for seq in sequences)
+        input_ids = torch.full((len(sequences), max_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long)
+        for row, seq in enumerate(sequences):
+            input_ids[row, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+            attention_mask[row, :len(seq)] = 1
+        
+        with torch.no_grad():
+            logits = self.model(
+                input_ids=input_ids.to(self.model.device),
+                attention_mask=attention_mask.to(self.model.device)
+            ).logits
+        
+        results = []
+        for p in range(len(prompts)):
+            scores = {}
+            for c, candidate in enumerate(candidates):
+                row = p * len(candidates) + c
+                start, length = prompt_lengths[row], len(candidate_ids[c])
+                # Logits at position t predict the token at position t + 1. Only the
+                # candidate's positions are normalized: a log-softmax over the whole
+                # [rows, seq_len, vocab] batch would take gigabytes for /ask_batch
+                positions = logits[row, start - 1:start + length - 1].float()
+                targets = input_ids[row, start:start + length].to(positions.device)
+                token_log_probs = torch.log_softmax(positions, dim=-1).gather(1, targets.unsqueeze(1))
+                scores[candidate] = token_log_probs.mean().item()
+            results.append(scores)
+        
+        return results
+    
+    def _unload_llm(self):
         self.llm = None
+        self.tokenizer = None
+        self.model = None
+        self.session_cache.clear()
+    
+    def _offload_llm(self):
+        # Quantized (bitsandbytes) weights cannot be moved between devices
+        if self.llm_config['load_in_8bit'] or self.llm_config['load_in_4bit'] or self.llm_config['device'] != "cuda":
+            return False
+        self.session_cache.clear()
+        self.model.to("cpu")
+        return True
+    
+    def _restore_llm(self):
+        self.model.to(self.llm_config['device'])
+    
+    def _unload_embeddings(self):
         self.embeddings = None
+    
+    def _unload_ocr(self):
         self.ocr_model = None
-        self.tokenizer = None
+    
+    def _offload_ocr(self):
+        if not MODELS['ocr']['use_gpu']:
+            return False
+        self.ocr_model['model'].to("cpu")
+        return True
+    
+    def _restore_ocr(self):
+        self.ocr_model['model'].to("cuda")
+    
+    def cleanup(self, models=None):
+        """
+        Free up memory by evicting models (all of this manager's by default)
         
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        Goes through the residency manager so its accounting stays correct;
+        models in use are skipped.
+        """
+        for name in models or [self.llm_slot, "embeddings", "ocr"]:
+            residency.evict(name)
         
         logger.info("Models cleaned up from memory")
 
 # Global instance
-model_manager = LocalModelManager()
+if FAKE_MODELS['enabled']:
+    # Deterministic stub models for load tests on machines without the real models
+    from utils.stub_models import StubModelManager
+    model_manager = StubModelManager(
+        prefill_latency=FAKE_MODELS['prefill_latency'],
+        decode_latency=FAKE_MODELS['decode_latency'],
+        embed_latency=FAKE_MODELS['embed_latency']
+    )
+    logger.warning("Using fake models (FAKE_MODELS=true)")
+else:
+    model_manager = LocalModelManager()
+
+_small_model_manager = None
+_small_lock = threading.Lock()
+
+def get_model_manager(tier="large"):
+    """
+    Model manager for an LLM tier
+    
+    "large" is MODELS['llm'] (model_manager); "small" is MODELS['llm_small'],
+    created on first use and only holding that LLM (see utils.cascade).
+    """
+    global _small_model_manager
+    if tier != "small":
+        return model_manager
+    with _small_lock:
+        if _small_model_manager is None:
+            if FAKE_MODELS['enabled']:
+                factor = FAKE_MODELS['small_latency_factor']
+                _small_model_manager = StubModelManager(
+                    prefill_latency=FAKE_MODELS['prefill_latency'] * factor,
+                    decode_latency=FAKE_MODELS['decode_latency'] * factor
+                )
+            else:
+                _small_model_manager = LocalModelManager(MODELS['llm_small'], llm_slot="llm_small")
+    return _small_model_manager
 
 # Helper functions for easy access
+# When MODEL_SERVER is enabled these are thin clients to the shared model
+# server process (utils/model_server.py) instead of loading models in-process.
 def get_llm():
     """Get or load LLM instance"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_client, RemoteLLM
+        return RemoteLLM(get_client())
     return model_manager.load_llm()
 
+_embedding_dispatcher = None
+_embedding_dispatcher_lock = threading.Lock()
+
 def get_embeddings():
-    """Get or load embeddings instance"""
-    return model_manager.load_embeddings()
+    """Get or load embeddings instance (query embeddings are micro-batched, see EMBEDDING_BATCHING)"""
+    global _embedding_dispatcher
+    if MODEL_SERVER['enabled']:
+        # The model server batches queries from all workers together
+        from utils.model_server import get_client, RemoteEmbeddings
+        return RemoteEmbeddings(get_client())
+    embeddings = model_manager.load_embeddings()
+    if not EMBEDDING_BATCHING['enabled']:
+        return embeddings
+    with _embedding_dispatcher_lock:
+        if _embedding_dispatcher is None:
+            from utils.embedding_dispatcher import EmbeddingDispatcher
+            _embedding_dispatcher = EmbeddingDispatcher(
+                model_manager.load_embeddings,
+                max_batch=EMBEDDING_BATCHING['max_batch'],
+                max_wait=EMBEDDING_BATCHING['max_wait_ms'] / 1000
+            )
+        return _embedding_dispatcher
 
 def get_ocr_model():
     """Get or load OCR model instance"""
     return model_manager.load_ocr_model()
 
-def generate_response(prompt, system_prompt=None):
+def residency_snapshot():
+    """Which models are resident, offloaded or evicted (in the model server when enabled)"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_health_client
+        try:
+            return get_health_client().call("residency")
+        except Exception as e:
+            # Reported by /health, which must answer even when the model server is down
+            return {"error": str(e)}
+    return residency.snapshot()
+
+def score_continuations(prompt, candidates, system_prompt=None, tier="large"):
+    """Mean token log-probability of each candidate continuation of the prompt"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_client
+        return get_client().score(prompt, candidates, system_prompt, tier=tier)
+    return get_model_manager(tier).score_continuations(prompt, candidates, system_prompt)
+
+def score_continuations_batch(prompts, candidates, system_prompt=None):
+    """Candidate log-probabilities for several prompts in one forward pass"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_client
+        return get_client().score_batch(prompts, candidates, system_prompt)
+    return model_manager.score_continuations_batch(prompts, candidates, system_prompt)
+
+def generate_response(prompt, system_prompt=None, profile="default"):
     """Quick function to generate text"""
-    return model_manager.generate_text(prompt, system_prompt)
\ No newline at end of file
+    return generate_with_stats(prompt, system_prompt, profile)["text"]
+
+def generate_with_stats(prompt, system_prompt=None, profile="default", tier="large"):
+    """Generate text with a named profile and return token counts alongside it"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_client
+        return get_client().generate_with_stats(prompt, system_prompt, profile=profile, tier=tier)
+    return get_model_manager(tier).generate_with_stats(prompt, system_prompt, profile)
+
+def generate_batch(prompts, system_prompt=None, profile="default"):
+    """Generate for several prompts in one batched call (raises on failure)"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_client
+        return get_client().generate_batch(prompts, system_prompt, profile=profile)
+    return model_manager.generate_batch(prompts, system_prompt, profile)
+
+def generate_in_session(session_id, turn, prompt, system_prompt=None, history=None, profile="default"):
+    """Generate one turn of a multi-turn session, reusing its cached KV prefix"""
+    if MODEL_SERVER['enabled']:
+        from utils.model_server import get_client
+        return get_client().generate_in_session(
+            session_id, turn, prompt, system_prompt, history=history, profile=profile
+        )
+    return model_manager.generate_in_session(session_id, turn, prompt, system_prompt, history, profile)
\ No newline at end of file
@@ -0,0 +1,353 @@
+"""
+Shared model server for multiple Flask workers
+
+One process loads the LLM, embeddings and OCR model and serves them over a
+Unix socket (multiprocessing.connection, pickle framing with an authkey).
+Web workers talk to it through ModelServerClient, so gunicorn workers can be
+scaled without each one holding its own copy of the models.
+
+Run with:
+    python -m utils.model_server
+and set MODEL_SERVER_ENABLED=true for the web workers.
+
+Requests are unpickled, so only the server's user may connect: the socket
+is created with mode 0600, and without MODEL_SERVER_AUTHKEY the server
+writes a random authkey to MODEL_SERVER['authkey_file'] (mode 0600), which
+clients running as the same user read.
+"""
+import logging
+import os
+import secrets
+import stat
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+from config import MODEL_SERVER, MODEL_CASCADE, EMBEDDING_BATCHING
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelServerError(RuntimeError):
+    """Raised on the client when the model server reports a failure"""
+
+
+def load_authkey(create=False):
+    """
+    The model server authkey: MODEL_SERVER_AUTHKEY, or the key in authkey_file
+
+    With create=True (the server) a missing key file is written with a new
+    random key. A key file that other users can read is refused.
+    """
+    if MODEL_SERVER['authkey']:
+        return MODEL_SERVER['authkey'].encode()
+    path = MODEL_SERVER['authkey_file']
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass  # Another server process wrote it first
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+            logger.info(f"🔑 Wrote new model server authkey to {path}")
+    try:
+        mode = os.stat(path).st_mode
+        with open(path) as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        raise ModelServerError(f"No model server authkey: set MODEL_SERVER_AUTHKEY or start the server to create {path}")
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise ModelServerError(f"Model server authkey file {path} is accessible to other users; chmod 600 it")
+    if not key:
+        raise ModelServerError(f"Model server authkey file {path} is empty")
+    return key.encode()
+
+
+class ModelServer:
+    """Serves generate/score/embed/ocr requests from the local LocalModelManager"""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or MODEL_SERVER['address']
+        self.authkey = authkey.encode() if authkey else load_authkey(create=True)
+        # One lock per model: the LLM and embeddings can run concurrently,
+        # but each model only handles one request at a time
+        self._locks = {
+            "llm": threading.Lock(),
+            "llm_small": threading.Lock(),
+            "embeddings": threading.Lock(),
+            "ocr": threading.Lock(),
+        }
+        self._handlers = {
+            "ping": (None, self._ping),
+            "residency": (None, self._residency),
+            "generate": ("llm", self._generate),
+            "generate_with_stats": ("llm", self._generate_with_stats),
+            "generate_raw": ("llm", self._generate_raw),
+            "score": ("llm", self._score),
+            "score_batch": ("llm", self._score_batch),
+            "generate_batch": ("llm", self._generate_batch),
+            "generate_in_session": ("llm", self._generate_in_session),
+            "embed_documents": ("embeddings", self._embed_documents),
+            # Batched queries skip the lock: concurrent ones must meet in the embedding dispatcher
+            "embed_query": (None if EMBEDDING_BATCHING['enabled'] else "embeddings", self._embed_query),
+            "ocr": ("ocr", self._ocr),
+            "ocr_page": ("ocr", self._ocr_page),
+        }
+
+    def _ping(self):
+        return "pong"
+
+    def _residency(self):
+        from utils.residency import residency
+        return residency.snapshot()
+
+    def _generate(self, *args, **kwargs):
+        from utils.model_loader import model_manager
+        return model_manager.generate_text(*args, **kwargs)
+
+    def _generate_with_stats(self, *args, tier="large", **kwargs):
+        from utils.model_loader import get_model_manager
+        return get_model_manager(tier).generate_with_stats(*args, **kwargs)
+
+    def _generate_raw(self, prompt):
+        from utils.model_loader import model_manager
+        return model_manager.load_llm()(prompt)
+
+    def _score(self, prompt, candidates, system_prompt=None, tier="large"):
+        from utils.model_loader import get_model_manager
+        return get_model_manager(tier).score_continuations(prompt, candidates, system_prompt)
+
+    def _score_batch(self, prompts, candidates, system_prompt=None):
+        from utils.model_loader import model_manager
+        return model_manager.score_continuations_batch(prompts, candidates, system_prompt)
+
+    def _generate_batch(self, prompts, system_prompt=None, profile="default"):
+        from utils.model_loader import model_manager
+        return model_manager.generate_batch(prompts, system_prompt, profile)
+
+    def _generate_in_session(self, session_id, turn, prompt, system_prompt=None, history=None, profile="default"):
+        # Session KV caches live here, next to the model, shared by every web worker
+        from utils.model_loader import model_manager
+        return model_manager.generate_in_session(session_id, turn, prompt, system_prompt, history, profile)
+
+    def _embed_documents(self, texts):
+        from utils.model_loader import get_embeddings
+        return get_embeddings().embed_documents(texts)
+
+    def _embed_query(self, text):
+        # Micro-batched with queries from every web worker (EMBEDDING_BATCHING)
+        from utils.model_loader import get_embeddings
+        return get_embeddings().embed_query(text)
+
+    def _ocr(self, pdf_path, use_ocr=True, hybrid=True):
+        from utils.ocr_processor import extract_text_from_pdf
+        return extract_text_from_pdf(pdf_path, use_ocr=use_ocr, hybrid=hybrid)
+
+    def _ocr_page(self, pdf_path, page_number):
+        from utils.ocr_processor import pdf_processor
+        return pdf_processor.ocr_page(pdf_path, page_number)
+
+    def handle(self, method, args, kwargs):
+        """Dispatch a single request and return a (status, payload) reply"""
+        if method not in self._handlers:
+            return ("error", f"Unknown method: {method}")
+
+        lock_name, handler = self._handlers[method]
+        if lock_name == "llm" and kwargs.get("tier") == "small":
+            # The cascade's small model runs alongside the large one
+            lock_name = "llm_small"
+        try:
+            if lock_name is None:
+                return ("ok", handler(*args, **kwargs))
+            with self._locks[lock_name]:
+                return ("ok", handler(*args, **kwargs))
+        except Exception as e:
+            logger.error(f"Model server {method} failed: {e}", exc_info=True)
+            return ("error", str(e))
+
+    def _serve_connection(self, conn):
+        """Handle requests on one client connection until it closes"""
+        try:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except EOFError:
+                    break
+                conn.send(self.handle(method, args, kwargs))
+        except Exception as e:
+            logger.error(f"Model server connection error: {e}")
+        finally:
+            conn.close()
+
+    def preload(self):
+        """Load the LLM and embeddings up front so the first request is fast"""
+        from utils.model_loader import model_manager, get_model_manager
+        model_manager.load_embeddings()
+        model_manager.load_llm()
+        if MODEL_CASCADE['enabled']:
+            get_model_manager("small").load_llm()
+
+    def serve_forever(self):
+        """Accept client connections, one thread per connection"""
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+        # Owner-only from the moment it is bound, not just after the chmod
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        os.chmod(self.address, 0o600)
+        logger.info(f"✅ Model server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Bad authkey or aborted handshake - keep serving
+                    logger.warning(f"Rejected model server connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+
+
+class ModelServerClient:
+    """Thin client for ModelServer; keeps one connection per thread"""
+
+    def __init__(self, address=None, authkey=None, connect_timeout=None):
+        self.address = address or MODEL_SERVER['address']
+        self.connect_timeout = MODEL_SERVER['connect_timeout'] if connect_timeout is None else connect_timeout
+        # Read on first connect: the server may not have written its key file yet
+        self.authkey = authkey.encode() if authkey else None
+        self._local = threading.local()
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                if self.authkey is None:
+                    self.authkey = load_authkey()
+                return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError, ModelServerError):
+                if time.monotonic() >= deadline:
+                    if self.authkey is None:
+                        raise
+                    raise ModelServerError(f"Model server not reachable at {self.address}")
+                time.sleep(0.5)
+
+    # Safe to send again if the connection drops after the request went out;
+    # anything else (generation, session turns) may already have run on the server
+    IDEMPOTENT = frozenset({"score", "score_batch", "embed_documents", "embed_query", "ocr", "ocr_page"})
+
+    def call(self, method, *args, **kwargs):
+        """Send one request and wait for the reply"""
+        conn = getattr(self._local, "conn", None)
+        for attempt in range(2):
+            sent = False
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            try:
+                conn.send((method, args, kwargs))
+                sent = True
+                status, payload = conn.recv()
+                break
+            except (EOFError, OSError):
+                # Server restarted - reconnect once, unless the request may have run
+                conn.close()
+                conn = self._local.conn = None
+                if attempt == 1 or (sent and method not in self.IDEMPOTENT):
+                    raise ModelServerError(f"Lost connection to model server during {method}")
+
+        if status != "ok":
+            raise ModelServerError(payload)
+        return payload
+
+    def generate(self, prompt, system_prompt=None, **kwargs):
+        return self.call("generate", prompt, system_prompt, **kwargs)
+
+    def generate_with_stats(self, prompt, system_prompt=None, **kwargs):
+        return self.call("generate_with_stats", prompt, system_prompt, **kwargs)
+
+    def score(self, prompt, candidates, system_prompt=None, tier="large"):
+        return self.call("score", prompt, list(candidates), system_prompt, tier=tier)
+
+    def score_batch(self, prompts, candidates, system_prompt=None):
+        return self.call("score_batch", list(prompts), list(candidates), system_prompt)
+
+    def generate_batch(self, prompts, system_prompt=None, **kwargs):
+        return self.call("generate_batch", list(prompts), system_prompt, **kwargs)
+
+    def generate_in_session(self, session_id, turn, prompt, system_prompt=None, **kwargs):
+        return self.call("generate_in_session", session_id, turn, prompt, system_prompt, **kwargs)
+
+    def embed_documents(self, texts):
+        return self.call("embed_documents", list(texts))
+
+    def embed_query(self, text):
+        return self.call("embed_query", text)
+
+    def ocr(self, pdf_path, use_ocr=True, hybrid=True):
+        return self.call("ocr", os.path.abspath(pdf_path), use_ocr=use_ocr, hybrid=hybrid)
+
+    def ocr_page(self, pdf_path, page_number):
+        return self.call("ocr_page", os.path.abspath(pdf_path), page_number)
+
+
+class RemoteEmbeddings:
+    """LangChain-compatible embeddings backed by the model server"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_documents(self, texts):
+        return self.client.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.client.embed_query(text)
+
+
+class RemoteLLM:
+    """Callable LLM backed by the model server (mirrors HuggingFacePipeline.__call__)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __call__(self, prompt):
+        # Prompt is already formatted, so send it without a system prompt wrapper
+        return self.client.call("generate_raw", prompt)
+
+
+_client = None
+_health_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Get the process-wide model server client"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ModelServerClient()
+        return _client
+
+def get_health_client():
+    """Client for health checks: gives up on an unreachable server quickly"""
+    global _health_client
+    with _client_lock:
+        if _health_client is None:
+            _health_client = ModelServerClient(connect_timeout=MODEL_SERVER['health_connect_timeout'])
+        return _health_client
+
+
+if __name__ == "__main__":
+    # This process is the model server: it must use its own models directly
+    MODEL_SERVER['enabled'] = False
+
+    server = ModelServer()
+    logger.info("🔄 Preloading models...")
+    server.preload()
+    server.serve_forever()
\ No newline at end of file
@@ -1,30 +1,104 @@
 from typing import TypedDict, List, Optional
 import os
+import time
 from datetime import datetime
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Chroma
-from langchain.prompts import PromptTemplate
 import logging
 
 # Import local model utilities
-from utils.model_loader import get_llm, get_embeddings, generate_response
-from config import VECTOR_DB, ACCURACY_THRESHOLD
+from utils.model_loader import get_llm, get_embeddings, generate_in_session
+from utils import cascade
+from config import ACCURACY_THRESHOLD, ACCURACY_EVALUATION, FAQ_PRECOMPUTE, SESSIONS
+from utils.metrics import (
+    PROMPT_TOKENS,
+    COMPLETION_TOKENS,
+    EMBEDDING_LATENCY,
+    RETRIES,
+    TTS_FIRST_AUDIO
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+INTENT_LABELS = ["product_info", "troubleshooting", "feature_request", "complaint", "general"]
+
+INTENT_SYSTEM_PROMPT = """You are an intent classifier for customer support queries. 
+Classify the user's query into one of these categories: product_info, troubleshooting, feature_request, complaint, or general.
+Respond with ONLY the category name, nothing else."""
+
+RESPONSE_SYSTEM_PROMPT = """You are a helpful customer support assistant. 
+Use the provided context from product documentation to answer the user's question accurately.
+If the context doesn't contain relevant information, politely say so and provide general guidance.
+Keep your answer concise, helpful, and professional.
+Do not make up information that isn't in the context."""
+
 class SupportState(TypedDict):
     """State definition for LangGraph workflow"""
     user_input: str
     mode_input: str  # "text" or "voice"
-    mode_output: str  # "text", "voice", or "email"
+    mode_output: str  # "text", "voice", "voice_stream", or "email"
     intent: str
     retrieved_docs: List[dict]
     answer: str
     accuracy: bool
     email: str
     audio_file: Optional[str]
+    audio_stream: Optional[str]  # /audio_stream/<id> for mode_output "voice_stream"
     confidence_score: float
+    tokens_generated: dict  # node name -> completion tokens decoded
+    request_id: str
+    retry_count: int  # re-retrievals after a low accuracy score
+    node_timings: dict  # node name -> seconds spent (filled in by build_graph)
+    retrieval_score: float  # cosine similarity of the best retrieved chunk
+    model_tiers: dict  # node name -> LLM tier that produced its result ("small"/"large")
+    faq_match: Optional[dict]  # precomputed FAQ entry that answered the query, if any
+    session_id: str  # empty for a stateless query
+    history: List[dict]  # recent {"user", "assistant"} turns of the session
+    turn: int  # number of earlier turns in the session
+    started_at: float  # perf_counter at request start, for time-to-first-audio
+
+def new_state(user_input: str, mode_input: str = "text", mode_output: str = "text",
+              email: str = "", request_id: str = "", session_id: str = "",
+              history: Optional[List[dict]] = None, turn: int = 0) -> SupportState:
+    """Initial state for one run of the workflow"""
+    return {
+        "user_input": user_input,
+        "mode_input": mode_input,
+        "mode_output": mode_output,
+        "email": email,
+        "intent": "",
+        "retrieved_docs": [],
+        "answer": "",
+        "accuracy": False,
+        "audio_file": None,
+        "audio_stream": None,
+        "confidence_score": 0.0,
+        "tokens_generated": {},
+        "request_id": request_id,
+        "retry_count": 0,
+        "node_timings": {},
+        "retrieval_score": 0.0,
+        "model_tiers": {},
+        "faq_match": None,
+        "session_id": session_id,
+        "history": history or [],
+        "turn": turn,
+        "started_at": time.perf_counter()
+    }
+
+def record_tokens(state: SupportState, node: str, stats: dict):
+    """Accumulate completion tokens generated by a node"""
+    tokens = state.get("tokens_generated") or {}
+    tokens[node] = tokens.get(node, 0) + stats["completion_tokens"]
+    state["tokens_generated"] = tokens
+    PROMPT_TOKENS.observe(stats["prompt_tokens"], node=node)
+    COMPLETION_TOKENS.observe(stats["completion_tokens"], node=node)
+    logger.info(f"  Tokens: {stats['prompt_tokens']} prompt, {stats['completion_tokens']} generated ({stats['profile']} profile)")
+
+def record_tier(state: SupportState, node: str, tier: str):
+    """Remember which LLM tier a node's result came from (see utils.cascade)"""
+    tiers = state.get("model_tiers") or {}
+    tiers[node] = tier
+    state["model_tiers"] = tiers
 
 def input_router(state: SupportState) -> SupportState:
     """
@@ -42,6 +116,38 @@ def input_router(state: SupportState) -> SupportState:
     
     return state
 
+def faq_matcher(state: SupportState) -> SupportState:
+    """
+    Node 1b: Answer from precomputed FAQ entries (see utils.faq)
+    A close enough match skips intent analysis, retrieval and generation
+    """
+    if not FAQ_PRECOMPUTE['enabled']:
+        return state
+    
+    logger.info("🗂️  FAQ Matcher Node")
+    
+    try:
+        from utils.faq import find_faq_answer
+        
+        match = find_faq_answer(state["user_input"])
+        if match:
+            state["faq_match"] = {
+                "question": match["question"],
+                "similarity": match["similarity"],
+                "source": match["metadata"].get("source", "unknown")
+            }
+            state["answer"] = match["answer"]
+            state["confidence_score"] = match["similarity"]
+            state["accuracy"] = True
+            logger.info(f"  ⚡ Matched \"{match['question'][:50]}\" (similarity {match['similarity']:.3f})")
+        else:
+            logger.info("  No close FAQ match")
+    
+    except Exception as e:
+        logger.error(f"FAQ lookup failed: {e}")
+    
+    return state
+
 def intent_analyzer(state: SupportState) -> SupportState:
     """
     Node 2: Analyze user intent using local DeepSeek LLM
@@ -50,40 +156,40 @@ def intent_analyzer(state: SupportState) -> SupportState:
     logger.info("🎯 Intent Analyzer Node")
     
     try:
-        # Use local LLM to classify intent
-        system_prompt = """You are an intent classifier for customer support queries. 
-Classify the user's query into one of these categories: product_info, troubleshooting, feature_request, complaint, or general.
-Respond with ONLY the category name, nothing else."""
-        
-        prompt = f"Query: {state['user_input']}\n\nIntent category:"
-        
-        response = generate_response(prompt, system_prompt)
-        
-        # Extract intent from response
-        intent = response.strip().lower()
-        if intent not in ["product_info", "troubleshooting", "feature_request", "complaint", "general"]:
-            # Fallback to keyword-based detection
-            query_lower = state["user_input"].lower()
-            if any(word in query_lower for word in ["how", "what", "explain", "tell me", "describe"]):
-                intent = "product_info"
-            elif any(word in query_lower for word in ["problem", "issue", "error", "not working", "broken", "fail"]):
-                intent = "troubleshooting"
-            elif any(word in query_lower for word in ["feature", "add", "want", "need", "wish", "could you"]):
-                intent = "feature_request"
-            elif any(word in query_lower for word in ["complaint", "unhappy", "disappointed", "terrible"]):
-                intent = "complaint"
-            else:
-                intent = "general"
+        # Use local LLM to score each category label (one forward pass, no sampling)
+        scores, tier = cascade.score(
+            "intent_analyzer", intent_prompt(state["user_input"]), INTENT_LABELS, INTENT_SYSTEM_PROMPT
+        )
+        intent = max(scores, key=scores.get)
         
         state["intent"] = intent
-        logger.info(f"  Detected intent: {intent}")
+        record_tier(state, "intent_analyzer", tier)
+        logger.info(f"  Detected intent: {intent} (mean token log-prob {scores[intent]:.2f}, {tier} model)")
         
     except Exception as e:
         logger.error(f"Intent analysis failed: {e}")
-        state["intent"] = "general"
+        # Fallback to keyword-based detection
+        state["intent"] = keyword_intent(state["user_input"])
     
     return state
 
+def intent_prompt(query: str) -> str:
+    """Prompt whose continuation is scored against INTENT_LABELS"""
+    return f"Query: {query}\n\nIntent category:"
+
+def keyword_intent(query: str) -> str:
+    """Keyword-based intent detection, used when the LLM is unavailable"""
+    query_lower = query.lower()
+    if any(word in query_lower for word in ["how", "what", "explain", "tell me", "describe"]):
+        return "product_info"
+    elif any(word in query_lower for word in ["problem", "issue", "error", "not working", "broken", "fail"]):
+        return "troubleshooting"
+    elif any(word in query_lower for word in ["feature", "add", "want", "need", "wish", "could you"]):
+        return "feature_request"
+    elif any(word in query_lower for word in ["complaint", "unhappy", "disappointed", "terrible"]):
+        return "complaint"
+    return "general"
+
 def retriever_node(state: SupportState) -> SupportState:
     """
     Node 3: Retrieve relevant documents from ChromaDB using local embeddings
@@ -91,30 +197,35 @@ def retriever_node(state: SupportState) -> SupportState:
     """
     logger.info("📚 Retriever Node")
     
+    if state.get("answer"):
+        # Looped back from the accuracy evaluator
+        state["retry_count"] = state.get("retry_count", 0) + 1
+        RETRIES.inc()
+    
     try:
+        from utils.vector_store import get_vectorstore, search_with_similarity
+        
         # Load local embeddings model (sentence-transformers)
         embeddings = get_embeddings()
         
-        # Load ChromaDB vector store
-        vectorstore = Chroma(
-            persist_directory=VECTOR_DB['persist_directory'],
-            embedding_function=embeddings,
-            collection_name=VECTOR_DB['collection_name']
-        )
+        # Load ChromaDB vector store (or the compact store, see VECTOR_DB['compression'])
+        vectorstore = get_vectorstore(embeddings)
         
-        # Perform similarity search
-        docs = vectorstore.similarity_search(
-            state["user_input"], 
-            k=3  # Retrieve top 3 most relevant documents
-        )
+        # Embed the query and search separately so each step is timed
+        with EMBEDDING_LATENCY.time(operation="query"):
+            query_vector = embeddings.embed_query(retrieval_query(state))
+        
+        # Perform similarity search (top 3 most relevant documents, with scores)
+        found = search_with_similarity(vectorstore, query_vector, k=3)
         
         state["retrieved_docs"] = [
             {
                 "content": doc.page_content,
                 "metadata": doc.metadata
             } 
-            for doc in docs
+            for doc, _ in found
         ]
+        state["retrieval_score"] = float(found[0][1]) if found else 0.0
         
         logger.info(f"  Retrieved {len(state['retrieved_docs'])} documents")
         if state['retrieved_docs']:
@@ -123,9 +234,18 @@ def retriever_node(state: SupportState) -> SupportState:
     except Exception as e:
         logger.error(f"Retrieval failed: {e}")
         state["retrieved_docs"] = []
+        state["retrieval_score"] = 0.0
     
     return state
 
+def retrieval_query(state: SupportState) -> str:
+    """
+    Text to embed for retrieval: the query plus the session's recent user turns,
+    so follow-ups like "and how about the battery?" keep their subject
+    """
+    recent = [turn["user"] for turn in (state.get("history") or [])[-SESSIONS['retrieval_turns']:]]
+    return "\n".join(recent + [state["user_input"]])
+
 def response_generator(state: SupportState) -> SupportState:
     """
     Node 4: Generate response using local DeepSeek LLM + retrieved context
@@ -133,32 +253,27 @@ def response_generator(state: SupportState) -> SupportState:
     logger.info("✍️ Response Generator Node")
     
     try:
-        # Prepare context from retrieved documents
-        if state["retrieved_docs"]:
-            context = "\n\n".join([
-                f"Document {i+1} (from {doc['metadata'].get('source', 'unknown')}):\n{doc['content']}" 
-                for i, doc in enumerate(state["retrieved_docs"])
-            ])
-        else:
-            context = "No specific documentation found."
-        
         # Create prompt with context for DeepSeek
-        system_prompt = """You are a helpful customer support assistant. 
-Use the provided context from product documentation to answer the user's question accurately.
-If the context doesn't contain relevant information, politely say so and provide general guidance.
-Keep your answer concise, helpful, and professional.
-Do not make up information that isn't in the context."""
-        
-        prompt = f"""Context from product documentation:
-{context}
-
-User Question: {state["user_input"]}
-
-Provide a helpful answer based on the context above:"""
+        prompt = response_prompt(state["user_input"], state["retrieved_docs"])
         
         # Generate response using local DeepSeek LLM
-        answer = generate_response(prompt, system_prompt)
-        state["answer"] = answer.strip()
+        if state.get("session_id"):
+            # Follow-up turn: the model sees the conversation, prefilling only this turn
+            stats = generate_in_session(
+                state["session_id"], state.get("turn", 0), prompt, RESPONSE_SYSTEM_PROMPT,
+                history=state.get("history"), profile="response"
+            )
+            logger.info(f"  Session {state['session_id'][:8]}: reused {stats['reused_tokens']} cached prompt tokens")
+            # Session KV caches belong to the large model, so sessions skip the cascade
+            record_tier(state, "response_generator", "large")
+        else:
+            stats = cascade.generate(
+                "response_generator", prompt, RESPONSE_SYSTEM_PROMPT, profile="response",
+                retrieval_score=state.get("retrieval_score"), intent=state.get("intent")
+            )
+            record_tier(state, "response_generator", stats["tier"])
+        record_tokens(state, "response_generator", stats)
+        state["answer"] = stats["text"].strip()
         
         logger.info(f"  Generated answer: {state['answer'][:100]}...")
         
@@ -168,6 +283,23 @@ Provide a helpful answer based on the context above:"""
     
     return state
 
+def response_prompt(user_input: str, retrieved_docs: List[dict]) -> str:
+    """Answer prompt with the retrieved documents as context"""
+    if retrieved_docs:
+        context = "\n\n".join([
+            f"Document {i+1} (from {doc['metadata'].get('source', 'unknown')}):\n{doc['content']}" 
+            for i, doc in enumerate(retrieved_docs)
+        ])
+    else:
+        context = "No specific documentation found."
+    
+    return f"""Context from product documentation:
+{context}
+
+User Question: {user_input}
+
+Provide a helpful answer based on the context above:"""
+
 def accuracy_evaluator(state: SupportState) -> SupportState:
     """
     Node 5: Evaluate response accuracy and relevance using local LLM
@@ -176,34 +308,16 @@ def accuracy_evaluator(state: SupportState) -> SupportState:
     logger.info("🎯 Accuracy Evaluator Node")
     
     try:
-        # Use local LLM to check if answer is well-supported by context
-        system_prompt = """You are an accuracy evaluator for customer support responses. 
-Determine if the answer is well-supported by the context and accurately addresses the question.
-Consider: 1) Is the answer based on the context? 2) Does it answer the question? 3) Is it helpful?
-Respond with ONLY a number between 0.0 and 1.0 representing confidence (e.g., 0.85), nothing else."""
-        
         context = "\n".join([doc["content"][:200] for doc in state["retrieved_docs"]]) if state["retrieved_docs"] else "No context"
         
-        prompt = f"""Question: {state["user_input"]}
+        evaluation = f"""Question: {state["user_input"]}
 Context: {context}
-Answer: {state["answer"]}
-
-Confidence score (0.0 to 1.0):"""
-        
-        response = generate_response(prompt, system_prompt)
+Answer: {state["answer"]}"""
         
-        # Extract confidence score
-        try:
-            confidence = float(response.strip().split()[0])  # Get first number
-            confidence = max(0.0, min(1.0, confidence))  # Clamp to [0, 1]
-        except:
-            # Fallback: simple heuristic based on answer quality
-            if len(state["retrieved_docs"]) > 0 and len(state["answer"]) > 50:
-                confidence = 0.75
-            elif len(state["retrieved_docs"]) > 0:
-                confidence = 0.60
-            else:
-                confidence = 0.40
+        if ACCURACY_EVALUATION["mode"] == "logprob":
+            confidence = logprob_confidence(state, evaluation)
+        else:
+            confidence = generated_confidence(state, evaluation)
         
         state["confidence_score"] = confidence
         state["accuracy"] = confidence >= ACCURACY_THRESHOLD
@@ -218,11 +332,69 @@ Confidence score (0.0 to 1.0):"""
     
     return state
 
+def logprob_confidence(state: SupportState, evaluation: str) -> float:
+    """
+    Confidence from the LLM's token probabilities in one forward pass (no decoding)
+    - yes_no: probability of a "yes" (supported) judgment
+    - digits: probability-weighted expectation over a 0-9 rating, scaled to [0, 1]
+    """
+    if ACCURACY_EVALUATION["logprob_method"] == "digits":
+        system_prompt = """You are an accuracy evaluator for customer support responses. 
+Rate how well the answer is supported by the context and addresses the question.
+Respond with ONLY a single digit from 0 (unsupported) to 9 (fully supported), nothing else."""
+        candidates = [str(d) for d in range(10)]
+        prompt = f"{evaluation}\n\nRating (0-9):"
+    else:
+        system_prompt = """You are an accuracy evaluator for customer support responses. 
+Determine if the answer is well-supported by the context and accurately addresses the question.
+Respond with ONLY yes or no, nothing else."""
+        candidates = ["yes", "no"]
+        prompt = f"{evaluation}\n\nIs the answer supported by the context (yes or no)?"
+    
+    scores, tier = cascade.score("accuracy_evaluator", prompt, candidates, system_prompt)
+    record_tier(state, "accuracy_evaluator", tier)
+    
+    # Renormalize over the closed candidate set
+    probs = cascade.label_probabilities(scores)
+    
+    if ACCURACY_EVALUATION["logprob_method"] == "digits":
+        return sum(int(d) * p for d, p in probs.items()) / 9
+    return probs["yes"]
+
+def generated_confidence(state: SupportState, evaluation: str) -> float:
+    """Confidence parsed from a generated number (one greedy decode)"""
+    system_prompt = """You are an accuracy evaluator for customer support responses. 
+Determine if the answer is well-supported by the context and accurately addresses the question.
+Consider: 1) Is the answer based on the context? 2) Does it answer the question? 3) Is it helpful?
+Respond with ONLY a number between 0.0 and 1.0 representing confidence (e.g., 0.85), nothing else."""
+    
+    prompt = f"""{evaluation}
+
+Confidence score (0.0 to 1.0):"""
+    
+    stats = cascade.generate("accuracy_evaluator", prompt, system_prompt, profile="evaluator")
+    record_tier(state, "accuracy_evaluator", stats["tier"])
+    record_tokens(state, "accuracy_evaluator", stats)
+    response = stats["text"]
+    
+    # Extract confidence score
+    try:
+        confidence = float(response.strip().split()[0])  # Get first number
+        return max(0.0, min(1.0, confidence))  # Clamp to [0, 1]
+    except (ValueError, IndexError):
+        # Fallback: simple heuristic based on answer quality
+        if len(state["retrieved_docs"]) > 0 and len(state["answer"]) > 50:
+            return 0.75
+        elif len(state["retrieved_docs"]) > 0:
+            return 0.60
+        return 0.40
+
 def output_router(state: SupportState) -> SupportState:
     """
     Node 6: Route output based on desired mode
     - text: return as-is
     - voice: convert to speech using offline TTS (pyttsx3)
+    - voice_stream: speak sentence by sentence in the background (utils.tts)
     - email: send via email
     """
     logger.info("📤 Output Router Node")
@@ -230,20 +402,15 @@ def output_router(state: SupportState) -> SupportState:
     if state["mode_output"] == "voice":
         try:
             # Use pyttsx3 for offline text-to-speech
-            import pyttsx3
-            from config import TTS_CONFIG
-            
-            engine = pyttsx3.init()
-            engine.setProperty('rate', TTS_CONFIG['rate'])
-            engine.setProperty('volume', TTS_CONFIG['volume'])
+            from utils.tts import synthesize
             
             # Generate unique filename
             filename = f"response_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp3"
             filepath = f"static/audio/{filename}"
             
-            # Save audio file
-            engine.save_to_file(state["answer"], filepath)
-            engine.runAndWait()
+            # Save audio file (nothing can play until the whole answer is synthesized)
+            synthesize(state["answer"], filepath)
+            TTS_FIRST_AUDIO.observe(time.perf_counter() - state.get("started_at", time.perf_counter()), mode="voice")
             
             state["audio_file"] = f"/audio/{filename}"
             logger.info(f"  TTS audio saved: {filename}")
@@ -253,6 +420,24 @@ def output_router(state: SupportState) -> SupportState:
             state["audio_file"] = None
             logger.warning("  Falling back to text-only output")
         
+    elif state["mode_output"] == "voice_stream":
+        try:
+            # Sentences are synthesized on a background worker; the client
+            # plays /audio_stream/<id>/0, 1, ... while the rest is rendered
+            from utils.tts import speech_pipeline
+            
+            stream = speech_pipeline.open(started_at=state.get("started_at"))
+            stream.feed(state["answer"])
+            stream.close()
+            
+            state["audio_stream"] = f"/audio_stream/{stream.id}"
+            logger.info(f"  TTS audio stream started: {stream.id}")
+            
+        except Exception as e:
+            logger.error(f"TTS streaming failed: {e}")
+            state["audio_stream"] = None
+            logger.warning("  Falling back to text-only output")
+        
     elif state["mode_output"] == "email":
         try:
             import smtplib
@@ -308,6 +493,11 @@ AI Support Team
     
     return state
 
+# Decision function for FAQ matcher
+def faq_route(state: SupportState) -> str:
+    """Conditional edge function: matched FAQs go straight to output"""
+    return "output_router" if state.get("faq_match") else "intent_analyzer"
+
 # Decision function for accuracy evaluator
 def check_accuracy_route(state: SupportState) -> str:
     """
@@ -322,8 +512,8 @@ def check_accuracy_route(state: SupportState) -> str:
         # Check if we've already retried (prevent infinite loops)
         retry_count = state.get("retry_count", 0)
         if retry_count < 1:  # Allow one retry
+            # retriever_node increments retry_count (edge functions cannot update state)
             logger.warning(f"  ⚠️ Low accuracy ({state['confidence_score']:.2f}) - retriggering retrieval")
-            state["retry_count"] = retry_count + 1
             return "retriever_node"
         else:
             logger.warning("  ⚠️ Max retries reached - proceeding with current answer")
@@ -1,24 +1,27 @@
 """
 PDF OCR processing using DeepSeek/GOT-OCR2.0
+
+PyMuPDF, pdf2image and torch are imported on first use so that importing
+this module does not slow down web-worker startup.
 """
-import fitz  # PyMuPDF
-from pdf2image import convert_from_path
-from PIL import Image
-import torch
 import logging
 from pathlib import Path
 from utils.model_loader import get_ocr_model
-from config import MODELS
+from utils.residency import residency
+from utils.scheduler import scheduler
+from config import MODELS, MODEL_SERVER
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class PDFProcessor:
-    """Process PDFs with OCR using DeepSeek/GOT-OCR2.0"""
+    """
+    Process PDFs with OCR using DeepSeek/GOT-OCR2.0
+    
+    The OCR model is fetched per page rather than kept here, so the residency
+    manager can evict it once uploads go idle.
+    """
     
-    def __init__(self):
-        self.ocr_model = None
-        
     def extract_text_with_ocr(self, pdf_path):
         """
         Extract text from PDF using DeepSeek OCR
@@ -26,10 +29,7 @@ class PDFProcessor:
         """
         try:
             # Try to load OCR model
-            if self.ocr_model is None:
-                self.ocr_model = get_ocr_model()
-            
-            if self.ocr_model:
+            if get_ocr_model():
                 return self._extract_with_got_ocr(pdf_path)
             else:
                 logger.warning("OCR model not available, using PyMuPDF fallback")
@@ -44,64 +44,106 @@ class PDFProcessor:
         """Extract text using GOT-OCR2.0 (DeepSeek's OCR model)"""
         logger.info("Using GOT-OCR2.0 for text extraction")
         
-        model = self.ocr_model['model']
-        tokenizer = self.ocr_model['tokenizer']
+        pages = [text for _, text in self.iter_ocr_pages(pdf_path)]
+        full_text = "\n\n".join(pages)
+        logger.info(f"✅ Extracted {len(full_text)} characters from {len(pages)} pages")
         
-        # Convert PDF to images
-        images = convert_from_path(pdf_path, dpi=150)
+        return full_text
+    
+    def ocr_page(self, pdf_path, page_number):
+        """OCR a single page (1-based) with GOT-OCR2.0"""
+        import torch
+        from pdf2image import convert_from_path
         
-        extracted_text = []
+        # Render only this page so memory does not grow with the page count
+        image = convert_from_path(pdf_path, dpi=150, first_page=page_number, last_page=page_number)[0]
         
-        for i, image in enumerate(images):
-            logger.info(f"Processing page {i+1}/{len(images)}")
+        # Not evicted while the page is processed (reloaded here if it was)
+        with residency.using("ocr"):
+            ocr_model = get_ocr_model()
             
+            # Note: Adjust this based on GOT-OCR2.0's API
+            with torch.no_grad():
+                return ocr_model['model'].chat(
+                    ocr_model['tokenizer'], 
+                    image, 
+                    ocr_type='ocr'  # or 'format' for formatted text
+                )
+    
+    def iter_ocr_pages(self, pdf_path):
+        """Yield (page_number, text) per page using GOT-OCR2.0 (PyMuPDF if unavailable)"""
+        from pdf2image import pdfinfo_from_path
+        
+        if MODEL_SERVER['enabled']:
+            # OCR model lives in the shared model server process
+            from utils.model_server import get_client
+            ocr_page = get_client().ocr_page
+        else:
+            if not get_ocr_model():
+                logger.warning("OCR model not available, using PyMuPDF fallback")
+                yield from self.iter_pymupdf_pages(pdf_path)
+                return
+            ocr_page = self.ocr_page
+        
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        for page_number in range(1, page_count + 1):
+            logger.info(f"Processing page {page_number}/{page_count}")
             try:
-                # Prepare image for model
-                # GOT-OCR2.0 expects PIL Image
-                
-                # Run OCR on image
-                # Note: Adjust this based on GOT-OCR2.0's API
-                with torch.no_grad():
-                    # Format input for the model
-                    # This is a placeholder - adjust based on actual GOT-OCR API
-                    result = model.chat(
-                        tokenizer, 
-                        image, 
-                        ocr_type='ocr'  # or 'format' for formatted text
-                    )
-                
-                extracted_text.append(result)
-                
+                # One page per unit: a query arriving mid-document waits at most one page
+                with scheduler.batch_unit("ocr"):
+                    text = ocr_page(pdf_path, page_number)
             except Exception as e:
-                logger.error(f"Failed to OCR page {i+1}: {e}")
+                logger.error(f"Failed to OCR page {page_number}: {e}")
                 continue
+            yield page_number, text
+    
+    def iter_pymupdf_pages(self, pdf_path):
+        """Yield (page_number, text) per page using PyMuPDF, one page in memory at a time"""
+        import fitz  # PyMuPDF
         
-        full_text = "\n\n".join(extracted_text)
-        logger.info(f"✅ Extracted {len(full_text)} characters from {len(images)} pages")
-        
-        return full_text
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                yield page.number + 1, page.get_text()
     
     def _extract_with_pymupdf(self, pdf_path):
         """Fallback: Extract text using PyMuPDF (no OCR, works only for text PDFs)"""
         logger.info("Using PyMuPDF for text extraction")
         
         try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                text += page.get_text()
-            
-            doc.close()
+            # Join once at the end: repeated += on a str is quadratic in the page count
+            pages = [text for _, text in self.iter_pymupdf_pages(pdf_path)]
+            text = "".join(pages)
             
-            logger.info(f"✅ Extracted {len(text)} characters from {len(doc)} pages")
+            logger.info(f"✅ Extracted {len(text)} characters from {len(pages)} pages")
             return text
             
         except Exception as e:
             logger.error(f"PyMuPDF extraction failed: {e}")
             raise
     
+    def iter_pages_hybrid(self, pdf_path, min_chars=100):
+        """
+        Streaming hybrid extraction: PyMuPDF pages, or OCR pages if the
+        document has less than `min_chars` of text (probably scanned)
+        
+        Only the first pages are held back until min_chars is reached.
+        """
+        buffered = []
+        seen = 0
+        for page in self.iter_pymupdf_pages(pdf_path):
+            if seen >= min_chars:
+                yield page
+                continue
+            buffered.append(page)
+            seen += len(page[1].strip())
+            if seen >= min_chars:
+                yield from buffered
+                buffered = []
+        
+        if seen < min_chars:
+            logger.warning("Extracted text too short, switching to OCR")
+            yield from self.iter_ocr_pages(pdf_path)
+    
     def extract_text_hybrid(self, pdf_path):
         """
         Hybrid approach: Try PyMuPDF first (fast), 
@@ -138,6 +180,11 @@ def extract_text_from_pdf(pdf_path, use_ocr=True, hybrid=True):
     Returns:
         Extracted text as string
     """
+    if MODEL_SERVER['enabled']:
+        # OCR model lives in the shared model server process
+        from utils.model_server import get_client
+        return get_client().ocr(pdf_path, use_ocr=use_ocr, hybrid=hybrid)
+    
     if hybrid:
         return pdf_processor.extract_text_hybrid(pdf_path)
     elif use_ocr:
@@ -146,6 +193,21 @@ def extract_text_from_pdf(pdf_path, use_ocr=True, hybrid=True):
         return pdf_processor._extract_with_pymupdf(pdf_path)
 
 
+def iter_pdf_pages(pdf_path, use_ocr=True, hybrid=True):
+    """
+    Streaming variant of extract_text_from_pdf
+    
+    Yields:
+        (page_number, text) pairs, one page at a time (page numbers are 1-based)
+    """
+    if hybrid:
+        return pdf_processor.iter_pages_hybrid(pdf_path)
+    elif use_ocr:
+        return pdf_processor.iter_ocr_pages(pdf_path)
+    else:
+        return pdf_processor.iter_pymupdf_pages(pdf_path)
+
+
 # Alternative: Simple OCR function using EasyOCR (if GOT-OCR doesn't work)
 def extract_with_easyocr(pdf_path):
     """
@@ -154,6 +216,8 @@ def extract_with_easyocr(pdf_path):
     """
     try:
         import easyocr
+        import torch
+        from pdf2image import convert_from_path
         
         logger.info("Using EasyOCR for text extraction")
         
@@ -0,0 +1,232 @@
+"""
+ONNX Runtime embedding backend (int8-quantized, CPU)
+
+Exports the sentence-transformers model to ONNX once, optionally applies
+dynamic int8 quantization, and runs it through onnxruntime with mean pooling
+and L2 normalization, matching HuggingFaceEmbeddings(normalize_embeddings=True).
+
+Select it with MODELS["embeddings"]["backend"] = "onnx" (or EMBEDDINGS_BACKEND=onnx).
+
+Accuracy check against the fp32 PyTorch vectors:
+    python -m utils.onnx_embeddings --check
+"""
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from config import MODELS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FP32_FILENAME = "model.onnx"
+INT8_FILENAME = "model.int8.onnx"
+
+
+def _publish(write, path):
+    """
+    Run write(scratch_path) in a private scratch directory, then move the files to path's directory
+
+    Side files (tokenizer files, ONNX external data such as model.onnx.data)
+    are moved first, so path only ever appears complete. Another worker may
+    be exporting at the same time; the last rename wins.
+    """
+    scratch = Path(tempfile.mkdtemp(dir=path.parent, prefix=".export."))
+    try:
+        write(scratch / path.name)
+        for name in sorted(os.listdir(scratch), key=lambda name: name == path.name):
+            os.replace(scratch / name, path.parent / name)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def export_onnx_model(model_path, export_dir, quantize=True):
+    """
+    Export a Hugging Face encoder to ONNX and optionally quantize it
+
+    Files are written in a scratch directory and renamed into place, so
+    model.onnx / model.int8.onnx only exist once complete, with the
+    tokenizer saved next to them.
+
+    Returns:
+        Path to the ONNX file to load
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+
+    export_dir = Path(export_dir)
+    fp32_path = export_dir / FP32_FILENAME
+    int8_path = export_dir / INT8_FILENAME
+
+    if not fp32_path.exists():
+        logger.info(f"Exporting embeddings model to ONNX: {fp32_path}")
+        export_dir.mkdir(parents=True, exist_ok=True)
+
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModel.from_pretrained(model_path)
+        model.eval()
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        def export(path):
+            tokenizer.save_pretrained(str(path.parent))
+            with torch.no_grad():
+                torch.onnx.export(
+                    model,
+                    tuple(sample[name] for name in input_names),
+                    str(path),
+                    input_names=input_names,
+                    output_names=["last_hidden_state"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=14
+                )
+        _publish(export, fp32_path)
+
+    if not quantize:
+        return fp32_path
+
+    if not int8_path.exists():
+        logger.info(f"Quantizing ONNX model to int8: {int8_path}")
+        import onnx
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        # From a loaded model: given a path, it writes model-inferred.onnx next to it, which
+        # workers quantizing at the same time would share
+        model = onnx.load(str(fp32_path))
+        _publish(lambda path: quantize_dynamic(model, str(path), weight_type=QuantType.QInt8), int8_path)
+
+    return int8_path
+
+
+class OnnxEmbeddings:
+    """LangChain-compatible embeddings running on onnxruntime"""
+
+    def __init__(self, model_path=None, export_dir=None, quantize=None,
+                 intra_op_threads=None, batch_size=None, max_seq_length=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        cfg = MODELS['embeddings']['onnx']
+        model_path = model_path or MODELS['embeddings'].get('model_path') or MODELS['embeddings']['model_name']
+        export_dir = export_dir or cfg['export_dir']
+        quantize = cfg['quantize'] if quantize is None else quantize
+
+        self.batch_size = batch_size or cfg['batch_size']
+        self.max_seq_length = max_seq_length or cfg['max_seq_length']
+
+        onnx_path = self.onnx_path = export_onnx_model(model_path, export_dir, quantize=quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(export_dir))
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or cfg['intra_op_threads']
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(
+            str(onnx_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"✅ ONNX embeddings ready ({onnx_path.name}, {options.intra_op_num_threads} threads)")
+
+    def _embed_batch(self, texts):
+        import numpy as np
+
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np"
+        )
+        inputs = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+        last_hidden = self.session.run(None, inputs)[0]
+
+        # Mean pooling over non-padding tokens, then L2 normalize
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        summed = (last_hidden * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = summed / counts
+        norms = np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return (pooled / norms).tolist()
+
+    def embed_documents(self, texts):
+        """Embed a list of documents in batches"""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(list(texts[start:start + self.batch_size])))
+        return vectors
+
+    def embed_query(self, text):
+        """Embed a single query"""
+        return self._embed_batch([text])[0]
+
+
+def check_accuracy(texts=None):
+    """
+    Compare ONNX vectors against the fp32 PyTorch (HuggingFaceEmbeddings) vectors
+
+    Returns:
+        Dict with min/mean cosine similarity between the two backends
+    """
+    import numpy as np
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    texts = texts or [
+        "How do I reset my device to factory settings?",
+        "The battery drains quickly after the latest firmware update.",
+        "Can you add dark mode to the companion app?",
+        "Warranty coverage does not include water damage.",
+        "Press and hold the power button for ten seconds.",
+        "Error code E42 means the filter needs to be replaced.",
+    ]
+
+    reference = HuggingFaceEmbeddings(
+        model_name=MODELS['embeddings'].get('model_path') or MODELS['embeddings']['model_name'],
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+    candidate = OnnxEmbeddings()
+
+    ref = np.array(reference.embed_documents(texts))
+    onnx = np.array(candidate.embed_documents(texts))
+    cosine = (ref * onnx).sum(axis=1)  # both sides are L2-normalized
+
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ONNX embedding backend utilities")
+    parser.add_argument("--check", action="store_true", help="Compare ONNX vs fp32 vectors")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Minimum acceptable cosine similarity")
+    args = parser.parse_args()
+
+    if args.check:
+        result = check_accuracy()
+        print(f"Texts compared:   {result['texts']}")
+        print(f"Min cosine:       {result['min_cosine']:.4f}")
+        print(f"Mean cosine:      {result['mean_cosine']:.4f}")
+        if result['min_cosine'] < args.min_cosine:
+            print(f"❌ ONNX vectors drift below {args.min_cosine} cosine similarity")
+            raise SystemExit(1)
+        print("✅ ONNX embeddings match the fp32 model")
+    else:
+        # Export (and quantize) ahead of time so the first request does not pay for it
+        cfg = MODELS['embeddings']['onnx']
+        path = export_onnx_model(
+            MODELS['embeddings'].get('model_path') or MODELS['embeddings']['model_name'],
+            cfg['export_dir'],
+            quantize=cfg['quantize']
+        )
+        print(f"✅ ONNX model ready: {path}")
\ No newline at end of file
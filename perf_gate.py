@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Performance regression gate
+Runs a fixed benchmark scenario (stub models + real splitter, Chroma and
+PyMuPDF) and compares it against the committed baseline in perf_baseline.json.
+Fails when p95 latency or throughput regresses past the tolerance.
+
+Usage:
+    python perf_gate.py                      # compare against the baseline
+    python perf_gate.py --tolerance 0.3      # allow 30% regression
+    python perf_gate.py --update-baseline    # record a new baseline
+
+Baselines are machine-specific: record them on the same hardware the gate runs on.
+The committed baseline stores its machine, package versions and repeat count
+under "environment"; the gate warns when the current setup differs.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+from datetime import datetime
+from importlib import metadata
+from pathlib import Path
+
+from benchmark_components import run_benchmarks, print_section
+
+BASELINE_PATH = Path(__file__).resolve().parent / "perf_baseline.json"
+
+# Fixed scenario: keep this stable so results stay comparable with the baseline
+SCENARIO = {
+    "benchmarks": ["splitter", "token_splitter", "embeddings", "chroma", "prompt", "pipeline", "pymupdf"],
+    "chroma_sizes": [10_000],
+}
+
+# Libraries whose version changes the benchmark numbers; recorded with the baseline
+BASELINE_PACKAGES = ["chromadb", "langchain", "langchain-community", "langchain-core", "langgraph", "PyMuPDF", "numpy"]
+
+def environment():
+    """Machine and library details stored next to a baseline"""
+    packages = {}
+    for name in BASELINE_PACKAGES:
+        try:
+            packages[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            packages[name] = None
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor() or None,
+        "cpus": os.cpu_count(),
+        "packages": packages,
+    }
+
+def run_scenario(repeat):
+    """Run the scenario `repeat` times and keep the median of each metric"""
+    runs = [run_benchmarks(SCENARIO["benchmarks"], SCENARIO["chroma_sizes"]) for _ in range(repeat)]
+    results = {}
+    for name in runs[0]:
+        samples = [run[name] for run in runs if name in run]
+        results[name] = {
+            "p95_s": statistics.median(s["p95_s"] for s in samples),
+            "items_per_s": statistics.median(s["items_per_s"] for s in samples),
+        }
+    return results
+
+def compare(results, baseline, tolerance, noise_floor_ms=1.0):
+    """
+    Return (rows, failures) comparing results against the baseline
+
+    Benchmarks whose p95 stays under noise_floor_ms in both runs are reported
+    but not gated: at that scale scheduler jitter exceeds any tolerance.
+    """
+    rows = []
+    failures = []
+    for name, old in baseline.items():
+        new = results.get(name)
+        if new is None:
+            rows.append((name, "missing", "", "", "❌"))
+            failures.append(f"{name}: benchmark did not run")
+            continue
+
+        p95_change = (new["p95_s"] - old["p95_s"]) / old["p95_s"] if old["p95_s"] else 0.0
+        tput_change = (new["items_per_s"] - old["items_per_s"]) / old["items_per_s"] if old["items_per_s"] else 0.0
+
+        status = "✅"
+        if max(old["p95_s"], new["p95_s"]) * 1000 < noise_floor_ms:
+            status = "〰️"
+        elif p95_change > tolerance:
+            status = "❌"
+            failures.append(
+                f"{name}: p95 {old['p95_s'] * 1000:.2f}ms -> {new['p95_s'] * 1000:.2f}ms ({p95_change:+.0%})"
+            )
+        if tput_change < -tolerance and status != "〰️":
+            status = "❌"
+            failures.append(
+                f"{name}: throughput {old['items_per_s']:.1f}/s -> {new['items_per_s']:.1f}/s ({tput_change:+.0%})"
+            )
+        rows.append((
+            name,
+            f"{old['p95_s'] * 1000:.2f} -> {new['p95_s'] * 1000:.2f}",
+            f"{p95_change:+.0%}",
+            f"{tput_change:+.0%}",
+            status
+        ))
+
+    for name in results:
+        if name not in baseline:
+            rows.append((name, "new (not in baseline)", "", "", "➕"))
+    return rows, failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail on performance regressions against a stored baseline")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH), help="Baseline JSON path")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    parser.add_argument("--repeat", type=int, default=3, help="Scenario repetitions (median is used)")
+    parser.add_argument("--noise-floor-ms", type=float, default=1.0,
+                        help="Do not gate benchmarks whose p95 stays below this (default 1.0)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = run_scenario(args.repeat)
+    baseline_path = Path(args.baseline)
+
+    if args.update_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump({
+                "recorded": datetime.now().isoformat(),
+                "platform": platform.platform(),
+                "python": sys.version.split()[0],
+                "environment": environment(),
+                "repeat": args.repeat,
+                "scenario": SCENARIO,
+                "results": results,
+            }, f, indent=2)
+        print(f"\n📄 Baseline updated: {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"\n❌ No baseline at {baseline_path}")
+        print("   Record one on the reference machine: python perf_gate.py --update-baseline")
+        sys.exit(2)
+
+    with open(baseline_path) as f:
+        stored = json.load(f)
+
+    if stored.get("scenario") != SCENARIO:
+        print("⚠️  Baseline was recorded with a different scenario - consider --update-baseline")
+    if stored.get("platform") != platform.platform():
+        print(f"⚠️  Baseline platform differs: {stored.get('platform')}")
+    if stored.get("environment", {}).get("packages") not in (None, environment()["packages"]):
+        print(f"⚠️  Baseline package versions differ: {stored['environment']['packages']}")
+
+    rows, failures = compare(results, stored["results"], args.tolerance, args.noise_floor_ms)
+
+    print_section(f"📊 Performance vs baseline (tolerance {args.tolerance:.0%})")
+    print(f"{'benchmark':34} {'p95 ms (old -> new)':>24} {'p95':>7} {'tput':>7}")
+    for name, p95, p95_change, tput_change, status in rows:
+        print(f"{status} {name:32} {p95:>24} {p95_change:>7} {tput_change:>7}")
+
+    if failures:
+        print("\n❌ Performance regressions:")
+        for failure in failures:
+            print(f"   - {failure}")
+        sys.exit(1)
+
+    print("\n✅ No performance regressions")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
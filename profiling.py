@@ -0,0 +1,190 @@
+"""
+Opt-in per-request profiling
+
+A request is profiled when PROFILING["enabled"] is set, or when it carries a
+valid signature header: hex HMAC-SHA256(PROFILING["secret"], X-Request-ID).
+Profiles are written to PROFILING["output_dir"], tagged with the request id:
+- sampling mode: <request_id>.folded (collapsed stacks for flamegraph.pl/speedscope)
+- deterministic mode: <request_id>.prof (cProfile, for snakeviz/flameprof)
+plus <request_id>.json with the endpoint, duration and node breakdown.
+Client-supplied request ids are only used when they are safe in a file name
+(see request_id_from).
+
+When profiling is off, should_profile() returns immediately and nothing else runs.
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from config import PROFILING
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def request_id_from(header_value):
+    """The caller's X-Request-ID if it is a plain token, otherwise a fresh id"""
+    if header_value and _REQUEST_ID.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """Decides which requests to profile and writes their profiles"""
+
+    def __init__(self, config=PROFILING):
+        self.config = config
+        self.active = bool(config["enabled"] or config["secret"])
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def _signature_valid(self, headers, request_id):
+        signature = headers.get(self.config["header"])
+        # compare_digest raises TypeError on non-ASCII str; such a header is never a hex digest anyway
+        if not signature or not signature.isascii() or not self.config["secret"]:
+            return False
+        expected = hmac.new(self.config["secret"].encode(), request_id.encode(), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+
+    def _within_rate(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.config["max_per_minute"]:
+                return False
+            self._recent.append(now)
+            return True
+
+    def should_profile(self, endpoint, headers, request_id):
+        """True if this request should run under the profiler"""
+        if not self.active or endpoint not in self.config["endpoints"]:
+            return False
+        if not (self.config["enabled"] or self._signature_valid(headers, request_id)):
+            return False
+        if not self._within_rate():
+            logger.warning(f"Profiling rate limit reached, skipping request {request_id}")
+            return False
+        return True
+
+    def start(self):
+        """Start profiling the current thread; returns a handle for stop()"""
+        if self.config["mode"] == "deterministic":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        sampler = StackSampler(threading.get_ident(), self.config["sample_interval"])
+        sampler.start()
+        return sampler
+
+    def stop(self, handle, request_id, endpoint, duration, node_timings=None):
+        """
+        Stop profiling and write the profile plus a metadata sidecar
+
+        Never raises: the request has already been answered, so a failure to
+        write the profile is only logged.
+        """
+        if isinstance(handle, cProfile.Profile):
+            handle.disable()
+        else:
+            handle.stop()
+        try:
+            self._write(handle, request_id, endpoint, duration, node_timings)
+            self._enforce_disk_cap()
+        except Exception as e:
+            logger.error(f"❌ Failed to write profile for request {request_id}: {e}")
+
+    def _write(self, handle, request_id, endpoint, duration, node_timings):
+        output_dir = self.config["output_dir"]
+        os.makedirs(output_dir, exist_ok=True)
+        base = os.path.join(output_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{request_id}")
+
+        if isinstance(handle, cProfile.Profile):
+            profile_path = f"{base}.prof"
+            handle.dump_stats(profile_path)
+        else:
+            profile_path = f"{base}.folded"
+            handle.write(profile_path)
+
+        with open(f"{base}.json", "w") as f:
+            json.dump({
+                "request_id": request_id,
+                "endpoint": endpoint,
+                "mode": self.config["mode"],
+                "duration_s": round(duration, 4),
+                "node_timings_s": node_timings or {},
+                "profile": os.path.basename(profile_path),
+            }, f, indent=2)
+
+        logger.info(f"📈 Profile written: {profile_path}")
+
+    def _enforce_disk_cap(self):
+        """Delete the oldest profiles until the directory fits in max_disk_mb"""
+        output_dir = self.config["output_dir"]
+        files = []
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            try:
+                if not os.path.isfile(path):
+                    continue
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue  # Removed by a concurrent request's cleanup
+            files.append((info.st_mtime, info.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        limit = self.config["max_disk_mb"] * 1024 * 1024
+        while files and total > limit:
+            _, size, oldest = files.pop(0)
+            total -= size
+            try:
+                os.remove(oldest)
+            except FileNotFoundError:
+                pass
+
+
+request_profiler = RequestProfiler()
\ No newline at end of file
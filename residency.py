@@ -0,0 +1,216 @@
+"""
+Memory-budgeted model residency
+
+LocalModelManager reports every model it loads here with its measured
+footprint. Loading a model first makes room for it: unpinned models that
+are not in use are evicted in least-recently-used order until the new model
+fits MODEL_RESIDENCY['budget_mb']. Models idle longer than their
+idle_unload_seconds are evicted as well (the OCR model is only needed during
+uploads). Evicted models reload on their next use.
+
+Eviction either drops a model (its weights reload from the local checkpoint,
+which from_pretrained memory-maps) or, with offload "cpu", moves it to host
+memory so the reload is a device copy instead of a disk read.
+"""
+import gc
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import MODEL_RESIDENCY
+from utils.metrics import MODEL_RESIDENT_BYTES, MODEL_RESIDENCY_EVENTS, MODEL_LOAD_LATENCY
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def module_bytes(module):
+    """Parameter and buffer bytes of a torch module (0 for anything else)"""
+    if module is None or not hasattr(module, "parameters"):
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ResidencyManager:
+    """
+    Tracks loaded models and keeps them within a memory budget
+
+    Args:
+        budget_bytes: Memory all resident models may use together (0 = no limit)
+        pinned: Models that are never evicted
+        offload: Model name -> "drop" or "cpu"
+        idle_unload_seconds: Model name -> seconds idle before it is evicted
+        estimated_bytes: Model name -> footprint to plan for before its first load
+    """
+
+    def __init__(self, budget_bytes=0, pinned=(), offload=None, idle_unload_seconds=None, estimated_bytes=None):
+        self.budget_bytes = budget_bytes
+        self.pinned = set(pinned)
+        self.offload = offload or {}
+        self.idle_unload_seconds = idle_unload_seconds or {}
+        self.estimated_bytes = estimated_bytes or {}
+        self._models = OrderedDict()  # LRU order, least recently used first
+        self._lock = threading.RLock()
+
+    def register(self, name, unload, offload=None, restore=None):
+        """
+        Callbacks for a model slot
+
+        Args:
+            unload: Drops the model's references so its memory can be freed
+            offload: Moves the model to host memory; returns False if it cannot
+            restore: Moves an offloaded model back to its device
+        """
+        with self._lock:
+            entry = self._entry(name)
+            entry.update(unload=unload, offload=offload, restore=restore)
+
+    def _entry(self, name):
+        if name not in self._models:
+            self._models[name] = {
+                "state": "unloaded", "bytes": 0, "in_use": 0, "last_used": 0.0, "loads": 0,
+                "unload": None, "offload": None, "restore": None,
+            }
+        return self._models[name]
+
+    def _resident_bytes(self):
+        return sum(e["bytes"] for e in self._models.values() if e["state"] == "resident")
+
+    def make_room(self, name):
+        """Evict least recently used models until `name` fits the budget (call before loading it)"""
+        with self._lock:
+            self._evict_idle()
+            needed = self._entry(name)["bytes"] or self.estimated_bytes.get(name, 0)
+            self._evict_lru(needed, exclude=name)
+
+    def loaded(self, name, footprint, load_seconds):
+        """Record a finished load"""
+        with self._lock:
+            entry = self._entry(name)
+            event = "reload" if entry["loads"] else "load"
+            entry.update(state="resident", bytes=footprint, last_used=time.monotonic())
+            entry["loads"] += 1
+            self._models.move_to_end(name)
+            MODEL_RESIDENT_BYTES.set(footprint, model=name)
+            MODEL_RESIDENCY_EVENTS.inc(model=name, event=event)
+            MODEL_LOAD_LATENCY.observe(load_seconds, model=name)
+            logger.info(f"📦 {name} resident ({footprint / MB:.0f} MB, {event} in {load_seconds:.1f}s)")
+            # Footprint may exceed the estimate used by make_room
+            self._evict_lru(0, exclude=name)
+
+    def touch(self, name):
+        """Mark a model as just used"""
+        with self._lock:
+            entry = self._entry(name)
+            entry["last_used"] = time.monotonic()
+            self._models.move_to_end(name)
+
+    @contextmanager
+    def using(self, name):
+        """Keep a model from being evicted while the block runs (restores it if offloaded)"""
+        with self._lock:
+            self._evict_idle(exclude=name)
+            entry = self._entry(name)
+            if entry["state"] == "offloaded":
+                self._evict_lru(entry["bytes"], exclude=name)
+                start = time.perf_counter()
+                entry["restore"]()
+                entry["state"] = "resident"
+                MODEL_RESIDENT_BYTES.set(entry["bytes"], model=name)
+                MODEL_RESIDENCY_EVENTS.inc(model=name, event="restore")
+                MODEL_LOAD_LATENCY.observe(time.perf_counter() - start, model=name)
+            entry["in_use"] += 1
+            self.touch(name)
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry["in_use"] -= 1
+                entry["last_used"] = time.monotonic()
+
+    def evict(self, name, reason="manual"):
+        """Evict one model now (offloading it if configured); returns False if pinned or in use"""
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None or entry["state"] != "resident" or entry["in_use"]:
+                return False
+            if reason != "manual" and name in self.pinned:
+                return False
+
+            offloaded = (
+                self.offload.get(name) == "cpu" and entry["offload"] is not None and entry["offload"]()
+            )
+            if offloaded:
+                entry["state"] = "offloaded"
+                MODEL_RESIDENCY_EVENTS.inc(model=name, event="offload")
+            else:
+                if entry["unload"] is not None:
+                    entry["unload"]()
+                entry["state"] = "unloaded"
+                MODEL_RESIDENCY_EVENTS.inc(model=name, event="evict")
+            MODEL_RESIDENT_BYTES.set(0, model=name)
+            logger.info(f"♻️  {'Offloaded' if offloaded else 'Evicted'} {name} ({reason}, {entry['bytes'] / MB:.0f} MB)")
+        _free_memory()
+        return True
+
+    def _evict_lru(self, needed, exclude):
+        if not self.budget_bytes:
+            return
+        for name in list(self._models):
+            if self._resident_bytes() + needed <= self.budget_bytes:
+                return
+            if name != exclude:
+                self.evict(name, reason="budget")
+        if self._resident_bytes() + needed > self.budget_bytes:
+            logger.warning(
+                f"Model memory over budget: {(self._resident_bytes() + needed) / MB:.0f} MB "
+                f"> {self.budget_bytes / MB:.0f} MB (remaining models are pinned or in use)"
+            )
+
+    def _evict_idle(self, exclude=None):
+        now = time.monotonic()
+        for name, entry in list(self._models.items()):
+            limit = self.idle_unload_seconds.get(name)
+            if limit and name != exclude and entry["state"] == "resident" and now - entry["last_used"] > limit:
+                self.evict(name, reason="idle")
+
+    def snapshot(self):
+        """Residency of every known model, for /health"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "budget_mb": round(self.budget_bytes / MB) if self.budget_bytes else None,
+                "resident_mb": round(self._resident_bytes() / MB),
+                "models": {
+                    name: {
+                        "state": entry["state"],
+                        "mb": round(entry["bytes"] / MB),
+                        "pinned": name in self.pinned,
+                        "in_use": entry["in_use"],
+                        "loads": entry["loads"],
+                        "idle_s": round(now - entry["last_used"], 1) if entry["last_used"] else None,
+                    }
+                    for name, entry in self._models.items()
+                },
+            }
+
+
+def _free_memory():
+    gc.collect()
+    # Only touch torch if a loader already imported it
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+residency = ResidencyManager(
+    budget_bytes=MODEL_RESIDENCY['budget_mb'] * MB,
+    pinned=MODEL_RESIDENCY['pinned'],
+    offload=MODEL_RESIDENCY['offload'],
+    idle_unload_seconds=MODEL_RESIDENCY['idle_unload_seconds'],
+    estimated_bytes={name: mb * MB for name, mb in MODEL_RESIDENCY['estimated_mb'].items()},
+)
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Priority-aware work scheduler shared by query serving and ingestion
+
+Graph model nodes run as interactive work. Ingestion (OCR pages, embedding
+and vector store batches, FAQ generation) and /ask_batch run as batch work,
+split into small units. Before each unit, batch work waits while interactive
+work is running, so a query preempts ingestion at the next unit boundary
+instead of queueing behind a whole PDF. While queries keep arriving, batch
+units are also held to WORK_SCHEDULER['batch_share'] of model time over a
+sliding window; on an otherwise idle server they run at full speed. No unit
+waits longer than max_batch_wait, so ingestion cannot starve.
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import WORK_SCHEDULER
+from utils.metrics import BATCH_UNIT_WAIT, BATCH_MODEL_SHARE, QUERY_LATENCY
+
+
+class WorkScheduler:
+    """Interactive work first; batch work in units, within a share of model time"""
+
+    def __init__(self, batch_share, window_seconds, max_batch_wait):
+        self.batch_share = batch_share
+        self.window_seconds = window_seconds
+        self.max_batch_wait = max_batch_wait
+        self._cond = threading.Condition()
+        self._interactive = 0
+        self._last_interactive = -math.inf
+        self._batch_jobs = 0
+        self._batch_units = deque()  # (start, end) of finished batch units in the window
+
+    @contextmanager
+    def interactive(self):
+        """Mark latency-sensitive model work (batch units wait while any is running)"""
+        with self._cond:
+            self._interactive += 1
+            self._last_interactive = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._interactive -= 1
+                self._last_interactive = time.monotonic()
+                self._cond.notify_all()
+
+    @contextmanager
+    def batch_job(self):
+        """Mark a whole batch job (an upload, an FAQ run) so query latency can be split by it"""
+        with self._cond:
+            self._batch_jobs += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._batch_jobs -= 1
+
+    def batch_active(self):
+        return self._batch_jobs > 0
+
+    def _batch_seconds(self, now):
+        """Batch unit time within the sliding window"""
+        window_start = now - self.window_seconds
+        while self._batch_units and self._batch_units[0][1] < window_start:
+            self._batch_units.popleft()
+        return sum(end - max(start, window_start) for start, end in self._batch_units)
+
+    def _batch_may_run(self, now):
+        if self._interactive:
+            return False
+        if now - self._last_interactive > self.window_seconds:
+            return True  # No recent queries: use the whole machine
+        return self._batch_seconds(now) < self.batch_share * self.window_seconds
+
+    @contextmanager
+    def batch_unit(self, kind):
+        """Run one unit of batch work once interactive work and the batch share allow it"""
+        start = time.monotonic()
+        deadline = start + self.max_batch_wait
+        with self._cond:
+            now = start
+            while not self._batch_may_run(now) and now < deadline:
+                # The share frees up as time passes, so poll as well as wait for notify
+                self._cond.wait(min(deadline - now, 0.05))
+                now = time.monotonic()
+        BATCH_UNIT_WAIT.observe(time.monotonic() - start, kind=kind)
+
+        unit_start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self._cond:
+                self._batch_units.append((unit_start, end))
+                BATCH_MODEL_SHARE.set(round(self._batch_seconds(end) / self.window_seconds, 3))
+
+    def snapshot(self):
+        """Running work, batch share and query p99 with and without batch work, for /health"""
+        with self._cond:
+            share = self._batch_seconds(time.monotonic()) / self.window_seconds
+            running = {"interactive": self._interactive, "batch_jobs": self._batch_jobs}
+
+        def p99(during_batch):
+            value = QUERY_LATENCY.quantile(0.99, during_batch=during_batch)
+            if value is None or math.isfinite(value):
+                return value
+            return f">{QUERY_LATENCY.buckets[-1]}"
+
+        return {
+            **running,
+            "batch_model_share": round(share, 3),
+            "batch_share_cap": self.batch_share,
+            "query_p99_s": {"idle": p99("false"), "during_batch": p99("true")},
+        }
+
+
+class _Unscheduled:
+    """Stand-in when WORK_SCHEDULER is disabled: nothing waits"""
+
+    @contextmanager
+    def interactive(self):
+        yield
+
+    @contextmanager
+    def batch_job(self):
+        yield
+
+    @contextmanager
+    def batch_unit(self, kind):
+        yield
+
+    def batch_active(self):
+        return False
+
+    def snapshot(self):
+        return {"enabled": False}
+
+
+if WORK_SCHEDULER['enabled']:
+    scheduler = WorkScheduler(
+        WORK_SCHEDULER['batch_share'], WORK_SCHEDULER['window_seconds'], WORK_SCHEDULER['max_batch_wait']
+    )
+else:
+    scheduler = _Unscheduled()
+
+
+@contextmanager
+def timed_query():
+    """Record a query's latency, labelled by whether batch work overlapped it"""
+    during_batch = scheduler.batch_active()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        during_batch = during_batch or scheduler.batch_active()
+        QUERY_LATENCY.observe(time.perf_counter() - start, during_batch=str(during_batch).lower())
\ No newline at end of file
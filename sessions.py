@@ -0,0 +1,71 @@
+"""
+Conversation history for multi-turn /ask sessions
+
+Each session keeps its most recent turns (question and answer text) so
+follow-up questions can be resolved: the retriever adds recent user turns to
+its query, and the response generator replays the history when the model has
+no cached KV prefix for the session (see LocalModelManager.generate_in_session).
+
+Histories live in process memory, bounded by SESSIONS['max_sessions'] (LRU)
+and expired after SESSIONS['ttl_seconds'] of inactivity. With several web
+workers, route a session to the same worker (sticky sessions) to keep both
+its history and its KV cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from config import SESSIONS
+
+
+class SessionStore:
+    """LRU of session_id -> recent turns, with idle expiry"""
+
+    def __init__(self, max_sessions=None, ttl_seconds=None, max_turns=None):
+        self.max_sessions = max_sessions or SESSIONS['max_sessions']
+        self.ttl_seconds = ttl_seconds or SESSIONS['ttl_seconds']
+        self.max_turns = max_turns or SESSIONS['history_turns']
+        self._sessions = OrderedDict()  # session_id -> {"turns", "turn_count", "updated"}
+        self._lock = threading.Lock()
+
+    def _get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is not None and time.monotonic() - session["updated"] > self.ttl_seconds:
+            del self._sessions[session_id]
+            session = None
+        return session
+
+    def history(self, session_id):
+        """
+        Recent turns of a session
+
+        Returns:
+            (turns, turn_count): up to max_turns {"user", "assistant"} dicts,
+            oldest first, and the number of turns the session has had in total
+        """
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                return [], 0
+            self._sessions.move_to_end(session_id)
+            return list(session["turns"]), session["turn_count"]
+
+    def append(self, session_id, user_input, answer):
+        """Record a finished turn"""
+        with self._lock:
+            session = self._get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = {"turns": [], "turn_count": 0, "updated": 0.0}
+            session["turns"] = (session["turns"] + [{"user": user_input, "assistant": answer}])[-self.max_turns:]
+            session["turn_count"] += 1
+            session["updated"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def end(self, session_id):
+        """Forget a session"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+session_store = SessionStore()
\ No newline at end of file
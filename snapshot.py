@@ -0,0 +1,434 @@
+"""
+Vector index snapshots for warming up new serving nodes
+
+export_snapshot() writes the vector collections (VECTOR_DB's chunks and the
+FAQ question index) as one versioned, gzip-compressed tar: chunk text and
+metadata, the exact float32 vectors and, for compact stores, the fitted
+codec. Given a base snapshot it writes only the chunks added since.
+import_snapshot() bulk-loads an artifact into the configured store (Chroma or
+compact) without re-running OCR or embeddings, and applies a delta only on
+top of the snapshot it was taken from.
+
+Ingestion only appends, so an export is a consistent cut even while a writer
+is active: compact collections are read up to the row count fixed when the
+export starts (SQLite rows are committed before their vectors are appended),
+Chroma collections up to the ids listed when the export starts. There is no
+separate lexical index in this tree; chunk text travels with the vectors.
+
+Run with:
+    python -m utils.snapshot export [--base snapshots/<id>.tar.gz]
+    python -m utils.snapshot import snapshots/<id>.tar.gz [--replace]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tarfile
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from config import VECTOR_DB, VECTOR_SNAPSHOT, FAQ_PRECOMPUTE, MODELS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+BLOCK_ROWS = 65536  # Rows read or loaded at a time
+CHROMA_BATCH = 5000  # Chroma rejects very large get/upsert calls
+STATE_FILE = "snapshot_state.json"  # Last snapshot applied to this node's persist_directory
+
+
+class SnapshotError(RuntimeError):
+    """Raised when a snapshot cannot be exported or applied"""
+
+
+def store_kind():
+    return "chroma" if VECTOR_DB['compression']['mode'] == "none" else "compact"
+
+
+def default_collections():
+    return [VECTOR_DB['collection_name'], FAQ_PRECOMPUTE['collection_name']]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _chroma(name):
+    from langchain.vectorstores import Chroma
+    return Chroma(persist_directory=VECTOR_DB['persist_directory'], embedding_function=None, collection_name=name)
+
+
+def _compact_directory(name, persist_directory=None):
+    return Path(persist_directory or VECTOR_DB['persist_directory']) / f"{name}.compact"
+
+
+def _compact_rows(directory):
+    """(rows, dim) of a compact collection directory, counting only rows whose vector is complete"""
+    if not (directory / "meta.json").exists():
+        return 0, None
+    dim = json.loads((directory / "meta.json").read_text())["dim"]
+    path = directory / "vectors.f32"
+    return (path.stat().st_size // (4 * dim) if path.exists() else 0), dim
+
+
+class _CollectionWriter:
+    """chunks.jsonl and vectors.f32 (same row order) for one collection of a snapshot"""
+
+    def __init__(self, directory):
+        directory.mkdir()
+        self.chunks = open(directory / "chunks.jsonl", "w", encoding="utf-8")
+        self.vectors = open(directory / "vectors.f32", "wb")
+        self.rows = 0
+        self.dim = None
+
+    def write(self, ids, texts, metadatas, vectors):
+        import numpy as np
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            self.chunks.write(json.dumps({"id": chunk_id, "text": text, "metadata": metadata}) + "\n")
+        vectors.tofile(self.vectors)
+        self.rows += len(texts)
+        self.dim = self.dim or int(vectors.shape[1])
+
+    def close(self):
+        self.chunks.close()
+        self.vectors.close()
+
+
+def _export_compact(name, directory, base_info):
+    import numpy as np
+
+    source = _compact_directory(name)
+    # Fix the cut first: every row with a complete vector already has its SQLite row
+    rows, dim = _compact_rows(source)
+    if not rows:
+        return None
+    start = base_info["total_rows"] if base_info else 0
+    if rows < start:
+        raise SnapshotError(f"{name} has fewer rows than the base snapshot; export a full snapshot")
+
+    meta = json.loads((source / "meta.json").read_text())
+    vectors = np.memmap(source / "vectors.f32", dtype=np.float32, mode="r", shape=(rows, dim))
+    db = sqlite3.connect(str(source / "chunks.sqlite"))
+    writer = _CollectionWriter(directory)
+    try:
+        for block in range(start, rows, BLOCK_ROWS):
+            end = min(block + BLOCK_ROWS, rows)
+            found = db.execute(
+                "SELECT id, text, metadata FROM chunks WHERE id >= ? AND id < ? ORDER BY id", (block, end)
+            ).fetchall()
+            if len(found) != end - block:
+                raise SnapshotError(f"{name}: rows {block}-{end} have vectors but no text")
+            writer.write(
+                [row[0] for row in found], [row[1] for row in found],
+                [json.loads(row[2]) for row in found], vectors[block:end]
+            )
+    finally:
+        db.close()
+        writer.close()
+    if (source / "codec.npz").exists():
+        (directory / "codec.npz").write_bytes((source / "codec.npz").read_bytes())
+
+    return {
+        "rows": writer.rows,
+        "start_row": start,
+        "total_rows": rows,
+        "dim": dim,
+        "settings": {key: meta[key] for key in ("mode", "reduction", "dims")},
+    }
+
+
+def _export_chroma(name, directory, base_ids):
+    collection = _chroma(name)._collection
+    ids = collection.get(include=[])["ids"]
+    if not ids:
+        return None
+    if base_ids is not None and not base_ids <= set(ids):
+        raise SnapshotError(f"{name} lost chunks since the base snapshot; export a full snapshot")
+    new = [i for i in ids if i not in base_ids] if base_ids is not None else ids
+
+    writer = _CollectionWriter(directory)
+    try:
+        for offset in range(0, len(new), CHROMA_BATCH):
+            found = collection.get(
+                ids=new[offset:offset + CHROMA_BATCH], include=["embeddings", "documents", "metadatas"]
+            )
+            writer.write(found["ids"], found["documents"], found["metadatas"], found["embeddings"])
+    finally:
+        writer.close()
+    # Every id at the cut, so this snapshot can be the base of the next delta
+    (directory / "ids.txt").write_text("\n".join(ids))
+    return {"rows": writer.rows, "total_rows": len(ids), "dim": writer.dim}
+
+
+def _read_manifest(tar):
+    manifest = json.load(tar.extractfile("manifest.json"))
+    if manifest.get("format", 0) > FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot format {manifest['format']} is newer than this code ({FORMAT_VERSION})")
+    return manifest
+
+
+def _read_base(path):
+    """Manifest of a base snapshot, plus the chunk ids at its cut for Chroma collections"""
+    with tarfile.open(path, "r:gz") as tar:
+        manifest = _read_manifest(tar)
+        ids = {}
+        if manifest["store"] == "chroma":
+            for name in manifest["collections"]:
+                ids[name] = set(tar.extractfile(f"{name}/ids.txt").read().decode("utf-8").split("\n")) - {""}
+    return manifest, ids
+
+
+def export_snapshot(output=None, base=None, collections=None):
+    """
+    Write a snapshot of the vector collections
+
+    Args:
+        output: Artifact path (default: VECTOR_SNAPSHOT['directory']/<snapshot id>.tar.gz)
+        base: Earlier snapshot to export a delta against (only chunks added since)
+        collections: Collection names (default: VECTOR_DB's and the FAQ index)
+
+    Returns:
+        (artifact path, manifest)
+    """
+    kind = store_kind()
+    base_manifest, base_ids = _read_base(base) if base else (None, {})
+    if base_manifest and base_manifest["store"] != kind:
+        raise SnapshotError(f"Base snapshot is a {base_manifest['store']} store, this node uses {kind}")
+
+    snapshot_id = f"{datetime.now():%Y%m%d_%H%M%S}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(VECTOR_SNAPSHOT['directory'], exist_ok=True)
+    output = output or os.path.join(VECTOR_SNAPSHOT['directory'], f"{snapshot_id}.tar.gz")
+    manifest = {
+        "format": FORMAT_VERSION,
+        "snapshot_id": snapshot_id,
+        "base": base_manifest["snapshot_id"] if base_manifest else None,
+        "created": datetime.now().isoformat(),
+        "store": kind,
+        "embedding_model": MODELS['embeddings']['model_name'],
+        "collections": {},
+    }
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=VECTOR_SNAPSHOT['directory']) as staging:
+        staging = Path(staging)
+        for name in collections or default_collections():
+            directory = staging / name
+            if kind == "compact":
+                base_info = base_manifest["collections"].get(name) if base_manifest else None
+                info = _export_compact(name, directory, base_info)
+            else:
+                info = _export_chroma(name, directory, base_ids.get(name, set()) if base_manifest else None)
+            if info is None:
+                continue
+            info["files"] = {path.name: _sha256(path) for path in sorted(directory.iterdir())}
+            manifest["collections"][name] = info
+
+        (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+        partial = output + ".partial"
+        with tarfile.open(partial, "w:gz", compresslevel=VECTOR_SNAPSHOT['compresslevel']) as tar:
+            tar.add(staging / "manifest.json", arcname="manifest.json")
+            for name, info in manifest["collections"].items():
+                for filename in info["files"]:
+                    tar.add(staging / name / filename, arcname=f"{name}/{filename}")
+        os.replace(partial, output)
+
+    rows = sum(info["rows"] for info in manifest["collections"].values())
+    logger.info(
+        f"📸 {'Delta' if base_manifest else 'Snapshot'} {snapshot_id}: {rows} chunks, "
+        f"{os.path.getsize(output) / 1024 / 1024:.1f} MB in {time.perf_counter() - start:.1f}s -> {output}"
+    )
+    return output, manifest
+
+
+def _read_state():
+    path = Path(VECTOR_DB['persist_directory']) / STATE_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _write_state(manifest):
+    state = {
+        "snapshot_id": manifest["snapshot_id"],
+        "applied": datetime.now().isoformat(),
+        "collections": {name: info["total_rows"] for name, info in manifest["collections"].items()},
+    }
+    (Path(VECTOR_DB['persist_directory']) / STATE_FILE).write_text(json.dumps(state, indent=2))
+
+
+def _existing_rows(name):
+    if store_kind() == "compact":
+        return _compact_rows(_compact_directory(name))[0]
+    return _chroma(name)._collection.count()
+
+
+def _check_importable(manifest, replace):
+    """Refuse before anything is written: wrong embedding model, wrong base or non-empty targets"""
+    if manifest["embedding_model"] != MODELS['embeddings']['model_name']:
+        raise SnapshotError(
+            f"Snapshot vectors come from {manifest['embedding_model']}, "
+            f"this node embeds queries with {MODELS['embeddings']['model_name']}"
+        )
+    if manifest["base"]:
+        current = _read_state().get("snapshot_id")
+        if current != manifest["base"]:
+            raise SnapshotError(
+                f"Delta {manifest['snapshot_id']} applies on top of {manifest['base']}, "
+                f"but this node has {current or 'no snapshot'}"
+            )
+
+    for name, info in manifest["collections"].items():
+        rows = _existing_rows(name)
+        if not manifest["base"] and rows and not replace:
+            raise SnapshotError(f"{name} already holds {rows} chunks; pass replace to overwrite it")
+        if manifest["base"] and store_kind() == "compact" and "start_row" in info and rows != info["start_row"]:
+            raise SnapshotError(f"{name} has {rows} rows, the delta starts at row {info['start_row']}")
+
+
+def _blocks(directory, info):
+    """(chunks, vectors) of a snapshot collection, BLOCK_ROWS at a time; vectors are memory-mapped"""
+    import numpy as np
+
+    if not info["rows"]:
+        return
+    vectors = np.memmap(directory / "vectors.f32", dtype=np.float32, mode="r", shape=(info["rows"], info["dim"]))
+    start = 0
+    block = []
+    with open(directory / "chunks.jsonl", encoding="utf-8") as f:
+        for line in f:
+            block.append(json.loads(line))
+            if len(block) == BLOCK_ROWS:
+                yield block, vectors[start:start + len(block)]
+                start += len(block)
+                block = []
+    if block:
+        yield block, vectors[start:start + len(block)]
+
+
+def _import_compact(name, info, directory, staging, full):
+    from utils.vector_store import CompactVectorStore
+
+    if full:
+        # Built next to the live store and swapped in when complete
+        build = staging / "build"
+        built = _compact_directory(name, build)
+        built.mkdir(parents=True)
+        if "settings" in info:
+            (built / "meta.json").write_text(json.dumps({"dim": info["dim"], **info["settings"]}))
+            if (directory / "codec.npz").exists():
+                (built / "codec.npz").write_bytes((directory / "codec.npz").read_bytes())
+        store = CompactVectorStore(build, name, None)
+    else:
+        store = CompactVectorStore(VECTOR_DB['persist_directory'], name, None)
+
+    for chunks, vectors in _blocks(directory, info):
+        store.add_vectors([c["text"] for c in chunks], vectors, [c["metadata"] for c in chunks])
+    store._db.close()
+
+    if full:
+        target = _compact_directory(name)
+        if target.exists():
+            os.replace(target, staging / f"replaced-{name}.compact")  # Deleted with staging
+        os.replace(built, target)
+
+
+def _import_chroma(name, info, directory, full):
+    store = _chroma(name)
+    if full and store._collection.count():
+        store.delete_collection()
+        store = _chroma(name)
+
+    for chunks, vectors in _blocks(directory, info):
+        for offset in range(0, len(chunks), CHROMA_BATCH):
+            part = chunks[offset:offset + CHROMA_BATCH]
+            store._collection.upsert(
+                ids=[str(c["id"]) for c in part],
+                embeddings=vectors[offset:offset + len(part)].tolist(),
+                documents=[c["text"] for c in part],
+                metadatas=[c["metadata"] for c in part],
+            )
+
+
+def import_snapshot(path, replace=False):
+    """
+    Load a snapshot artifact into this node's vector store
+
+    A full snapshot fills empty collections (with replace, it replaces
+    existing ones); a delta is applied only if the last snapshot imported here
+    is its base. Workers already serving should be restarted after a full
+    import with replace; deltas are appended like ingestion and are picked up
+    on the next search.
+
+    Returns:
+        The snapshot manifest
+    """
+    persist = Path(VECTOR_DB['persist_directory'])
+    persist.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=persist) as staging, tarfile.open(path, "r:gz") as tar:
+        staging = Path(staging)
+        manifest = _read_manifest(tar)
+        _check_importable(manifest, replace)
+
+        expected = {
+            f"{name}/{filename}": digest
+            for name, info in manifest["collections"].items()
+            for filename, digest in info["files"].items()
+        }
+        for member in tar:
+            if member.name in expected:
+                tar.extract(member, staging, filter="data")
+        for member, digest in expected.items():
+            if not (staging / member).exists() or _sha256(staging / member) != digest:
+                raise SnapshotError(f"{member} is missing or corrupt in {path}")
+
+        for name, info in manifest["collections"].items():
+            full = manifest["base"] is None
+            if store_kind() == "compact":
+                _import_compact(name, info, staging / name, staging, full)
+            else:
+                _import_chroma(name, info, staging / name, full)
+
+    _write_state(manifest)
+    rows = sum(info["rows"] for info in manifest["collections"].values())
+    logger.info(
+        f"✅ Imported {'delta' if manifest['base'] else 'snapshot'} {manifest['snapshot_id']}: "
+        f"{rows} chunks in {time.perf_counter() - start:.1f}s"
+    )
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import vector index snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write a snapshot (or a delta with --base)")
+    export.add_argument("--base", help="Earlier snapshot; only chunks added since are written")
+    export.add_argument("--output", help="Artifact path (default: VECTOR_SNAPSHOT_DIR/<id>.tar.gz)")
+    export.add_argument("--collections", nargs="+", help="Collections to include (default: chunks and FAQ index)")
+    load = commands.add_parser("import", help="Load a snapshot or apply a delta")
+    load.add_argument("artifact", help="Snapshot .tar.gz")
+    load.add_argument("--replace", action="store_true", help="Overwrite non-empty collections with a full snapshot")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            export_snapshot(args.output, args.base, args.collections)
+        else:
+            import_snapshot(args.artifact, replace=args.replace)
+    except SnapshotError as e:
+        logger.error(f"❌ {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
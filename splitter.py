@@ -0,0 +1,162 @@
+"""
+Streaming, token-aware text splitter for PDF ingestion
+
+Consumes (page_number, text) pairs from a page generator and yields chunks as
+soon as they are full, so memory stays bounded by one page plus one chunk no
+matter how long the manual is. Chunks are sized in embedding-model tokens and
+never exceed the model's max sequence length, so nothing is silently
+truncated when they are embedded.
+"""
+import logging
+import re
+from config import MODELS, TEXT_SPLITTER, FAKE_MODELS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TokenizerCounter:
+    """Token counts and offsets from the embedding model's (fast) tokenizer"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.special_tokens = tokenizer.num_special_tokens_to_add()
+
+    def count(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def spans(self, text):
+        """(start, end) character offsets of each token"""
+        return self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+
+
+class WordCounter:
+    """One token per word or punctuation mark (stub models / no tokenizer available)"""
+
+    special_tokens = 0
+    _token_re = re.compile(r"\w+|[^\w\s]")
+
+    def count(self, text):
+        return len(self._token_re.findall(text))
+
+    def spans(self, text):
+        return [m.span() for m in self._token_re.finditer(text)]
+
+
+_counter = None
+
+def get_token_counter():
+    """Token counter for the configured embedding model (tokenizer only, no weights)"""
+    global _counter
+    if _counter is None:
+        if FAKE_MODELS['enabled']:
+            _counter = WordCounter()
+        else:
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(
+                    MODELS['embeddings'].get('model_path') or MODELS['embeddings']['model_name']
+                )
+                _counter = TokenizerCounter(tokenizer)
+            except Exception as e:
+                logger.warning(f"Embedding tokenizer unavailable ({e}), counting words instead")
+                _counter = WordCounter()
+    return _counter
+
+
+class StreamingTokenSplitter:
+    """
+    Split a stream of pages into chunks of at most `chunk_tokens` embedding tokens
+
+    Text is split on the coarsest separator that makes pieces fit (paragraphs,
+    then lines, then words), then packed greedily into chunks that overlap by
+    up to `overlap_tokens`. A chunk may span pages; its metadata records the
+    first and last page it came from.
+    """
+
+    def __init__(self, counter=None, chunk_tokens=None, overlap_tokens=None, separators=None):
+        self.counter = counter or get_token_counter()
+        limit = MODELS['embeddings']['max_seq_length'] - self.counter.special_tokens
+        self.chunk_tokens = min(chunk_tokens or TEXT_SPLITTER['chunk_tokens'] or limit, limit)
+        self.overlap_tokens = TEXT_SPLITTER['chunk_overlap_tokens'] if overlap_tokens is None else overlap_tokens
+        self.separators = separators or TEXT_SPLITTER['separators']
+
+    def split_pages(self, pages):
+        """
+        Yield chunks from an iterable of (page_number, text)
+
+        Yields:
+            Dicts with text, tokens, page_start and page_end
+        """
+        window = []  # [segment, tokens, page_number]
+        emitted = 0  # Leading segments of window already sent (the overlap)
+
+        for page_number, text in pages:
+            if not text.strip():
+                continue
+            for segment, tokens in self._segments(text.strip() + "\n\n", self.separators):
+                while window and sum(w[1] for w in window) + tokens > self.chunk_tokens:
+                    if emitted < len(window):
+                        chunk, end = self._chunk(window, emitted)
+                        yield chunk
+                        window, emitted = self._keep_overlap(window, end)
+                    else:
+                        # Only overlap left and the next segment does not fit beside it
+                        window.pop(0)
+                        emitted -= 1
+                window.append([segment, tokens, page_number])
+
+        while emitted < len(window):
+            chunk, end = self._chunk(window, emitted)
+            yield chunk
+            window, emitted = self._keep_overlap(window, end)
+
+    def split_text(self, text):
+        """Split a single string (no page numbers)"""
+        return [chunk["text"] for chunk in self.split_pages([(None, text)])]
+
+    def _chunk(self, window, emitted):
+        """Longest prefix of window (with at least one new segment) that fits the token budget"""
+        end = len(window)
+        while True:
+            text = "".join(w[0] for w in window[:end]).strip()
+            # Segment counts add up for whitespace separators; verify the joined text anyway
+            tokens = self.counter.count(text)
+            if tokens <= self.chunk_tokens or end == emitted + 1:
+                break
+            end -= 1
+        pages = [w[2] for w in window[:end]]
+        return {"text": text, "tokens": tokens, "page_start": pages[0], "page_end": pages[-1]}, end
+
+    def _keep_overlap(self, window, end):
+        """Drop sent segments except a tail of at most overlap_tokens"""
+        keep = end
+        tail = 0
+        while keep > 0 and tail + window[keep - 1][1] <= self.overlap_tokens:
+            keep -= 1
+            tail += window[keep][1]
+        return window[keep:], end - keep
+
+    def _segments(self, text, separators):
+        """Yield (piece, tokens) with every piece at most chunk_tokens long"""
+        tokens = self.counter.count(text)
+        if tokens <= self.chunk_tokens:
+            if text.strip():
+                yield text, tokens
+            return
+
+        for i, separator in enumerate(separators):
+            if separator and separator in text:
+                parts = text.split(separator)
+                for j, part in enumerate(parts):
+                    piece = part + separator if j < len(parts) - 1 else part
+                    yield from self._segments(piece, separators[i + 1:])
+                return
+
+        # No separator left (e.g. one very long "word"): cut at token boundaries
+        spans = self.counter.spans(text)
+        cuts = [0] + [spans[k][0] for k in range(self.chunk_tokens, len(spans), self.chunk_tokens)] + [len(text)]
+        for start, end in zip(cuts, cuts[1:]):
+            piece = text[start:end]
+            if piece.strip():
+                yield piece, self.counter.count(piece)
\ No newline at end of file
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Startup benchmark for web workers
+Runs `python -X importtime` on the app module in a fresh interpreter and
+reports where import time goes, so slow worker respawns can be caught early.
+
+Usage:
+    python startup_benchmark.py                  # profile `import app`
+    python startup_benchmark.py --module nodes   # profile another module
+    python startup_benchmark.py --output startup_report.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# Modules that must only be imported lazily (on first model use)
+HEAVY_MODULES = [
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "langchain.llms",
+    "langchain.embeddings",
+    "langchain.vectorstores",
+    "chromadb",
+    "fitz",
+    "pdf2image",
+]
+
+def print_section(title):
+    """Print a formatted section header"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+def run_importtime(module):
+    """Import `module` in a fresh interpreter with -X importtime enabled"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    wall_time = time.perf_counter() - start
+    return proc, wall_time
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output lines of the form:
+        import time: self [us] | cumulative | imported package
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0].strip())
+            cumulative_us = int(fields[1].strip())
+        except ValueError:
+            continue  # header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append({
+            "module": name.strip(),
+            "self_us": self_us,
+            "cumulative_us": cumulative_us,
+            "depth": depth
+        })
+    return entries
+
+def build_report(module, entries, wall_time, returncode, top=20):
+    """Summarize parsed import timings"""
+    top_level = [e for e in entries if e["depth"] == 0]
+    imported = {e["module"] for e in entries}
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+
+    return {
+        "module": module,
+        "returncode": returncode,
+        "wall_time_s": round(wall_time, 3),
+        "total_import_us": sum(e["cumulative_us"] for e in top_level),
+        "modules_imported": len(entries),
+        "heavy_modules_imported": heavy,
+        "top_cumulative": sorted(top_level, key=lambda e: e["cumulative_us"], reverse=True)[:top],
+        "top_self": sorted(entries, key=lambda e: e["self_us"], reverse=True)[:top],
+    }
+
+def print_report(report):
+    """Print the import-time report"""
+    print_section(f"⏱️  Import Profile: import {report['module']}")
+    print(f"Wall time:          {report['wall_time_s']:.3f}s")
+    print(f"Total import time:  {report['total_import_us'] / 1e6:.3f}s")
+    print(f"Modules imported:   {report['modules_imported']}")
+
+    print("\nTop imports by cumulative time:")
+    for e in report["top_cumulative"]:
+        print(f"  {e['cumulative_us'] / 1000:10.1f} ms  {e['module']}")
+
+    print("\nTop imports by self time:")
+    for e in report["top_self"]:
+        print(f"  {e['self_us'] / 1000:10.1f} ms  {e['module']}")
+
+    if report["heavy_modules_imported"]:
+        print("\n❌ Heavy modules imported at startup:")
+        for m in report["heavy_modules_imported"]:
+            print(f"  - {m}")
+    else:
+        print("\n✅ No heavy model libraries imported at startup")
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile web-worker import time")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--top", type=int, default=20, help="Number of entries to show")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    proc, wall_time = run_importtime(args.module)
+    entries = parse_importtime(proc.stderr)
+    report = build_report(args.module, entries, wall_time, proc.returncode, top=args.top)
+
+    print_report(report)
+
+    if proc.returncode != 0:
+        print(f"\n❌ import {args.module} failed:")
+        print("\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:")))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Report written to {args.output}")
+
+    # Non-zero exit when startup regresses to eager heavy imports
+    if proc.returncode != 0 or report["heavy_modules_imported"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""
+Deterministic stub models for benchmarks and load tests
+
+StubModelManager is a drop-in LocalModelManager that needs no downloads,
+no GPU and no torch: embeddings are feature-hashed bag-of-words vectors and
+generation echoes a fixed answer. Optional per-token latencies let load tests
+approximate real model timings.
+"""
+import re
+import time
+import zlib
+from utils.model_loader import LocalModelManager, get_generation_profile, truncate_at_stop
+from utils.metrics import CACHE_HITS, CACHE_MISSES, SESSION_REUSED_TOKENS
+
+EMBEDDING_DIM = 384  # Same as all-MiniLM-L6-v2
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def count_tokens(text):
+    """Rough token count (word pieces), good enough for stub accounting"""
+    return len(_TOKEN_RE.findall(text))
+
+
+class StubEmbeddings:
+    """Feature-hashed bag-of-words embeddings, L2-normalized"""
+
+    def __init__(self, dim=EMBEDDING_DIM, latency_per_text=0.0):
+        self.dim = dim
+        self.latency_per_text = latency_per_text
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for token in _TOKEN_RE.findall(text.lower()):
+            h = zlib.crc32(token.encode())
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        if self.latency_per_text:
+            time.sleep(self.latency_per_text * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class StubLLM:
+    """Callable stand-in for the HuggingFacePipeline wrapper"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def __call__(self, prompt):
+        return self.manager._complete(prompt, get_generation_profile())["text"]
+
+
+class StubModelManager(LocalModelManager):
+    """
+    LocalModelManager with deterministic stub models
+
+    Args:
+        prefill_latency: seconds per prompt token
+        decode_latency: seconds per generated token
+        embed_latency: seconds per embedded text
+    """
+
+    ANSWER = (
+        "Based on the product documentation, please follow the steps described "
+        "in the manual. If the problem persists, contact support."
+    )
+
+    def __init__(self, prefill_latency=0.0, decode_latency=0.0, embed_latency=0.0):
+        super().__init__()
+        self.prefill_latency = prefill_latency
+        self.decode_latency = decode_latency
+        self.embed_latency = embed_latency
+
+    def load_llm(self):
+        if self.llm is None:
+            self.llm = StubLLM(self)
+        return self.llm
+
+    def load_embeddings(self):
+        if self.embeddings is None:
+            self.embeddings = StubEmbeddings(latency_per_text=self.embed_latency)
+        return self.embeddings
+
+    def load_ocr_model(self):
+        # No OCR model: PDFProcessor falls back to PyMuPDF
+        return None
+
+    def _complete(self, formatted_prompt, settings, sleep=True):
+        prompt_tokens = count_tokens(formatted_prompt)
+        words = self.ANSWER.split()[:settings["max_new_tokens"]]
+        text, stopped = truncate_at_stop(" ".join(words), self.stop_sequences(settings))
+        completion_tokens = count_tokens(text)
+        if sleep and (self.prefill_latency or self.decode_latency):
+            time.sleep(prompt_tokens * self.prefill_latency + completion_tokens * self.decode_latency)
+        return {
+            "text": text,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "stopped": stopped,
+            # Varies with the prompt so cascade load tests see a mix of escalations
+            "mean_logprob": -(zlib.crc32(formatted_prompt.encode()) % 100) / 50,
+        }
+
+    def generate_with_stats(self, prompt, system_prompt=None, profile="default"):
+        result = self._complete(self.format_prompt(prompt, system_prompt), get_generation_profile(profile))
+        result["profile"] = profile
+        return result
+
+    def generate_batch(self, prompts, system_prompt=None, profile="default"):
+        # A batched decode step costs about as much as a single one
+        settings = get_generation_profile(profile)
+        results = [self._complete(self.format_prompt(p, system_prompt), settings, sleep=False) for p in prompts]
+        if results and (self.prefill_latency or self.decode_latency):
+            time.sleep(
+                sum(r["prompt_tokens"] for r in results) * self.prefill_latency
+                + max(r["completion_tokens"] for r in results) * self.decode_latency
+            )
+        for result in results:
+            result["profile"] = profile
+        return results
+
+    def generate_in_session(self, session_id, turn, prompt, system_prompt=None, history=None, profile="default"):
+        # Same cache bookkeeping as the real model, counting tokens instead of holding tensors:
+        # prefill is only paid for the part of the transcript that is not cached
+        settings = get_generation_profile(profile)
+        entry = self.session_cache.take(session_id)
+        if entry is not None and entry["turn"] == turn:
+            entry["tokens"] = entry["turn_start"]
+        elif entry is not None and entry["turn"] != turn - 1:
+            entry = None
+
+        if entry is not None:
+            CACHE_HITS.inc(cache="session_kv")
+            turn_start = reused = entry["tokens"]
+        else:
+            CACHE_MISSES.inc(cache="session_kv")
+            turn_start = count_tokens(self.format_session(system_prompt, history or []))
+            reused = 0
+        prompt_tokens = turn_start + count_tokens(self.format_turn(prompt))
+
+        result = self._complete(self.format_turn(prompt), settings, sleep=False)
+        if self.prefill_latency or self.decode_latency:
+            time.sleep((prompt_tokens - reused) * self.prefill_latency + result["completion_tokens"] * self.decode_latency)
+        self.session_cache.put(session_id, {
+            "tokens": prompt_tokens + result["completion_tokens"],
+            "turn": turn,
+            "turn_start": turn_start,
+            "bytes": 0,
+        })
+        SESSION_REUSED_TOKENS.observe(reused)
+        result.update(profile=profile, prompt_tokens=prompt_tokens, reused_tokens=reused)
+        return result
+
+    def score_continuations_batch(self, prompts, candidates, system_prompt=None):
+        # One "forward pass": earlier candidates score higher, so the first label wins
+        if self.prefill_latency:
+            time.sleep(sum(count_tokens(self.format_prompt(p, system_prompt)) for p in prompts) * self.prefill_latency)
+        return [{candidate: -float(i) for i, candidate in enumerate(candidates)} for _ in prompts]
\ No newline at end of file
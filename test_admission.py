@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Admission control checks (no models needed)
+
+Exercises AdmissionController with a single run slot: coroutines cancelled
+while queued (a client disconnecting from the ASGI app) must leave their
+lane without holding a slot, and threads and coroutines must share the
+same slots.
+
+Usage:
+    python test_admission.py
+"""
+
+import asyncio
+import sys
+import threading
+import time
+
+from utils.admission import AdmissionController, AdmissionRejected
+
+LANES = {
+    "interactive": {"priority": 0, "max_concurrent": 1, "max_queue": 8, "max_wait": 2.0},
+    "heavy": {"priority": 1, "max_concurrent": 1, "max_queue": 8, "max_wait": 2.0},
+}
+
+def print_section(title):
+    """Print a formatted section header"""
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+def idle(controller):
+    """True when no lane has anything queued or running"""
+    return all(lane["queued"] == 0 and lane["running"] == 0 for lane in controller.snapshot().values())
+
+def test_cancel_while_queued():
+    """A cancelled waiter leaves its queue and the next request still gets the slot"""
+    controller = AdmissionController(1, LANES)
+
+    async def scenario():
+        holder = await controller.acquire_async("interactive")
+        waiter = asyncio.create_task(controller.acquire_async("interactive"))
+        await asyncio.sleep(0.05)
+        assert controller.snapshot()["interactive"]["queued"] == 1
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        controller.release("interactive", holder)
+        assert idle(controller), controller.snapshot()
+
+        admitted = await asyncio.wait_for(controller.acquire_async("interactive"), 1.0)
+        controller.release("interactive", admitted)
+        assert idle(controller), controller.snapshot()
+
+    asyncio.run(scenario())
+
+def test_cancel_while_slot_frees():
+    """Cancelling exactly as the slot is released does not leak it"""
+    controller = AdmissionController(1, LANES)
+
+    async def scenario():
+        for _ in range(50):
+            holder = await controller.acquire_async("heavy")
+            waiter = asyncio.create_task(controller.acquire_async("heavy"))
+            await asyncio.sleep(0)
+            controller.release("heavy", holder)
+            waiter.cancel()
+            try:
+                controller.release("heavy", await waiter)  # Admitted before the cancel landed
+            except asyncio.CancelledError:
+                pass
+            assert idle(controller), controller.snapshot()
+
+    asyncio.run(scenario())
+
+def test_timeout_while_queued():
+    """A coroutine that waits past max_wait is rejected with 503 and leaves the queue"""
+    lanes = {"interactive": dict(LANES["interactive"], max_wait=0.1)}
+    controller = AdmissionController(1, lanes)
+
+    async def scenario():
+        holder = await controller.acquire_async("interactive")
+        try:
+            await controller.acquire_async("interactive")
+            raise AssertionError("expected AdmissionRejected")
+        except AdmissionRejected as e:
+            assert e.status == 503 and e.reason == "timeout"
+        controller.release("interactive", holder)
+        assert idle(controller), controller.snapshot()
+
+    asyncio.run(scenario())
+
+def test_threads_and_coroutines_share_slots():
+    """A coroutine queued behind a thread is admitted when the thread releases"""
+    controller = AdmissionController(1, LANES)
+    held = threading.Event()
+    release = threading.Event()
+
+    def thread_request():
+        with controller.admit("heavy"):
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=thread_request)
+    thread.start()
+    held.wait()
+
+    async def scenario():
+        waiter = asyncio.create_task(controller.acquire_async("interactive"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        started = time.monotonic()
+        release.set()
+        admitted = await asyncio.wait_for(waiter, 1.0)
+        assert time.monotonic() - started < 0.5
+        controller.release("interactive", admitted)
+
+    asyncio.run(scenario())
+    thread.join()
+    assert idle(controller), controller.snapshot()
+
+def main():
+    print_section("🚦 Admission Control Tests")
+    tests = [
+        test_cancel_while_queued,
+        test_cancel_while_slot_frees,
+        test_timeout_while_queued,
+        test_threads_and_coroutines_share_slots,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ PASS - {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ FAIL - {test.__name__}: {e!r}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -216,7 +216,11 @@ def test_langgraph():
             "accuracy": False,
             "email": "",
             "audio_file": None,
-            "confidence_score": 0.0
+            "confidence_score": 0.0,
+            "tokens_generated": {},
+            "request_id": "test-models",
+            "retry_count": 0,
+            "node_timings": {}
         }
         
         print("Running workflow...")
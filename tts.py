@@ -0,0 +1,267 @@
+"""
+Text-to-speech for voice answers
+
+synthesize() renders text with the offline engine in TTS_CONFIG. With
+mode_output "voice" the whole answer is rendered before /ask returns, so
+nothing can play until the last word is synthesized. With "voice_stream"
+the answer goes through a SpeechStream instead: it is cut into sentences
+and each one is synthesized on a background worker as soon as it is
+complete, written next to the others under the audio folder:
+
+    <stream_id>_<n>.wav   sentence n (renamed into place once fully written)
+    <stream_id>.done      JSON summary, written after the last sentence
+
+/audio_stream/<stream_id>/<n> waits for sentence n, so a client can start
+playing the first sentence while later ones are still being synthesized.
+State lives on disk, so any web worker can serve any stream. Workers take
+sentences by position, so the first sentence of every stream is
+synthesized before later sentences of earlier streams.
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import wave
+from config import TTS_CONFIG, APP_CONFIG, FAKE_MODELS
+from utils.metrics import TTS_FIRST_AUDIO, TTS_SYNTHESIS_LATENCY
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_STREAM_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def split_sentences(text, min_chars=None):
+    """
+    Split text into speakable segments at sentence ends and line breaks
+
+    Fragments shorter than min_chars (list numbers, "Yes.") are merged into
+    the following sentence so each segment is worth a synthesis call.
+    """
+    min_chars = TTS_CONFIG['min_segment_chars'] if min_chars is None else min_chars
+    segments = []
+    current = ""
+    for piece in _SENTENCE_END.split(text.strip()):
+        current = f"{current} {piece.strip()}".strip()
+        if len(current) >= min_chars:
+            segments.append(current)
+            current = ""
+    if current:
+        segments.append(current)
+    return segments
+
+
+def _write_silence(text, path):
+    """Fake synthesis for FAKE_MODELS: a silent WAV about as long as the speech would be"""
+    time.sleep(FAKE_MODELS['tts_latency'] * len(text))
+    rate = 16000
+    seconds = len(text) / 15  # Roughly 150 words per minute
+    with wave.open(path, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(rate)
+        audio.writeframes(b"\x00\x00" * int(rate * seconds))
+
+
+def synthesize(text, path, mode="voice"):
+    """Render text to an audio file at path (written under a temporary name, then renamed)"""
+    root, ext = os.path.splitext(path)
+    partial = f"{root}.partial{ext}"
+    start = time.perf_counter()
+    if FAKE_MODELS['enabled']:
+        _write_silence(text, partial)
+    else:
+        import pyttsx3
+
+        engine = pyttsx3.init()
+        engine.setProperty('rate', TTS_CONFIG['rate'])
+        engine.setProperty('volume', TTS_CONFIG['volume'])
+        engine.save_to_file(text, partial)
+        engine.runAndWait()
+    os.replace(partial, path)
+    TTS_SYNTHESIS_LATENCY.observe(time.perf_counter() - start, mode=mode)
+
+
+def _check_stream_id(stream_id):
+    if not _STREAM_ID.match(stream_id):
+        raise ValueError(f"Invalid audio stream id: {stream_id!r}")
+
+
+def segment_path(stream_id, index):
+    _check_stream_id(stream_id)
+    return os.path.join(APP_CONFIG['audio_folder'], f"{stream_id}_{index}.wav")
+
+
+def _done_path(stream_id):
+    return os.path.join(APP_CONFIG['audio_folder'], f"{stream_id}.done")
+
+
+def stream_status(stream_id):
+    """Sentences ready so far and, once the stream is finished, the total"""
+    _check_stream_id(stream_id)
+    summary = None
+    if os.path.exists(_done_path(stream_id)):
+        with open(_done_path(stream_id)) as f:
+            summary = json.load(f)
+    ready = 0
+    while os.path.exists(segment_path(stream_id, ready)):
+        ready += 1
+    return {
+        "stream_id": stream_id,
+        "ready": ready,
+        "done": summary is not None,
+        "segments": summary["segments"] if summary else None,
+        "time_to_first_audio_s": summary["time_to_first_audio_s"] if summary else None,
+    }
+
+
+def segment_state(stream_id, index):
+    """"ready", "pending" (not synthesized yet) or "missing" (the stream ended before it)"""
+    if os.path.exists(segment_path(stream_id, index)):
+        return "ready"
+    # The summary is written after the last sentence, so check it second
+    if os.path.exists(_done_path(stream_id)):
+        with open(_done_path(stream_id)) as f:
+            if index >= json.load(f)["segments"]:
+                return "missing"
+        return "ready"
+    return "pending"
+
+
+def wait_for_segment(stream_id, index, timeout=None):
+    """
+    Path of sentence index of a stream, waiting until it is synthesized
+
+    Returns None if the stream finished with fewer sentences. Raises
+    TimeoutError if the sentence is still pending after timeout seconds.
+    """
+    timeout = TTS_CONFIG['segment_timeout'] if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while True:
+        state = segment_state(stream_id, index)
+        if state != "pending":
+            return segment_path(stream_id, index) if state == "ready" else None
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Audio segment {index} of {stream_id} not ready after {timeout}s")
+        time.sleep(0.02)
+
+
+class SpeechStream:
+    """
+    One answer being spoken sentence by sentence
+
+    feed() accepts text as it becomes available (a whole answer or generated
+    tokens) and queues each sentence once it is complete; close() queues the
+    remainder. The stream's summary is written when its last sentence is done.
+    """
+
+    def __init__(self, pipeline, started_at):
+        self.id = uuid.uuid4().hex
+        self.started_at = started_at
+        self._pipeline = pipeline
+        self._buffer = ""
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._finished = 0
+        self._closed = False
+        self._failed = False
+        self.time_to_first_audio = None
+
+    def feed(self, text):
+        with self._lock:
+            self._buffer += text
+            *complete, self._buffer = _SENTENCE_END.split(self._buffer)
+            # Keep short fragments with the next sentence, as split_sentences does
+            pending = split_sentences(" ".join(complete)) if complete else []
+            if pending and len(pending[-1]) < TTS_CONFIG['min_segment_chars']:
+                self._buffer = f"{pending.pop()} {self._buffer}"
+        for sentence in pending:
+            self._queue(sentence)
+
+    def close(self):
+        with self._lock:
+            remainder, self._buffer = self._buffer, ""
+        for sentence in split_sentences(remainder):
+            self._queue(sentence)
+        with self._lock:
+            self._closed = True
+            finished = self._finished == self._queued
+        if finished:
+            self._write_summary()
+
+    def _queue(self, sentence):
+        with self._lock:
+            index = self._queued
+            self._queued += 1
+        self._pipeline.submit(self, index, sentence)
+
+    def _speak(self, index, sentence):
+        """Synthesize one sentence (called on a pipeline worker)"""
+        if not self._failed:
+            try:
+                synthesize(sentence, segment_path(self.id, index), mode="voice_stream")
+                if index == 0:
+                    self.time_to_first_audio = time.perf_counter() - self.started_at
+                    TTS_FIRST_AUDIO.observe(self.time_to_first_audio, mode="voice_stream")
+            except Exception as e:
+                # Later sentences are dropped so the stream ends where playback would stall
+                logger.error(f"❌ TTS failed for segment {index} of {self.id}: {e}")
+                self._failed = True
+        with self._lock:
+            self._finished += 1
+            finished = self._closed and self._finished == self._queued
+        if finished:
+            self._write_summary()
+
+    def _write_summary(self):
+        segments = 0
+        while os.path.exists(segment_path(self.id, segments)):
+            segments += 1
+        summary = {
+            "segments": segments,
+            "time_to_first_audio_s": round(self.time_to_first_audio, 3) if self.time_to_first_audio else None,
+        }
+        partial = _done_path(self.id) + ".partial"
+        with open(partial, "w") as f:
+            json.dump(summary, f)
+        os.replace(partial, _done_path(self.id))
+        logger.info(f"🔊 Audio stream {self.id}: {segments} segments, first audio after {summary['time_to_first_audio_s']}s")
+
+
+class SpeechPipeline:
+    """Background TTS workers shared by all streams, earliest sentence position first"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def open(self, started_at=None):
+        """New stream; started_at (perf_counter) is when the request began, for time-to-first-audio"""
+        return SpeechStream(self, started_at if started_at is not None else time.perf_counter())
+
+    def submit(self, stream, index, sentence):
+        self._ensure_workers()
+        self._queue.put((index, next(self._order), stream, sentence))
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"tts-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            index, _, stream, sentence = self._queue.get()
+            stream._speak(index, sentence)
+
+
+speech_pipeline = SpeechPipeline(TTS_CONFIG['stream_workers'])
\ No newline at end of file
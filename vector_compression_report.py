@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Recall vs. memory report for compact vector storage (VECTOR_DB['compression'])
+
+Compares float16 / int8 codes, with and without PCA or truncation, against
+exact float32 search: bytes per vector, recall@k of the approximate scan
+alone and after float32 rescoring, and query latency.
+
+By default the vectors are stub (feature-hashed) embeddings of synthetic
+text. They need no downloads, but the synthetic text has a tiny vocabulary,
+so they say little about how real sentence embeddings compress. Use
+--real-embeddings or --from-collection before choosing a setting.
+
+Usage:
+    python vector_compression_report.py
+    python vector_compression_report.py --real-embeddings --vectors 20000
+    python vector_compression_report.py --from-collection --dims 64 128 192 --output compression.json
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from benchmark_components import make_text, print_section
+from config import MODELS, VECTOR_DB
+
+def load_vectors(args):
+    """(corpus vectors, query vectors) as unit-length float32 arrays"""
+    import numpy as np
+
+    if args.from_collection:
+        from langchain.vectorstores import Chroma
+        from utils.model_loader import get_embeddings
+
+        store = Chroma(
+            persist_directory=VECTOR_DB['persist_directory'],
+            embedding_function=get_embeddings(),
+            collection_name=VECTOR_DB['collection_name']
+        )
+        vectors = np.asarray(store._collection.get(include=["embeddings"])["embeddings"], dtype=np.float32)
+        if len(vectors) <= args.queries:
+            raise SystemExit(f"Collection has only {len(vectors)} vectors")
+        # Held-out chunks act as queries
+        rng = np.random.default_rng(0)
+        order = rng.permutation(len(vectors))
+        corpus, queries = vectors[order[args.queries:]], vectors[order[:args.queries]]
+    else:
+        if args.real_embeddings:
+            from utils.model_loader import get_embeddings
+            embeddings = get_embeddings()
+        else:
+            from utils.stub_models import StubEmbeddings
+            embeddings = StubEmbeddings()
+        corpus = np.asarray(
+            embeddings.embed_documents([make_text(400, seed=i) for i in range(args.vectors)]), dtype=np.float32
+        )
+        queries = np.asarray(
+            embeddings.embed_documents([make_text(80, seed=10_000_000 + i) for i in range(args.queries)]),
+            dtype=np.float32
+        )
+
+    def normalize(x):
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+    return normalize(corpus), normalize(queries)
+
+def evaluate(codec, corpus, queries, exact, k, rescore_candidates):
+    """Recall@k of the approximate scan and after rescoring, plus per-query latency"""
+    from utils.vector_store import top_candidates, rescore
+
+    start = time.perf_counter()
+    if codec.needs_fit:
+        codec.fit(corpus)
+    codes = codec.encode(corpus)
+    build_s = time.perf_counter() - start
+
+    def scan(count):
+        return top_candidates(lambda s, e: codec.scores(codes[s:e], queries), len(codes), len(queries), count)
+
+    approx = scan(k)
+    start = time.perf_counter()
+    candidates = scan(max(k, rescore_candidates))
+    rescored = rescore(corpus, candidates, queries, k)
+    query_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    def recall(found):
+        return sum(len(set(map(int, f)) & set(map(int, e))) for f, e in zip(found, exact)) / (k * len(exact))
+
+    return {
+        "bytes_per_vector": codec.bytes_per_vector(corpus.shape[1]),
+        "recall_approx": recall(approx),
+        "recall_rescored": recall([ids for ids, _ in rescored]),
+        "query_ms": query_ms,
+        "build_s": build_s,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs. memory for compact vector storage")
+    parser.add_argument("--vectors", type=int, default=20_000, help="Synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=3, help="Results per query (retriever uses 3)")
+    parser.add_argument("--dims", nargs="+", type=int, default=[64, 128, 192], help="Reduced dimensions to try")
+    parser.add_argument("--rescore-candidates", type=int, default=VECTOR_DB['compression']['rescore_candidates'])
+    parser.add_argument("--real-embeddings", action="store_true", help="Embed the synthetic corpus with the real model")
+    parser.add_argument("--from-collection", action="store_true", help="Use the vectors in the Chroma collection")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    from utils.vector_store import VectorCodec, top_candidates
+
+    print_section("🗜️  Compact vector storage: recall vs. memory")
+    corpus, queries = load_vectors(args)
+    dim = corpus.shape[1]
+    print(f"Corpus: {len(corpus)} x {dim}, {len(queries)} queries, k={args.k}, "
+          f"rescoring top {args.rescore_candidates}")
+
+    start = time.perf_counter()
+    exact = top_candidates(lambda s, e: queries @ corpus[s:e].T, len(corpus), len(queries), args.k)
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    results = {
+        "float32": {
+            "bytes_per_vector": dim * 4, "recall_approx": 1.0, "recall_rescored": 1.0,
+            "query_ms": exact_ms, "build_s": 0.0,
+        }
+    }
+    settings = [("float16", None, None), ("int8", None, None)]
+    for dims in args.dims:
+        if dims < dim:
+            settings += [("int8", "pca", dims), ("float16", "pca", dims), ("int8", "truncate", dims)]
+
+    for mode, reduction, dims in settings:
+        name = mode if reduction is None else f"{mode}+{reduction}{dims}"
+        results[name] = evaluate(
+            VectorCodec(mode, reduction, dims), corpus, queries, exact, args.k, args.rescore_candidates
+        )
+
+    print_section("📊 Results")
+    print(f"{'setting':22} {'bytes/vec':>9} {'x less':>7} {'chunks/GB':>11} {'recall':>8} {'+rescore':>9} {'ms/query':>9}")
+    for name, r in results.items():
+        ratio = dim * 4 / r["bytes_per_vector"]
+        print(f"{name:22} {r['bytes_per_vector']:9} {ratio:6.1f}x {int(2**30 / r['bytes_per_vector']):11,} "
+              f"{r['recall_approx']:8.3f} {r['recall_rescored']:9.3f} {r['query_ms']:9.2f}")
+
+    if not (args.real_embeddings or args.from_collection):
+        print("\n⚠️  Stub embeddings: rerun with --real-embeddings or --from-collection "
+              f"({MODELS['embeddings']['model_name']}) before choosing a setting")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"corpus": len(corpus), "dim": dim, "k": args.k, "results": results}, f, indent=2)
+        print(f"\n📄 Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
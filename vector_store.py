@@ -0,0 +1,491 @@
+"""
+Vector store layer behind VECTOR_DB
+
+get_vectorstore() returns the Chroma collection, or - when
+VECTOR_DB['compression']['mode'] is not "none" - a CompactVectorStore. The
+compact store keeps only compact codes in memory (float16 or 8-bit scalar
+quantized, optionally reduced with PCA or truncated to fewer dimensions).
+The exact float32 vectors stay in a memory-mapped file and are read only to
+rescore the final candidates. Chunk text and metadata live in SQLite.
+
+int8 + PCA to 128 dimensions stores 128 bytes per chunk in memory instead of
+1536 (float32 x 384), i.e. 12x more chunks per worker; see
+vector_compression_report.py for the recall each setting costs.
+"""
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from config import VECTOR_DB
+from utils.metrics import VECTOR_STORE_LATENCY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCORE_BLOCK_ROWS = 65536  # Rows decoded to float32 at a time while scoring
+
+
+class VectorCodec:
+    """
+    Encodes unit-length float32 vectors into compact codes
+
+    mode: "float16" or "int8" (per-dimension 8-bit scalar quantization)
+    reduction: None, "pca" (fitted projection) or "truncate" (keep the first
+        `dims` components, Matryoshka-style; only meaningful for models
+        trained for it)
+    """
+
+    def __init__(self, mode="int8", reduction=None, dims=None):
+        if mode not in ("float16", "int8"):
+            raise ValueError(f"Unknown vector compression mode: {mode}")
+        if reduction not in (None, "pca", "truncate"):
+            raise ValueError(f"Unknown dimension reduction: {reduction}")
+        self.mode = mode
+        self.reduction = reduction
+        self.dims = dims if reduction else None
+        self.mean = None
+        self.components = None
+        self.offset = None
+        self.scale = None
+        self.fitted = not self.needs_fit
+
+    @property
+    def needs_fit(self):
+        return self.reduction == "pca" or self.mode == "int8"
+
+    def fit(self, vectors):
+        """Fit the PCA projection and/or the int8 ranges on a sample of vectors"""
+        import numpy as np
+
+        X = np.asarray(vectors, dtype=np.float32)
+        if self.reduction == "pca":
+            self.mean = X.mean(axis=0)
+            centered = X - self.mean
+            eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered / len(X))
+            order = np.argsort(eigenvalues)[::-1][:self.dims]
+            self.components = np.ascontiguousarray(eigenvectors[:, order], dtype=np.float32)
+
+        if self.mode == "int8":
+            reduced = self.project(X)
+            low = reduced.min(axis=0)
+            high = reduced.max(axis=0)
+            self.offset = low.astype(np.float32)
+            self.scale = np.where(high > low, (high - low) / 255.0, 1.0).astype(np.float32)
+
+        self.fitted = True
+        return self
+
+    def project(self, X, query=False):
+        """Reduce dimensions; queries skip centering so dot products keep their ranking"""
+        import numpy as np
+
+        if self.reduction == "pca":
+            return (X if query else X - self.mean) @ self.components
+        if self.reduction == "truncate":
+            reduced = X[:, :self.dims]
+            return reduced / np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
+        return X
+
+    def encode(self, vectors):
+        import numpy as np
+
+        reduced = self.project(np.asarray(vectors, dtype=np.float32))
+        if self.mode == "float16":
+            return reduced.astype(np.float16)
+        return np.clip(np.rint((reduced - self.offset) / self.scale), 0, 255).astype(np.uint8)
+
+    def scores(self, codes, queries):
+        """Approximate dot products, shape (len(queries), len(codes))"""
+        import numpy as np
+
+        projected = self.project(np.asarray(queries, dtype=np.float32), query=True)
+        decoded = codes.astype(np.float32)
+        if self.mode == "float16":
+            return projected @ decoded.T
+        # (code * scale + offset) . q  ==  code . (scale * q) + offset . q
+        return (projected * self.scale) @ decoded.T + (projected @ self.offset)[:, None]
+
+    @property
+    def code_dtype(self):
+        import numpy as np
+        return np.float16 if self.mode == "float16" else np.uint8
+
+    def bytes_per_vector(self, dim):
+        return (self.dims or dim) * (2 if self.mode == "float16" else 1)
+
+    def save(self, path):
+        import numpy as np
+        arrays = {name: getattr(self, name) for name in ("mean", "components", "offset", "scale")
+                  if getattr(self, name) is not None}
+        np.savez(path, **arrays)
+
+    def load(self, path):
+        import numpy as np
+        with np.load(path) as data:
+            for name in data.files:
+                setattr(self, name, data[name])
+        self.fitted = True
+        return self
+
+
+def top_candidates(score_block, n_rows, n_queries, count):
+    """
+    Indices of the `count` best rows per query, scoring SCORE_BLOCK_ROWS rows at a time
+
+    score_block(start, end) must return scores of shape (n_queries, end - start).
+    """
+    import numpy as np
+
+    count = min(count, n_rows)
+    best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((n_queries, 0), dtype=np.int64)
+    for start in range(0, n_rows, SCORE_BLOCK_ROWS):
+        end = min(start + SCORE_BLOCK_ROWS, n_rows)
+        scores = np.hstack([best_scores, score_block(start, end).astype(np.float32)])
+        ids = np.hstack([best_ids, np.broadcast_to(np.arange(start, end), (n_queries, end - start))])
+        keep = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_ids = np.take_along_axis(ids, keep, axis=1)
+    return best_ids
+
+
+def rescore(vectors, candidate_ids, queries, k):
+    """Exact float32 top-k among each query's candidates; returns [(ids, scores)]"""
+    import numpy as np
+
+    results = []
+    for query, ids in zip(queries, candidate_ids):
+        ids = np.sort(ids)  # Sequential reads from the memory map
+        exact = np.asarray(vectors[ids], dtype=np.float32) @ query
+        order = np.argsort(-exact)[:k]
+        results.append((ids[order], exact[order]))
+    return results
+
+
+class StoredDocument:
+    """Search result with the LangChain Document attributes the nodes use"""
+
+    def __init__(self, page_content, metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+class CompactVectorStore:
+    """
+    Append-only vector store with compact in-memory codes and float32 rescoring
+
+    Files under <persist_directory>/<collection>.compact/:
+        meta.json      dimension and compression settings
+        vectors.f32    exact vectors (memory-mapped, read only for rescoring)
+        codes.bin      compact codes (memory-mapped, scanned on every query)
+        codec.npz      fitted PCA projection / int8 ranges
+        chunks.sqlite  text, metadata and caller-supplied id (key) by row id
+
+    Writers take an exclusive lock on write.lock, append codes before
+    vectors and publish a refit codec only after its codes. Readers never
+    write: they pick up appended rows on their next search, and only search
+    rows present in both files.
+    """
+
+    def __init__(self, persist_directory, collection_name, embedding_function, compression=None):
+        compression = compression or VECTOR_DB['compression']
+        self.embedding_function = embedding_function
+        self.rescore_candidates = compression['rescore_candidates']
+        self.fit_min_samples = compression['fit_min_samples']
+        self.directory = Path(persist_directory) / f"{collection_name}.compact"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+
+        meta_path = self.directory / "meta.json"
+        settings = {
+            "mode": compression['mode'],
+            "reduction": compression['reduction'],
+            "dims": compression['dims'] if compression['reduction'] else None,
+        }
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            stored = {key: meta[key] for key in settings}
+            if stored != settings:
+                logger.warning(f"Compact store was built with {stored}, ignoring configured {settings}")
+            settings = stored
+            self.dim = meta["dim"]
+        else:
+            self.dim = None
+        self.settings = settings
+
+        self.codec = VectorCodec(settings["mode"], settings["reduction"], settings["dims"])
+        if (self.directory / "codec.npz").exists():
+            self.codec.load(self.directory / "codec.npz")
+
+        self._db = sqlite3.connect(str(self.directory / "chunks.sqlite"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, text TEXT, metadata TEXT)")
+        if "key" not in [column[1] for column in self._db.execute("PRAGMA table_info(chunks)")]:
+            self._db.execute("ALTER TABLE chunks ADD COLUMN key TEXT")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS chunks_key ON chunks (key)")
+        self._db.commit()
+
+        self._rows = 0
+        self._encoded = 0
+        self._vectors = None
+        self._codes = None
+        self._refresh()
+
+    # ---------- files ----------
+    def _disk_rows(self):
+        path = self.directory / "vectors.f32"
+        if self.dim is None or not path.exists():
+            return 0
+        return path.stat().st_size // (4 * self.dim)
+
+    def _code_row_bytes(self):
+        import numpy as np
+        return (self.codec.dims or self.dim) * np.dtype(self.codec.code_dtype).itemsize
+
+    def _disk_codes(self):
+        path = self.directory / "codes.bin"
+        return path.stat().st_size // self._code_row_bytes() if path.exists() else 0
+
+    def _refresh(self):
+        """Re-map the files if rows were appended (possibly by another process)"""
+        import numpy as np
+
+        rows = self._disk_rows()
+        if not self.codec.fitted and (self.directory / "codec.npz").exists():
+            self.codec.load(self.directory / "codec.npz")
+        # A writer may be between its codes and vectors appends: use the rows both files have
+        encoded = min(self._disk_codes(), rows) if self.codec.fitted and rows else 0
+        if (rows, encoded) == (self._rows, self._encoded) and self._vectors is not None:
+            return
+        self._rows = rows
+        self._encoded = encoded
+        if rows == 0:
+            return
+        self._vectors = np.memmap(self.directory / "vectors.f32", dtype=np.float32, mode="r", shape=(rows, self.dim))
+        if encoded:
+            # Codes are scanned on every query, so they stay in the (shared) page cache
+            width = self.codec.dims or self.dim
+            self._codes = np.memmap(self.directory / "codes.bin", dtype=self.codec.code_dtype, mode="r", shape=(encoded, width))
+        elif self.codec.fitted:
+            self._codes = np.zeros((0, self.codec.dims or self.dim), dtype=self.codec.code_dtype)
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across processes: appends and refits never interleave"""
+        with open(self.directory / "write.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _repair(self):
+        """Under the write lock: drop partial rows and code rows a crashed writer left behind"""
+        self._refresh()  # Also loads a codec another writer fitted
+        rows = self._rows
+        if (self.directory / "vectors.f32").exists():
+            os.truncate(self.directory / "vectors.f32", rows * 4 * self.dim)
+        if self.codec.fitted:
+            encoded = self._disk_codes()
+            if (self.directory / "codes.bin").exists():
+                os.truncate(self.directory / "codes.bin", min(encoded, rows) * self._code_row_bytes())
+            if encoded < rows:
+                self._append_codes(self._vectors[encoded:rows])
+                self._refresh()
+
+    def _append_codes(self, vectors, path=None):
+        with open(path or self.directory / "codes.bin", "ab") as f:
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                self.codec.encode(vectors[start:start + SCORE_BLOCK_ROWS]).tofile(f)
+
+    def _fit(self):
+        """Fit the codec on the stored vectors and encode all of them"""
+        import numpy as np
+
+        sample = self._vectors
+        if len(sample) > 50_000:
+            rng = np.random.default_rng(0)
+            sample = sample[np.sort(rng.choice(len(sample), 50_000, replace=False))]
+        self.codec.fit(sample)
+        # Readers use codes only once codec.npz exists, so publish the codes first
+        partial = self.directory / "codes.bin.partial"
+        partial.unlink(missing_ok=True)
+        self._append_codes(self._vectors, partial)
+        os.replace(partial, self.directory / "codes.bin")
+        with open(self.directory / "codec.npz.partial", "wb") as f:
+            self.codec.save(f)
+        os.replace(self.directory / "codec.npz.partial", self.directory / "codec.npz")
+        logger.info(f"🗜️  Fitted {self.settings} vector codec on {len(sample)} vectors")
+
+    # ---------- LangChain-style API ----------
+    def add_texts(self, texts, metadatas=None, ids=None):
+        """Embed and append texts; returns their ids"""
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_vectors(texts, self.embedding_function.embed_documents(texts), metadatas, ids)
+
+    def add_vectors(self, texts, vectors, metadatas=None, ids=None):
+        """
+        Append texts with already computed vectors (e.g. from a snapshot); returns their ids
+
+        With ids, texts whose id is already stored are skipped (like Chroma's
+        upsert, so replaying a batch does not duplicate it) and the ids are
+        returned; otherwise the new row numbers are.
+        """
+        import numpy as np
+
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        keys = list(ids) if ids is not None else [None] * len(texts)
+        vectors = np.array(vectors, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        with self._lock, self._write_lock():
+            if self.dim is None and (self.directory / "meta.json").exists():
+                self.dim = json.loads((self.directory / "meta.json").read_text())["dim"]
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                (self.directory / "meta.json").write_text(json.dumps({"dim": self.dim, **self.settings}))
+            self._repair()
+            start = self._rows
+            if ids is not None:
+                # Rows at or past start have no vector yet (a writer stopped mid-append): not stored
+                stored = {row[0] for row in self._db.execute(
+                    f"SELECT key FROM chunks WHERE id < ? AND key IN ({','.join('?' * len(keys))})", [start, *keys]
+                )}
+                new = [i for i, key in enumerate(keys) if key not in stored]
+                if not new:
+                    return [str(key) for key in keys]
+                texts, metadatas, keys = [texts[i] for i in new], [metadatas[i] for i in new], [keys[i] for i in new]
+                vectors = vectors[new]
+            rows = list(range(start, start + len(texts)))
+
+            self._db.executemany(
+                "INSERT OR REPLACE INTO chunks (id, text, metadata, key) VALUES (?, ?, ?, ?)",
+                [(i, text, json.dumps(metadata), key) for i, text, metadata, key in zip(rows, texts, metadatas, keys)]
+            )
+            self._db.commit()
+            if self.codec.fitted:
+                self._append_codes(vectors)
+            with open(self.directory / "vectors.f32", "ab") as f:
+                vectors.tofile(f)
+            self._refresh()
+
+            if not self.codec.fitted and self._rows >= self.fit_min_samples:
+                self._fit()
+                self._refresh()
+
+        return [str(key) for key in ids] if ids is not None else [str(i) for i in rows]
+
+    def search_batch(self, query_vectors, k=4, with_scores=False):
+        """Top-k StoredDocuments per query vector (or (document, cosine similarity) pairs)"""
+        import numpy as np
+
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        with self._lock:
+            self._refresh()
+            rows, vectors, codes = self._rows, self._vectors, self._codes
+        if rows == 0:
+            return [[] for _ in queries]
+
+        if self.codec.fitted:
+            # Approximate scan over the in-memory codes, then exact rescoring from disk
+            candidates = top_candidates(
+                lambda start, end: self.codec.scores(codes[start:end], queries),
+                len(codes), len(queries), max(k, self.rescore_candidates)
+            )
+        else:
+            # Not fitted yet (small collection): exact scan of the float32 vectors
+            candidates = top_candidates(
+                lambda start, end: queries @ np.asarray(vectors[start:end]).T,
+                rows, len(queries), k
+            )
+        ranked = rescore(vectors, candidates, queries, k)
+        if with_scores:
+            return [self._documents(ids, scores) for ids, scores in ranked]
+        return [self._documents(ids) for ids, _ in ranked]
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        return self.search_batch([embedding], k)[0]
+
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def _documents(self, ids, scores=None):
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        by_id = {row[0]: StoredDocument(row[1], json.loads(row[2])) for row in rows}
+        if scores is not None:
+            return [(by_id[i], float(score)) for i, score in zip(ids, scores) if i in by_id]
+        return [by_id[i] for i in ids if i in by_id]
+
+    def memory_bytes(self):
+        """Bytes scanned per query (the codes); float32 vectors are only read for rescoring"""
+        return int(self._codes.nbytes) if self._codes is not None else 0
+
+
+_compact_stores = {}
+_compact_lock = threading.Lock()
+
+def get_vectorstore(embedding_function=None, collection_name=None):
+    """The configured vector store for VECTOR_DB (Chroma, or compact when enabled)"""
+    from utils.model_loader import get_embeddings
+
+    embeddings = embedding_function or get_embeddings()
+    collection_name = collection_name or VECTOR_DB['collection_name']
+    if VECTOR_DB['compression']['mode'] == "none":
+        from langchain.vectorstores import Chroma
+        return Chroma(
+            persist_directory=VECTOR_DB['persist_directory'],
+            embedding_function=embeddings,
+            collection_name=collection_name
+        )
+
+    # Compact stores hold their codes in memory, so keep one per collection
+    key = (VECTOR_DB['persist_directory'], collection_name)
+    with _compact_lock:
+        store = _compact_stores.get(key)
+        if store is None:
+            store = _compact_stores[key] = CompactVectorStore(*key, embeddings)
+    store.embedding_function = embeddings
+    return store
+
+def search_batch(vectorstore, query_vectors, k):
+    """Top-k documents for many query vectors in one call, as {"content", "metadata"} dicts"""
+    with VECTOR_STORE_LATENCY.time(operation="search_batch"):
+        if isinstance(vectorstore, CompactVectorStore):
+            found = vectorstore.search_batch(query_vectors, k)
+            return [[{"content": d.page_content, "metadata": d.metadata} for d in docs] for docs in found]
+
+        # The LangChain Chroma wrapper searches one vector at a time; the collection takes many
+        found = vectorstore._collection.query(
+            query_embeddings=[list(map(float, v)) for v in query_vectors],
+            n_results=k,
+            include=["documents", "metadatas"]
+        )
+    return [
+        [{"content": content, "metadata": metadata or {}} for content, metadata in zip(documents, metadatas)]
+        for documents, metadatas in zip(found["documents"], found["metadatas"])
+    ]
+
+def search_with_similarity(vectorstore, query_vector, k):
+    """Top-k (document, cosine similarity) pairs for one unit-length query vector"""
+    with VECTOR_STORE_LATENCY.time(operation="search"):
+        if isinstance(vectorstore, CompactVectorStore):
+            return vectorstore.search_batch([query_vector], k, with_scores=True)[0]
+        # Chroma reports squared L2 distance; for unit vectors that is 2 - 2 * cosine
+        found = vectorstore.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
+    return [(doc, 1.0 - distance / 2.0) for doc, distance in found]
\ No newline at end of file